@@ -0,0 +1,358 @@
+"""
+Load test for the UCP endpoints
+
+Starts a local server on a synthetic catalog, runs many concurrent agents
+through the examples/python_agent.py flow (discovery -> browse -> checkout
+-> order status), and reports latency percentiles and throughput per
+endpoint.
+
+    python benchmarks/bench.py --agents 32 --duration 30 --products 10000
+    python benchmarks/bench.py --output before.json
+    python benchmarks/bench.py --baseline before.json --max-regression 10
+
+Results are written as JSON with --output. With --baseline, each endpoint
+is compared against a stored run; --max-regression makes the script exit
+non-zero when p95 latency or throughput gets worse by more than that
+percentage. Use --url to measure a server that is already running instead.
+
+Rate limits are switched off for the spawned server (every agent would
+otherwise be throttled to a few checkouts a second); --rate-limits keeps
+them.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'examples'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from python_agent import run_agent  # noqa: E402
+
+# Path patterns -> route label, so /orders/ORD_123 and /orders/ORD_456 are
+# reported together
+ROUTES = [
+    (re.compile(r'^/api/ucp/orders/[^/]+$'), '/api/ucp/orders/<order_id>'),
+    (re.compile(r'^/api/ucp/products/[^/]+/availability$'), '/api/ucp/products/<product_id>/availability'),
+    (re.compile(r'^/api/ucp/products/(?!export$)[^/]+$'), '/api/ucp/products/<product_id>'),
+]
+
+PRODUCT_TYPES = ["digital", "physical", "subscription", "experience", "booking"]
+
+
+# =============================================================================
+# SYNTHETIC CATALOG
+# =============================================================================
+
+def synthetic_catalog(size, seed=0):
+    """The built-in products plus `size` generated ones"""
+    from routes import PRODUCTS
+
+    rng = random.Random(seed)
+    products = [dict(p) for p in PRODUCTS.values()]
+    for n in range(size):
+        kind = rng.choice(PRODUCT_TYPES)
+        products.append({
+            "id": f"bench-{kind}-{n:07d}",
+            "name": f"Benchmark {kind.title()} #{n}",
+            "description": f"Synthetic {kind} product generated for load testing.",
+            "price": 0 if rng.random() < 0.05 else round(rng.uniform(1, 500), 2),
+            "currency": "USD",
+            "type": kind,
+            "in_stock": rng.random() < 0.9,
+            "features": [f"feature-{rng.randrange(50)}" for _ in range(3)],
+        })
+    return products
+
+
+# =============================================================================
+# SERVER
+# =============================================================================
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir):
+    """Spawn the app on a free port; returns (process, base_url)"""
+    catalog_path = os.path.join(workdir, 'catalog.json')
+    with open(catalog_path, 'w') as f:
+        json.dump(synthetic_catalog(args.products, args.seed), f)
+
+    port = _free_port()
+    env = dict(os.environ,
+               UCP_CATALOG_PATH=catalog_path,
+               UCP_ORDER_STORE=args.store,
+               UCP_ORDER_STORE_PATH=os.path.join(workdir, 'orders.db'),
+               UCP_BIND=f'127.0.0.1:{port}',
+               UCP_WORKERS=str(args.workers),
+               UCP_SERVER_MODE=args.server if args.server != 'flask' else 'sync')
+    if not args.rate_limits:
+        env.update(UCP_RATE_CHECKOUT='0', UCP_RATE_TEST='0', UCP_RATE_PRODUCTS='0')
+
+    if args.server == 'flask':
+        command = [sys.executable, '-c',
+                   f"from app import app; app.run(port={port}, threaded=True)"]
+        cwd = os.path.join(ROOT, 'src')
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py']
+        cwd = ROOT
+    process = subprocess.Popen(command, cwd=cwd, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"Server exited with status {process.returncode}")
+        try:
+            requests.get(f'{base_url}/api/ucp/health', timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    sys.exit("Server did not start within 30 seconds")
+
+
+# =============================================================================
+# LOAD
+# =============================================================================
+
+class Recorder:
+    """Latency samples per route label"""
+
+    def __init__(self):
+        self.samples = {}    # label -> [seconds]
+        self.errors = {}     # label -> count of non-2xx responses
+        self.recording = False
+        self._lock = threading.Lock()
+
+    def add(self, label, seconds, status):
+        if not self.recording:
+            return
+        with self._lock:
+            self.samples.setdefault(label, []).append(seconds)
+            if status >= 400:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+
+class TimedSession(requests.Session):
+    """requests.Session that times every call into a Recorder"""
+
+    def __init__(self, recorder, agent_name):
+        super().__init__()
+        self.recorder = recorder
+        self.headers['UCP-Agent'] = agent_name
+
+    def request(self, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        response = super().request(method, url, *args, **kwargs)
+        self.recorder.add(route_label(method, url), time.perf_counter() - started,
+                          response.status_code)
+        return response
+
+
+def route_label(method, url):
+    path = requests.utils.urlparse(url).path
+    for pattern, label in ROUTES:
+        if pattern.match(path):
+            path = label
+            break
+    return f"{method.upper()} {path}"
+
+
+def run_load(base_url, agents, duration, warmup):
+    """Run `agents` threads through the agent flow; returns (recorder, seconds, flows)"""
+    recorder = Recorder()
+    flows = {"completed": 0, "failed": 0}
+    flows_lock = threading.Lock()
+    stop = threading.Event()
+
+    def agent(n):
+        session = TimedSession(recorder, f'bench-agent-{n}')
+        while not stop.is_set():
+            try:
+                run_agent(session, base_url, log=lambda *_: None)
+                outcome = "completed"
+            except (requests.RequestException, KeyError, ValueError):
+                outcome = "failed"
+            if recorder.recording:
+                with flows_lock:
+                    flows[outcome] += 1
+
+    threads = [threading.Thread(target=agent, args=(n,), daemon=True) for n in range(agents)]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    recorder.recording = True
+    started = time.perf_counter()
+    time.sleep(duration)
+    recorder.recording = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return recorder, elapsed, flows
+
+
+# =============================================================================
+# REPORTING
+# =============================================================================
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples, errors, elapsed):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+    }
+
+
+def build_results(args, recorder, elapsed, flows, base_url):
+    endpoints = {
+        label: summarize(samples, recorder.errors.get(label, 0), elapsed)
+        for label, samples in sorted(recorder.samples.items())
+    }
+    everything = [s for samples in recorder.samples.values() for s in samples]
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "url": base_url if args.url else None,
+            "server": None if args.url else args.server,
+            "workers": None if args.url else args.workers,
+            "store": None if args.url else args.store,
+            "catalog_products": None if args.url else args.products,
+            "agents": args.agents,
+            "duration": round(elapsed, 2),
+        },
+        "flows": flows,
+        "total": summarize(everything, sum(recorder.errors.values()), elapsed),
+        "endpoints": endpoints,
+    }
+
+
+def print_results(results):
+    header = f"{'endpoint':<48} {'count':>8} {'err':>5} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8}"
+    print(header)
+    print('-' * len(header))
+    rows = list(results["endpoints"].items()) + [("TOTAL", results["total"])]
+    for label, r in rows:
+        print(f"{label:<48} {r['count']:>8} {r['errors']:>5} {r['rps']:>9} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8}")
+    print(f"\nflows: {results['flows']['completed']} completed, "
+          f"{results['flows']['failed']} failed in {results['meta']['duration']}s (latencies in ms)")
+
+
+def _change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def compare(results, baseline, max_regression=None):
+    """Print per-endpoint changes against a baseline; returns the regressions found"""
+    print(f"\nCompared with baseline from {baseline['meta'].get('timestamp')}:")
+    print(f"{'endpoint':<48} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>9}")
+    regressions = []
+    rows = list(results["endpoints"].items()) + [("TOTAL", results["total"])]
+    for label, new in rows:
+        old = baseline["total"] if label == "TOTAL" else baseline["endpoints"].get(label)
+        if old is None:
+            print(f"{label:<48} {'(new)':>9}")
+            continue
+        changes = {key: _change(old[key], new[key]) for key in ("p50_ms", "p95_ms", "p99_ms", "rps")}
+        print(f"{label:<48} " + " ".join(f"{changes[k]:>+8.1f}%" for k in ("p50_ms", "p95_ms", "p99_ms", "rps")))
+        if max_regression is not None:
+            if changes["p95_ms"] > max_regression:
+                regressions.append(f"{label}: p95 {old['p95_ms']}ms -> {new['p95_ms']}ms")
+            if -changes["rps"] > max_regression:
+                regressions.append(f"{label}: rps {old['rps']} -> {new['rps']}")
+    return regressions
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--agents', type=int, default=16, help="concurrent simulated agents")
+    parser.add_argument('--duration', type=float, default=20, help="seconds to measure")
+    parser.add_argument('--warmup', type=float, default=3, help="seconds to run before measuring")
+    parser.add_argument('--products', type=int, default=1000, help="synthetic products to add to the catalog")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the synthetic catalog")
+    parser.add_argument('--server', choices=['asgi', 'sync', 'flask'], default='asgi',
+                        help="gunicorn worker mode, or the Flask dev server")
+    parser.add_argument('--workers', type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument('--store', choices=['memory', 'sqlite', 'log'], default='memory',
+                        help="order store backend (use sqlite or log with more than one worker)")
+    parser.add_argument('--rate-limits', action='store_true', help="keep the server's rate limits on")
+    parser.add_argument('--url', help="benchmark this running server instead of starting one")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against results saved with --output")
+    parser.add_argument('--max-regression', type=float,
+                        help="with --baseline, fail if p95 or rps worsens by more than this percent")
+    args = parser.parse_args()
+
+    if args.workers > 1 and args.store == 'memory' and not args.url:
+        parser.error("the memory order store is per worker; use --store sqlite or log with --workers > 1")
+
+    with tempfile.TemporaryDirectory(prefix='ucp-bench-') as workdir:
+        process = None
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            process, base_url = start_server(args, workdir)
+        try:
+            print(f"Benchmarking {base_url} with {args.agents} agents for {args.duration}s "
+                  f"(+{args.warmup}s warmup)...\n")
+            recorder, elapsed, flows = run_load(base_url, args.agents, args.duration, args.warmup)
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+
+    results = build_results(args, recorder, elapsed, flows, base_url)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions over {}%:".format(args.max_regression))
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Gunicorn settings for production
+
+    gunicorn -c gunicorn.conf.py
+
+UCP_SERVER_MODE picks the worker type:
+    asgi - uvicorn workers serving src/asgi.py (default); idle connections
+           are held by the event loop instead of a thread each
+    sync - threaded WSGI workers serving src/app.py
+"""
+
+import gc
+import multiprocessing
+import os
+
+pythonpath = 'src'
+bind = os.environ.get('UCP_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('UCP_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+if os.environ.get('UCP_SERVER_MODE', 'asgi') == 'asgi':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'app:app'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('UCP_THREADS', '8'))
+
+# Keep idle agent connections open longer than the proxy's upstream
+# keepalive so nginx, not gunicorn, decides when to close them.
+keepalive = int(os.environ.get('UCP_KEEPALIVE', '75'))
+
+# On SIGTERM stop accepting, let in-flight requests finish for up to
+# graceful_timeout seconds, then exit.
+graceful_timeout = int(os.environ.get('UCP_GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.environ.get('UCP_TIMEOUT', '30'))
+
+# Recycle workers now and then so slow leaks can't accumulate
+max_requests = 10000
+max_requests_jitter = 1000
+
+# Orders, stock/booking counts and Idempotency-Keys must be shared once
+# there is more than one worker, or an order would only be found by the
+# worker that took it, each worker would sell the full stock, and a retry
+# reaching another worker would check out again (see orders.py,
+# inventory.py, idempotency.py)
+if workers > 1:
+    os.environ.setdefault('UCP_ORDER_STORE', 'sqlite')
+    os.environ.setdefault('UCP_INVENTORY_STORE', 'sqlite')
+    os.environ.setdefault('UCP_IDEMPOTENCY_STORE', 'sqlite')
+
+accesslog = '-'
+errorlog = '-'
+
+# UCP_PRELOAD=1 loads the app - and the catalog with its indexes - once in
+# the master. Workers then share those pages copy-on-write instead of each
+# building a private copy. Products swapped in later by a hot reload are
+# per-worker again until the next restart.
+preload_app = os.environ.get('UCP_PRELOAD', '').lower() in ('1', 'true', 'yes')
+
+
+def on_starting(server):
+    if workers > 1 and os.environ.get('UCP_INVENTORY_STORE') == 'memory':
+        raise RuntimeError(f"UCP_INVENTORY_STORE=memory would oversell stock with {workers} workers; "
+                           "use sqlite or UCP_WORKERS=1")
+    if workers > 1 and os.environ.get('UCP_IDEMPOTENCY_STORE') == 'memory':
+        raise RuntimeError(f"UCP_IDEMPOTENCY_STORE=memory would repeat retried checkouts with {workers} workers; "
+                           "use sqlite or UCP_WORKERS=1")
+    # Any worker may serve GET /orders/<id> or run a fulfillment job, so
+    # each must see every order
+    if workers > 1 and os.environ.get('UCP_ORDER_STORE') == 'memory':
+        raise RuntimeError(f"UCP_ORDER_STORE=memory would lose orders between {workers} workers; "
+                           "use sqlite or log, or UCP_WORKERS=1")
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach so GC
+    # passes in the workers don't write to (and so un-share) those pages.
+    if preload_app:
+        import routes
+        if routes.JOBS:
+            routes.JOBS.stop()   # the master doesn't run jobs; each worker does
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # Background threads don't survive fork(); restart the catalog watcher
+    # and the job workers
+    if preload_app:
+        import routes
+        if routes.CATALOG_WATCHER:
+            routes.CATALOG_WATCHER.start()
+        if routes.JOBS:
+            routes.JOBS.start()
@@ -0,0 +1,303 @@
+"""
+Running sales aggregates
+
+Answering "how many of each product sold, revenue by type, orders per
+minute" from the order store means scanning every order. SalesStats is
+updated once per completed order instead, so reading it costs the same
+however many orders there are and however long the window (picking the
+best sellers is one pass over the products sold, keeping only the top
+`limit`):
+
+    totals      - orders, items, revenue and distinct buyers since start
+    products    - quantity, orders and revenue per product id
+    types       - the same per product type
+    windows     - the same again for each fixed window (15m, 1h, 24h by
+                  default), kept as running totals: a minute's sales are
+                  added as they happen and subtracted once the minute
+                  falls out of the window
+
+Distinct buyers (by email, else UCP-Agent) are estimated with HyperLogLog
+sketches: a couple of kilobytes whatever the number of buyers, within a
+few percent. A sketch can't forget a buyer, so the windows share a sliding
+HyperLogLog whose registers remember when each rank was seen. Money is
+summed in integer minor units (see pricing.py).
+
+Like /api/ucp/stats, figures are per worker process.
+"""
+
+import hashlib
+import heapq
+import math
+import threading
+import time
+from collections import deque
+
+from pricing import from_minor, to_minor
+
+# 2 ** -rank for every possible register value
+_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+def _hash(value, precision):
+    """Register index and rank (leading zeros + 1) for a value"""
+    digest = hashlib.blake2b(value.encode('utf-8', 'replace'), digest_size=8).digest()
+    h = int.from_bytes(digest, 'big')
+    rest = (h << precision) & 0xFFFFFFFFFFFFFFFF
+    return h >> (64 - precision), min(65 - rest.bit_length(), 65 - precision)
+
+
+def _estimate(registers):
+    m = len(registers)
+    zeros = registers.count(0)
+    if zeros == m:
+        return 0
+    raw = (0.7213 / (1 + 1.079 / m)) * m * m / sum(_POWERS[r] for r in registers)
+    if raw <= 2.5 * m and zeros:
+        return round(m * math.log(m / zeros))   # linear counting for small sets
+    return round(raw)
+
+
+class HyperLogLog:
+    """Distinct-count estimate in 2 ** precision one-byte registers"""
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=11):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        index, rank = _hash(value, self.precision)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        return _estimate(self.registers)
+
+
+class SlidingHyperLogLog:
+    """
+    HyperLogLog for any window of the last `horizon` minutes. Each register
+    keeps (minute, rank) pairs, newest last with ranks falling: a pair is
+    dropped once a later one ranks as high, as it can no longer be any
+    window's maximum. That leaves a handful of pairs per register.
+    """
+
+    __slots__ = ('precision', 'horizon', 'registers')
+
+    def __init__(self, precision=11, horizon=1440):
+        self.precision = precision
+        self.horizon = horizon
+        self.registers = [None] * (1 << precision)
+
+    def add(self, value, minute):
+        index, rank = _hash(value, self.precision)
+        pairs = self.registers[index]
+        if pairs is None:
+            self.registers[index] = [(minute, rank)]
+            return
+        while pairs and pairs[-1][1] <= rank:
+            pairs.pop()
+        pairs.append((minute, rank))
+        while pairs[0][0] <= minute - self.horizon:
+            del pairs[0]
+
+    def estimate(self, since):
+        """Distinct values added in minute `since` or later"""
+        registers = []
+        for pairs in self.registers:
+            rank = 0
+            for minute, pair_rank in pairs or ():
+                if minute >= since:
+                    rank = pair_rank    # the first one left is the window's highest
+                    break
+            registers.append(rank)
+        return _estimate(registers)
+
+
+class _Tally:
+    """Orders, items and revenue per product and type, for a minute or a window"""
+
+    __slots__ = ('orders', 'items', 'revenue', 'products', 'types')
+
+    def __init__(self):
+        self.orders = 0
+        self.items = 0
+        self.revenue = 0
+        self.products = {}      # product id -> [quantity, orders, revenue]
+        self.types = {}         # product type -> [quantity, orders, revenue]
+
+    def add(self, revenue, lines):
+        self.orders += 1
+        self.revenue += revenue
+        seen = set()    # count an order once per product and type it contains
+        for product_id, product_type, quantity, line_revenue in lines:
+            self.items += quantity
+            _count(self.products, product_id, quantity, line_revenue, ('p', product_id) not in seen)
+            _count(self.types, product_type, quantity, line_revenue, ('t', product_type) not in seen)
+            seen.update((('p', product_id), ('t', product_type)))
+
+    def subtract(self, other):
+        self.orders -= other.orders
+        self.items -= other.items
+        self.revenue -= other.revenue
+        _uncount(self.products, other.products)
+        _uncount(self.types, other.types)
+
+
+def _count(table, key, quantity, revenue, new_order):
+    row = table.get(key)
+    if row is None:
+        table[key] = [quantity, 1, revenue]
+    else:
+        row[0] += quantity
+        row[1] += new_order
+        row[2] += revenue
+
+
+def _uncount(table, rows):
+    for key, (quantity, orders, revenue) in rows.items():
+        row = table[key]
+        if row[1] == orders:
+            del table[key]      # no orders left in the window
+        else:
+            row[0] -= quantity
+            row[1] -= orders
+            row[2] -= revenue
+
+
+class _Window:
+    """Running totals for the last `minutes`, with the minute buckets inside it"""
+
+    __slots__ = ('minutes', 'tally', 'buckets')
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.tally = _Tally()
+        self.buckets = deque()      # (minute number, _Tally), oldest first
+
+    def expire(self, minute):
+        while self.buckets and self.buckets[0][0] <= minute - self.minutes:
+            self.tally.subtract(self.buckets.popleft()[1])
+
+
+def buyer_key(order):
+    """Who placed an order, for distinct-buyer counts; None if anonymous"""
+    buyer = order.get('buyer')
+    email = buyer.get('email') if isinstance(buyer, dict) else None
+    if isinstance(email, str) and email.strip():
+        return 'email:' + email.strip().lower()
+    agent = order.get('agent')
+    return 'agent:' + agent if agent else None
+
+
+class SalesStats:
+    """Per-product and per-type sales totals, since start and over fixed windows"""
+
+    def __init__(self, windows=(15, 60, 1440), precision=11, clock=time.time):
+        self.windows = tuple(sorted(set(windows)))
+        self.clock = clock
+        self.currency = None
+        self.started = clock()
+        self._total = _Tally()
+        self._buyers = HyperLogLog(precision)
+        self._recent_buyers = SlidingHyperLogLog(precision, max(self.windows, default=1))
+        self._windows = {minutes: _Window(minutes) for minutes in self.windows}
+        self._lock = threading.Lock()
+
+    def record(self, order, products):
+        """Add a completed order; `products` maps ids to the products it was priced against"""
+        totals = order.get('totals') or {}
+        currency = totals.get('currency', 'USD')
+        lines = []
+        for item in order['line_items']:
+            product = products.get(item['product_id']) or {}
+            lines.append((item['product_id'], product.get('type') or 'other', item['quantity'],
+                          to_minor(item['total'], currency)))
+        revenue = to_minor(totals.get('total', 0), currency)
+        buyer = buyer_key(order)
+        minute = int(self.clock() // 60)
+
+        with self._lock:
+            self.currency = self.currency or currency
+            self._total.add(revenue, lines)
+            if buyer:
+                self._buyers.add(buyer)
+                self._recent_buyers.add(buyer, minute)
+            bucket = _Tally()
+            for window in self._windows.values():
+                window.expire(minute)
+                # every window holds the same bucket for the current minute
+                if window.buckets and window.buckets[-1][0] == minute:
+                    bucket = window.buckets[-1][1]
+                else:
+                    window.buckets.append((minute, bucket))
+                window.tally.add(revenue, lines)
+            bucket.add(revenue, lines)
+
+    def report(self, minutes=None, limit=50, per_minute=False):
+        """
+        Sales for the last `minutes` (one of self.windows; None: since the
+        worker started), with the `limit` best-selling products and, if
+        asked for, each minute in the window that had orders.
+        """
+        now = int(self.clock() // 60)
+        with self._lock:
+            if minutes is None:
+                tally = self._total
+                buyers = self._buyers.estimate()
+            else:
+                window = self._windows[minutes]
+                window.expire(now)
+                tally = window.tally
+                buyers = self._recent_buyers.estimate(now - minutes + 1)
+            orders, items, revenue = tally.orders, tally.items, tally.revenue
+            # One pass keeping a heap of `limit` rows; only those are copied
+            best = [(key, tuple(row)) for key, row in heapq.nsmallest(
+                limit, tally.products.items(), key=lambda kv: (-kv[1][0], -kv[1][2], kv[0]))]
+            products_sold = len(tally.products)
+            types = [(key, tuple(row)) for key, row in tally.types.items()]
+            minute_rows = None
+            if per_minute and minutes is not None:
+                minute_rows = [(m, t.orders, t.items, t.revenue) for m, t in window.buckets]
+            currency = self.currency or 'USD'
+
+        def money(minor):
+            return from_minor(minor, currency)
+
+        report = {
+            "since": _iso(self.started if minutes is None else (now - minutes + 1) * 60),
+            "orders": orders,
+            "items": items,
+            "revenue": money(revenue),
+            "average_order": money(revenue // orders) if orders else 0,
+            "currency": currency,
+            "buyers": buyers,
+            "by_type": {
+                product_type: {"quantity": q, "orders": o, "revenue": money(r)}
+                for product_type, (q, o, r) in sorted(types, key=lambda kv: -kv[1][2])
+            },
+            "products": [
+                {"product_id": product_id, "quantity": q, "orders": o, "revenue": money(r)}
+                for product_id, (q, o, r) in best
+            ],
+            "products_sold": products_sold,
+        }
+        if minute_rows is not None:
+            report["per_minute"] = [
+                {"minute": _iso(m * 60), "orders": o, "items": i, "revenue": money(r)}
+                for m, o, i, r in minute_rows
+            ]
+        return report
+
+    def stats(self):
+        with self._lock:
+            return {
+                "orders": self._total.orders,
+                "windows": list(self.windows),
+                "minutes_kept": len(self._windows[self.windows[-1]].buckets) if self.windows else 0,
+            }
+
+
+def _iso(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
@@ -9,16 +9,24 @@ Test:
     curl http://localhost:5000/api/ucp/health
 """
 
+import config
 from flask import Flask
 from flask_cors import CORS
 from routes import ucp_bp
+from serialization import FastJSONProvider
+from tenants import TenantPathMiddleware
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # orjson when installed, stdlib json otherwise
 CORS(app)
 
 # Register UCP blueprint
 app.register_blueprint(ucp_bp)
 
+# /t/<tenant>/... serves that tenant's routes (see tenants.py)
+if config.TENANTS_PATH:
+    app.wsgi_app = TenantPathMiddleware(app.wsgi_app, config.TENANT_PATH_PREFIX)
+
 # Also serve discovery at root .well-known
 @app.route('/.well-known/ucp.json')
 def wellknown_discovery():
@@ -0,0 +1,238 @@
+"""
+ASGI entry point for the UCP merchant
+
+Serves the same Flask app and ucp_bp routes to an ASGI server. Connections
+are held by the server's event loop, so thousands of idle keep-alive agent
+connections cost no threads; a request only borrows a thread from the
+bridge's pool while its view runs (order-store I/O included).
+
+The order event streams (GET /api/ucp/orders/<id>/events and
+/api/ucp/events) are served natively on the event loop instead of through
+the bridge, so an open stream is a coroutine and a queue, not a thread.
+They resolve the merchant the same way the Flask side does (path prefix,
+then Host header; see tenants.py).
+
+Run:
+    uvicorn --app-dir src asgi:app
+    gunicorn -c gunicorn.conf.py        # production, see gunicorn.conf.py
+"""
+
+import asyncio
+import re
+import sys
+from collections import defaultdict
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+from asgiref.sync import AsyncToSync, sync_to_async
+
+import config
+import routes
+from app import app as flask_app
+from events import HEARTBEAT_SECONDS, KEEPALIVE, EventStream, last_event_id
+from tenants import split_path
+
+ORDER_EVENTS_PATH = re.compile(r'^/api/ucp/orders/([^/]+)/events$')
+AGENT_EVENTS_PATH = '/api/ucp/events'
+
+
+def wsgi_environ(scope, body, duplicate_header_limit=100):
+    """WSGI environ for an ASGI HTTP scope (raises ValueError on too many duplicate headers)"""
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope.get('query_string', b'').decode('ascii'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    headers = defaultdict(list)
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        if duplicate_header_limit and len(headers[key]) >= duplicate_header_limit:
+            raise ValueError(f"Too many duplicate headers: {key}")
+        headers[key].append(value.decode('latin1'))
+    environ.update((key, ','.join(values)) for key, values in headers.items())
+    return environ
+
+
+class ThreadPoolWsgiToAsgi:
+    """
+    WSGI-to-ASGI bridge. asgiref's WsgiToAsgi runs every WSGI call on one
+    shared thread (thread_sensitive=True), which serializes a worker's
+    requests and fails under concurrent load, and never calls close() on
+    the response, so Flask's call_on_close hooks and streamed-response
+    teardown don't run. The views are thread-safe; this runs each request
+    on the event loop's thread pool and closes what the app returns.
+    """
+
+    def __init__(self, wsgi_application, duplicate_header_limit=100):
+        self.wsgi_application = wsgi_application
+        self.duplicate_header_limit = duplicate_header_limit
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError("WSGI bridge received a non-HTTP scope")
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message['type'] != 'http.request':
+                    return      # client went away before sending the body
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            await sync_to_async(self._run, thread_sensitive=False)(scope, body, AsyncToSync(send))
+
+    def _run(self, scope, body, send):
+        """Call the WSGI app on a pool thread, sending its output as it comes"""
+        try:
+            environ = wsgi_environ(scope, body, self.duplicate_header_limit)
+        except ValueError:
+            send({"type": "http.response.start", "status": 400,
+                  "headers": [(b"content-type", b"text/plain")]})
+            send({"type": "http.response.body", "body": b"Bad Request: Too many duplicate headers"})
+            return
+
+        start = {}
+        sent = [False]
+
+        def start_response(status, response_headers, exc_info=None):
+            if exc_info and sent[0]:
+                raise exc_info[1].with_traceback(exc_info[2])
+            if start and exc_info is None:
+                raise ValueError("start_response called twice without exc_info")
+            start['message'] = {
+                "type": "http.response.start",
+                "status": int(status.split(' ', 1)[0]),
+                "headers": [(name.lower().encode('ascii'), value.encode('latin1'))
+                            for name, value in response_headers],
+            }
+            start['length'] = next((int(value) for name, value in response_headers
+                                    if name.lower() == 'content-length'), None)
+
+        response = self.wsgi_application(environ, start_response)
+        try:
+            remaining = None
+            for chunk in response:
+                if not sent[0]:
+                    sent[0] = True
+                    send(start['message'])
+                    remaining = start['length']
+                if remaining is not None:
+                    chunk = chunk[:remaining]   # never send more than Content-Length
+                    remaining -= len(chunk)
+                send({"type": "http.response.body", "body": chunk, "more_body": True})
+                if remaining == 0:
+                    break
+            if not sent[0]:
+                sent[0] = True
+                send(start['message'])
+            send({"type": "http.response.body"})
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+
+
+bridge = ThreadPoolWsgiToAsgi(flask_app)
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _serve_events(scope, receive, send, events_hub, topic, snapshot=None, settled=False):
+    headers = dict(scope.get('headers', ()))
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    stream = EventStream(events_hub, topic,
+                         lambda event: loop.call_soon_threadsafe(events.put_nowait, event),
+                         last_event_id(headers.get(b'last-event-id', b'').decode('latin1')),
+                         snapshot=snapshot, settled=settled)
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+                (b"access-control-allow-origin", b"*"),
+            ],
+        })
+        for chunk in stream.opening():
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        while not stream.finished:
+            next_event = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait({next_event, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                next_event.cancel()
+                return
+            if next_event in done:
+                chunk = stream.encode(next_event.result())
+            else:
+                next_event.cancel()
+                chunk = KEEPALIVE
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        stream.close()
+        disconnected.cancel()
+
+
+async def app(scope, receive, send):
+    """Event streams on the loop; everything else through the Flask bridge"""
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        tenant_id, path = None, scope['path']
+        if routes.TENANTS.specs:
+            tenant_id, path = split_path(path, config.TENANT_PATH_PREFIX)
+            if tenant_id is None:
+                host = dict(scope.get('headers', ())).get(b'host', b'').decode('latin1')
+                tenant_id = routes.TENANTS.for_host(host)
+        match = ORDER_EVENTS_PATH.match(path)
+        tenant = None
+        if match or path == AGENT_EVENTS_PATH:
+            try:
+                tenant = await asyncio.to_thread(routes.TENANTS.get, tenant_id)
+            except Exception:
+                tenant = None       # the bridge answers with the load error
+        if match and tenant:
+            order_id = match.group(1)
+            order = await asyncio.to_thread(tenant.orders.get, order_id)
+            if order:
+                with routes.TENANTS.use(tenant):
+                    settled = routes.order_settled(order)
+                return await _serve_events(scope, receive, send, tenant.events, f"order:{order_id}",
+                                           snapshot=order, settled=settled)
+        elif path == AGENT_EVENTS_PATH and tenant:
+            query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+            agent = (query.get('agent') or [None])[0] or \
+                dict(scope.get('headers', ())).get(b'ucp-agent', b'').decode('latin1')
+            if agent:
+                return await _serve_events(scope, receive, send, tenant.events, f"agent:{agent[:200]}")
+    # Everything else, including the streams' 400/404 responses
+    await bridge(scope, receive, send)
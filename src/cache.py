@@ -0,0 +1,95 @@
+"""
+Pre-encoded response cache for the UCP endpoints
+
+Payloads that only change with configuration or the catalog (discovery,
+docs, examples, product detail) are serialized once and served as bytes
+with a strong ETag. Clients that send a matching If-None-Match get a 304
+and skip the body entirely. With a Compressor, each body's gzip/brotli/zstd
+variants are made the first time a client asks for them and kept alongside
+it, compressed harder than per-request bodies since it only happens once.
+"""
+
+import hashlib
+import threading
+
+from flask import Response, request
+
+from compression import compress
+from serialization import dumps_bytes
+
+
+class ResponseCache:
+    """Encoded JSON bodies keyed by name, with hit/miss counters"""
+
+    def __init__(self, compressor=None):
+        self.compressor = compressor
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def encode(payload):
+        # Same bytes jsonify would produce outside debug mode
+        return dumps_bytes(payload) + b"\n"
+
+    def put(self, key, payload, max_age=60):
+        """Serialize and store a payload; replaces any previous entry"""
+        body = self.encode(payload)
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        # The last item collects compressed variants: encoding -> body, or
+        # None where compressing didn't make it smaller
+        self._entries[key] = (body, etag, f"public, max-age={max_age}", {})
+
+    def drop(self, key):
+        self._entries.pop(key, None)
+
+    def serve(self, key):
+        """Response for a cached key (304 when the client already has it), or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        body, etag, cache_control, variants = entry
+
+        encoding = None
+        if self.compressor:
+            encoding = self.compressor.choose(request.accept_encodings, len(body))
+            if encoding and encoding not in variants:
+                compressed = compress(body, encoding, stored=True)
+                variants[encoding] = compressed if len(compressed) < len(body) else None
+            if encoding and variants[encoding] is not None:
+                size, body = len(body), variants[encoding]
+                etag = f"{etag}-{encoding}"
+            else:
+                encoding = None
+
+        with self._lock:
+            self.hits += 1
+            if request.if_none_match.contains(etag):
+                self.not_modified += 1
+                body = b''
+                status = 304
+            else:
+                status = 200
+        if encoding and status == 200:
+            self.compressor.count(encoding, size, len(body))
+
+        response = Response(body, status=status, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        if self.compressor:
+            response.vary.add('Accept-Encoding')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        return response
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
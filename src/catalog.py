@@ -0,0 +1,450 @@
+"""
+Catalog and catalog indexes for the UCP product endpoints
+
+Every product gets a permanent slot number. Filters are answered from
+per-type and in-stock bitsets (plain Python ints), price ranges from a
+price-sorted array via bisect, and pages are cut with opaque cursors that
+encode the last sort key seen, so listing never scans the whole catalog.
+Text search ranks products from an inverted index (see search.py).
+"""
+
+import base64
+import bisect
+import json
+import threading
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# sort name -> (sorted array attribute, descending)
+SORTS = {
+    "catalog": (None, False),
+    "price": ("by_price", False),
+    "-price": ("by_price", True),
+    "name": ("by_name", False),
+    "-name": ("by_name", True),
+}
+
+
+def _price_key(product):
+    return product.get('price', 0)
+
+
+def _name_key(product):
+    return product.get('name', '').lower()
+
+
+SORT_KEYS = {"by_price": _price_key, "by_name": _name_key}
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(key):
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if isinstance(key, list):
+        key = tuple(key)
+    return key
+
+
+def _iter_bits(bits):
+    """Yield set bit positions, lowest first"""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield (i << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+def _mask(slots):
+    """Build a bitset from slot numbers without quadratic big-int shifting"""
+    slots = list(slots)
+    if not slots:
+        return 0
+    buf = bytearray(max(slots) // 8 + 1)
+    for slot in slots:
+        buf[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buf, 'little')
+
+
+class CatalogIndex:
+    """Secondary indexes over the catalog, keyed by slot number"""
+
+    # Below this fraction of the catalog, sorting the candidates beats
+    # walking the full sorted array and skipping non-matches.
+    SPARSE_RATIO = 8
+
+    def __init__(self, products=()):
+        self.slots = list(products)   # slot -> product, None once removed
+        self.slot_of = {p['id']: slot for slot, p in enumerate(self.slots)}
+        # bitsets of slots: occupied, in stock, and per product type
+        self.live = (1 << len(self.slots)) - 1
+        self.in_stock = _mask(s for s, p in enumerate(self.slots) if p.get('in_stock'))
+        types = {}
+        for slot, product in enumerate(self.slots):
+            types.setdefault(product.get('type'), []).append(slot)
+        self.by_type = {ptype: _mask(slots) for ptype, slots in types.items()}
+        # sorted (key, slot) arrays for range queries and ordered pages
+        self.by_price = sorted((_price_key(p), s) for s, p in enumerate(self.slots))
+        self.by_name = sorted((_name_key(p), s) for s, p in enumerate(self.slots))
+        # Imported here: search.py uses this module's bitset helpers
+        from search import SearchIndex
+        self.text = SearchIndex(enumerate(self.slots))
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def add(self, product):
+        """Index a product; a new version of one already here keeps its slot"""
+        slot = self.slot_of.get(product['id'])
+        if slot is None:
+            slot = len(self.slots)
+            self.slots.append(product)
+            self.slot_of[product['id']] = slot
+        else:
+            # Same place in the "catalog" sort, however often it is edited
+            self._unindex(slot, self.slots[slot])
+            self.slots[slot] = product
+        bit = 1 << slot
+        self.live |= bit
+        if product.get('in_stock'):
+            self.in_stock |= bit
+        ptype = product.get('type')
+        self.by_type[ptype] = self.by_type.get(ptype, 0) | bit
+        bisect.insort(self.by_price, (_price_key(product), slot))
+        bisect.insort(self.by_name, (_name_key(product), slot))
+        self.text.add(slot, product)
+
+    def remove(self, product_id):
+        """Drop a product from every index; its slot is never reused"""
+        slot = self.slot_of.pop(product_id, None)
+        if slot is None:
+            return
+        self._unindex(slot, self.slots[slot])
+        self.slots[slot] = None
+        self.live &= ~(1 << slot)
+
+    def _unindex(self, slot, product):
+        """Take a product out of the secondary indexes, keeping its slot"""
+        mask = ~(1 << slot)
+        self.in_stock &= mask
+        ptype = product.get('type')
+        self.by_type[ptype] &= mask
+        if not self.by_type[ptype]:
+            del self.by_type[ptype]
+        self._discard(self.by_price, (_price_key(product), slot))
+        self._discard(self.by_name, (_name_key(product), slot))
+        self.text.remove(slot, product)
+
+    @staticmethod
+    def _discard(array, entry):
+        i = bisect.bisect_left(array, entry)
+        if i < len(array) and array[i] == entry:
+            del array[i]
+
+    def query(self, product_type=None, in_stock=False, min_price=None,
+              max_price=None, sort="catalog", cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Return (products, total_matches, next_cursor) for one page.
+
+        `cursor` is the value returned as `next_cursor` by the previous page
+        of the same query. Raises InvalidCursor if it cannot be used.
+        """
+        bits = self._filter(product_type, in_stock, min_price, max_price)
+        total = bits.bit_count()
+        after = decode_cursor(cursor) if cursor else None
+        attr, descending = SORTS[sort]
+
+        if attr is None:
+            keys = self._catalog_order(bits, after)
+        elif total * self.SPARSE_RATIO < len(self.slot_of):
+            keys = self._walk(self._candidates(attr, bits), None, after, descending)
+        else:
+            keys = self._walk(getattr(self, attr), bits, after, descending)
+
+        page = []
+        last = None
+        for key in keys:
+            if len(page) == limit:
+                return page, total, encode_cursor(last)
+            page.append(self.slots[key if attr is None else key[1]])
+            last = key
+        return page, total, None
+
+    def _filter(self, product_type=None, in_stock=False, min_price=None, max_price=None):
+        """Bitset of the live slots passing every filter"""
+        bits = self.live
+        if product_type:
+            bits &= self.by_type.get(product_type, 0)
+        if in_stock:
+            bits &= self.in_stock
+
+        # Price range as bounds into the price-sorted array
+        lo, hi = 0, len(self.by_price)
+        if min_price is not None:
+            lo = bisect.bisect_left(self.by_price, (min_price, -1))
+        if max_price is not None:
+            hi = bisect.bisect_right(self.by_price, (max_price, float('inf')))
+        if (lo, hi) != (0, len(self.by_price)):
+            bits &= _mask(slot for _, slot in self.by_price[lo:hi])
+        return bits
+
+    def search(self, text, product_type=None, in_stock=False, min_price=None,
+               max_price=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Return (products, total_matches, next_cursor, match) for one page
+        of products matching `text`, best match first; match is "all",
+        "any" or "none" (see SearchIndex.search).
+
+        Takes the same filters as query(). Raises InvalidCursor if the
+        cursor cannot be used.
+        """
+        after = decode_cursor(cursor) if cursor else None
+        if after is not None and (not isinstance(after, tuple) or len(after) != 2
+                                  or not all(isinstance(v, (int, float)) for v in after)):
+            raise InvalidCursor(after)
+
+        filtered = product_type or in_stock or min_price is not None or max_price is not None
+        allowed = self._filter(product_type, in_stock, min_price, max_price) if filtered else None
+        ranked, total, match = self.text.search(text, allowed, limit + 1, after)
+        next_cursor = encode_cursor(ranked[limit - 1]) if len(ranked) > limit else None
+        return [self.slots[slot] for _, slot in ranked[:limit]], total, next_cursor, match
+
+    def _catalog_order(self, bits, after):
+        if after is not None:
+            if not isinstance(after, int) or after < 0:
+                raise InvalidCursor(after)
+            bits &= ~((1 << (after + 1)) - 1)
+        return _iter_bits(bits)
+
+    def _candidates(self, attr, bits):
+        """Sorted keys for just the matching slots, for selective filters"""
+        key = SORT_KEYS[attr]
+        return sorted((key(self.slots[slot]), slot) for slot in _iter_bits(bits))
+
+    def _walk(self, array, bits, after, descending):
+        """Iterate an ascending key array in either direction, resuming after a cursor"""
+        if after is not None and (not isinstance(after, tuple) or len(after) != 2):
+            raise InvalidCursor(after)
+        try:
+            if descending:
+                end = len(array) if after is None else bisect.bisect_left(array, after)
+                positions = range(end - 1, -1, -1)
+            else:
+                start = 0 if after is None else bisect.bisect_right(array, after)
+                positions = range(start, len(array))
+        except TypeError:
+            raise InvalidCursor(after)
+
+        if bits is None:
+            return (array[i] for i in positions)
+        members = bits.to_bytes(len(self.slots) // 8 + 1, 'little')
+        return (array[i] for i in positions
+                if members[array[i][1] >> 3] >> (array[i][1] & 7) & 1)
+
+
+def _now():
+    # Fixed-width so timestamps compare correctly as strings
+    return datetime.utcnow().isoformat(timespec='microseconds') + "Z"
+
+
+class CatalogState:
+    """One consistent version of the catalog: products, indexes and change log"""
+
+    __slots__ = ('products', 'index', 'changes', 'changed_at', 'deleted')
+
+    def __init__(self, products, deleted=None):
+        self.products = products
+        self.index = CatalogIndex(products.values())
+        self.deleted = dict(deleted or {})   # product id -> removal time
+        self.changed_at = {pid: p['updated_at'] for pid, p in products.items()}
+        self.changed_at.update(self.deleted)
+        self.changes = sorted((at, pid) for pid, at in self.changed_at.items())
+
+
+def _same_product(a, b):
+    return {k: v for k, v in a.items() if k != 'updated_at'} == \
+        {k: v for k, v in b.items() if k != 'updated_at'}
+
+
+class Catalog:
+    """
+    The product dict plus its indexes; catalog changes go through here.
+
+    Every product carries an `updated_at` timestamp, and the catalog keeps
+    a change log ordered by (updated_at, id) - including tombstones for
+    removed products - so agents can sync incrementally.
+
+    put()/remove() update the current state in place. replace() builds a
+    whole new state (indexes included) before swapping it in with a single
+    assignment, so readers see either the old catalog or the new one. Puts
+    and removes made while it builds are journaled and applied to the new
+    state before the swap, so none are lost.
+    """
+
+    def __init__(self, products):
+        loaded_at = _now()
+        for product in products.values():
+            product.setdefault('updated_at', loaded_at)
+        self._state = CatalogState(products)
+        self._lock = threading.Lock()
+        self._replace_lock = threading.Lock()
+        self._journal = None    # (product_id, product or None) while replace() builds
+        self._listeners = []
+
+    @property
+    def products(self):
+        return self._state.products
+
+    @property
+    def index(self):
+        return self._state.index
+
+    def get(self, product_id):
+        return self._state.products.get(product_id)
+
+    @staticmethod
+    def _log_change(state, product_id, updated_at):
+        previous = state.changed_at.get(product_id)
+        if previous is not None:
+            i = bisect.bisect_left(state.changes, (previous, product_id))
+            if i < len(state.changes) and state.changes[i] == (previous, product_id):
+                del state.changes[i]
+        state.changed_at[product_id] = updated_at
+        bisect.insort(state.changes, (updated_at, product_id))
+
+    def put(self, product):
+        """Add or replace a product and re-index it"""
+        with self._lock:
+            product['updated_at'] = _now()
+            self._put(self._state, product)
+            if self._journal is not None:
+                self._journal.append((product['id'], product))
+        self._notify(product['id'])
+
+    def remove(self, product_id):
+        with self._lock:
+            if not self._remove(self._state, product_id, _now()):
+                return
+            if self._journal is not None:
+                self._journal.append((product_id, None))
+        self._notify(product_id)
+
+    def _put(self, state, product):
+        state.products[product['id']] = product
+        state.index.add(product)
+        state.deleted.pop(product['id'], None)
+        self._log_change(state, product['id'], product['updated_at'])
+
+    def _remove(self, state, product_id, removed_at):
+        if state.products.pop(product_id, None) is None:
+            return False
+        state.index.remove(product_id)
+        state.deleted[product_id] = removed_at
+        self._log_change(state, product_id, removed_at)
+        return True
+
+    def replace(self, products):
+        """
+        Swap in a whole new catalog (e.g. reloaded from a file).
+
+        Unchanged products keep their updated_at so incremental syncs only
+        see real changes. Returns (added, changed, removed) product ids.
+        """
+        # Diff and index build happen outside the lock; only the snapshot and
+        # the swap are locked, and changes in between are journaled
+        with self._replace_lock:
+            with self._lock:
+                old_products = dict(self._state.products)
+                old_deleted = dict(self._state.deleted)
+                self._journal = []
+            try:
+                added, changed, removed, state = self._rebuild(products, old_products, old_deleted)
+            except BaseException:
+                with self._lock:
+                    self._journal = None
+                raise
+            with self._lock:
+                for product_id, product in self._journal:
+                    if product is None:
+                        self._remove(state, product_id, _now())
+                    else:
+                        self._put(state, product)
+                self._journal = None
+                self._state = state
+
+        for pid in added + changed + removed:
+            self._notify(pid)
+        return added, changed, removed
+
+    @staticmethod
+    def _rebuild(products, old_products, old_deleted):
+        """(added, changed, removed, new CatalogState) for a replace()"""
+        now = _now()
+        added, changed = [], []
+        for pid, product in products.items():
+            previous = old_products.get(pid)
+            if previous is None:
+                added.append(pid)
+                product.setdefault('updated_at', now)
+            elif _same_product(previous, product):
+                product['updated_at'] = previous['updated_at']
+            else:
+                changed.append(pid)
+                product.setdefault('updated_at', now)
+        removed = [pid for pid in old_products if pid not in products]
+        deleted = {pid: at for pid, at in old_deleted.items() if pid not in products}
+        deleted.update((pid, now) for pid in removed)
+        return added, changed, removed, CatalogState(products, deleted)
+
+    def changes(self, since=None, after_id=None, batch=500):
+        """
+        Yield products (or {"id", "deleted", "updated_at"} tombstones) changed
+        after (since, after_id), oldest change first.
+
+        Works in batches, re-seeking with bisect each time, so it holds no
+        copy of the catalog and tolerates changes while it runs.
+        """
+        if since is None:
+            position = ('', '')
+        else:
+            # Strictly after `since`, unless resuming within that timestamp
+            position = (since, after_id if after_id is not None else '\uffff')
+        while True:
+            with self._lock:
+                state = self._state
+                start = bisect.bisect_right(state.changes, position)
+                entries = state.changes[start:start + batch]
+                page = []
+                for updated_at, product_id in entries:
+                    product = state.products.get(product_id)
+                    if product is None:
+                        if since is None:
+                            continue  # full export: nothing to tell about deletions
+                        product = {"id": product_id, "deleted": True, "updated_at": updated_at}
+                    page.append(product)
+            if not entries:
+                return
+            yield from page
+            position = entries[-1]
+
+    def on_change(self, callback):
+        """Register callback(product_id) to run after every catalog change"""
+        self._listeners.append(callback)
+        return callback
+
+    def _notify(self, product_id):
+        for callback in self._listeners:
+            callback(product_id)
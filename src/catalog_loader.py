@@ -0,0 +1,224 @@
+"""
+Load the product catalog from a file instead of the PRODUCTS literal
+
+Supported sources, picked by file extension:
+
+    .json             - a list of products, {"products": [...]}, or {id: product}
+    .csv              - one product per row; header row names the fields
+    .db / .sqlite     - a `products` table, one column per field
+
+Products are validated when loaded; a bad file raises CatalogError and the
+running catalog is left untouched. CatalogWatcher polls the file and
+swaps a freshly built catalog in when it changes.
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from fulfillment import missing_fields
+
+REQUIRED_FIELDS = {
+    "id": str,
+    "name": str,
+    "price": (int, float),
+    "type": str,
+}
+
+OPTIONAL_FIELDS = {
+    "description": str,
+    "currency": str,
+    "fulfillment": str,
+    "in_stock": bool,
+    "features": list,
+    "updated_at": str,
+    "available_dates": list,
+}
+
+# Counts checkout reserves against (see inventory.py); whole numbers >= 0
+COUNT_FIELDS = ("stock", "slot_capacity")
+
+BOOLEAN_WORDS = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False, "": False}
+
+
+class CatalogError(ValueError):
+    """Raised when a catalog source cannot be read or fails validation"""
+
+    def __init__(self, source, problems):
+        self.source = source
+        self.problems = problems
+        shown = "; ".join(problems[:10])
+        more = f" (and {len(problems) - 10} more)" if len(problems) > 10 else ""
+        super().__init__(f"{source}: {shown}{more}")
+
+
+def _coerce(row):
+    """Turn the strings read from CSV/SQLite into JSON-shaped values"""
+    product = {}
+    for key, value in row.items():
+        if value is None or value == '':
+            continue
+        if key == 'price':
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                pass  # left as-is for validation to report
+        elif key in COUNT_FIELDS and isinstance(value, str):
+            try:
+                value = int(value.strip())
+            except ValueError:
+                pass
+        elif key == 'in_stock' and isinstance(value, (str, int)):
+            value = BOOLEAN_WORDS.get(str(value).strip().lower(), value)
+        elif key in ('features', 'available_dates') and isinstance(value, str):
+            value = json.loads(value) if value.startswith('[') else value.split('|')
+        product[key] = value
+    return product
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict) and isinstance(data.get('products'), list):
+        return data['products']
+    if isinstance(data, dict):
+        return list(data.values())
+    return data
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return [_coerce(row) for row in csv.DictReader(f)]
+
+
+def _read_sqlite(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [_coerce(dict(row)) for row in conn.execute("SELECT * FROM products")]
+    finally:
+        conn.close()
+
+
+READERS = {
+    ".json": _read_json,
+    ".csv": _read_csv,
+    ".db": _read_sqlite,
+    ".sqlite": _read_sqlite,
+    ".sqlite3": _read_sqlite,
+}
+
+
+def validate(products):
+    """Return a list of problems with the given product list (empty if valid)"""
+    problems = []
+    if not isinstance(products, list):
+        return ["expected a list of products"]
+    seen = set()
+    for n, product in enumerate(products):
+        if not isinstance(product, dict):
+            problems.append(f"product #{n}: not an object")
+            continue
+        label = f"product {product.get('id', '#' + str(n))!r}"
+        for field, kind in REQUIRED_FIELDS.items():
+            if field not in product:
+                problems.append(f"{label}: missing {field}")
+            elif not isinstance(product[field], kind) or isinstance(product[field], bool):
+                problems.append(f"{label}: {field} has the wrong type")
+        for field, kind in OPTIONAL_FIELDS.items():
+            if field in product and not isinstance(product[field], kind):
+                problems.append(f"{label}: {field} has the wrong type")
+        price = product.get('price')
+        if isinstance(price, (int, float)) and not isinstance(price, bool) and price < 0:
+            problems.append(f"{label}: price is negative")
+        for field in COUNT_FIELDS:
+            value = product.get(field)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                problems.append(f"{label}: {field} must be a whole number >= 0")
+        if isinstance(product.get('fulfillment', ''), str) and isinstance(product.get('type', ''), str):
+            for field in missing_fields(product):
+                problems.append(f"{label}: fulfillment {product.get('fulfillment')!r} needs {field}")
+        dates = product.get('available_dates')
+        if isinstance(dates, list) and not all(isinstance(d, str) for d in dates):
+            problems.append(f"{label}: available_dates must be date strings")
+        if product.get('id') in seen:
+            problems.append(f"{label}: duplicate id")
+        seen.add(product.get('id'))
+    return problems
+
+
+def load_products(path):
+    """Read and validate a catalog file; returns {id: product}"""
+    reader = READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise CatalogError(path, [f"unsupported catalog format (use {', '.join(READERS)})"])
+    try:
+        products = reader(path)
+    except (OSError, ValueError, sqlite3.Error, csv.Error) as e:
+        raise CatalogError(path, [str(e)])
+
+    problems = validate(products)
+    if problems:
+        raise CatalogError(path, problems)
+    for product in products:
+        product.setdefault('currency', 'USD')
+        product.setdefault('in_stock', True)
+    return {product['id']: product for product in products}
+
+
+def reload_catalog(catalog, path):
+    """Load `path` and swap it into `catalog`; returns a summary dict"""
+    started = time.perf_counter()
+    added, changed, removed = catalog.replace(load_products(path))
+    return {
+        "source": path,
+        "products": len(catalog.products),
+        "added": len(added),
+        "changed": len(changed),
+        "removed": len(removed),
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+
+class CatalogWatcher:
+    """Background thread that reloads the catalog when its file changes"""
+
+    def __init__(self, catalog, path, interval=5.0, log=print):
+        self.catalog = catalog
+        self.path = path
+        self.interval = interval
+        self.log = log
+        self._mtime = self._stat()
+        self._stop = threading.Event()
+        self._pid = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def start(self):
+        """Start polling; safe to call again after fork() to restart the thread"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='catalog-watcher', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            mtime = self._stat()
+            if mtime is None or mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            try:
+                self.log(f"Catalog reloaded: {reload_catalog(self.catalog, self.path)}")
+            except CatalogError as e:
+                self.log(f"Catalog reload failed, keeping current catalog: {e}")
@@ -0,0 +1,176 @@
+"""
+Response compression for the UCP endpoints
+
+Catalog and order-list JSON shrinks 5-10x compressed. Compressor picks the
+best encoding the client accepts (zstd, then brotli, then gzip) and
+compresses bodies above a size threshold in an after_request hook.
+
+gzip is always available; brotli (pip install brotli) and zstd (pip install
+zstandard) are offered when installed. Bodies that repeat - catalog pages,
+search results - are looked up by content hash so each distinct page is
+compressed once per encoding; ResponseCache keeps its own compressed
+variants next to each pre-encoded body. Streamed responses (the NDJSON
+export, event streams) and responses that negotiated their own encoding
+pass through untouched.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+# (per-request level, level for bodies compressed once and kept)
+LEVELS = {
+    "zstd": (3, 19),
+    "br": (4, 11),
+    "gzip": (6, 9),
+}
+
+# Server preference when the client accepts several equally
+PREFERENCE = ("zstd", "br", "gzip")
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/plain",
+                      "text/html", "text/css", "text/markdown")
+
+
+def _gzip(body, level):
+    return gzip.compress(body, level, mtime=0)  # mtime 0: same input, same bytes
+
+
+def _brotli(body, level):
+    return brotli.compress(body, quality=level)
+
+
+def _zstd(body, level):
+    # Compressor objects aren't safe to share between threads; they're cheap
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+
+CODECS = {"gzip": _gzip}
+if brotli:
+    CODECS["br"] = _brotli
+if zstandard:
+    CODECS["zstd"] = _zstd
+
+
+def available_encodings(names):
+    """The given encodings that can actually be produced here, in preference order"""
+    return tuple(name for name in PREFERENCE if name in names and name in CODECS)
+
+
+def compress(body, encoding, stored=False):
+    """Compress bytes; stored=True spends more CPU for a body that is kept"""
+    return CODECS[encoding](body, LEVELS[encoding][stored])
+
+
+def compressible(response):
+    return response.mimetype in COMPRESSIBLE_TYPES
+
+
+class Compressor:
+    """Content-Encoding negotiation plus a bounded cache of compressed bodies"""
+
+    def __init__(self, encodings=PREFERENCE, min_bytes=1024, cache_bytes=32 * 1024 * 1024):
+        self.encodings = available_encodings(encodings)
+        self.min_bytes = min_bytes
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()     # (digest, encoding) -> compressed body
+        self._cache_size = 0
+        self._lock = threading.Lock()
+        self.responses = dict.fromkeys(self.encodings, 0)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def choose(self, accept_encodings, size):
+        """Encoding to use for a body of `size` bytes, or None to send it as-is"""
+        if size < self.min_bytes or not self.encodings:
+            return None
+        best, best_quality = None, 0
+        for name in self.encodings:
+            quality = accept_encodings.quality(name)
+            if quality > best_quality:     # ties keep the earlier, preferred one
+                best, best_quality = name, quality
+        return best
+
+    def count(self, encoding, size, compressed_size):
+        with self._lock:
+            self.responses[encoding] += 1
+            self.bytes_in += size
+            self.bytes_out += compressed_size
+
+    def compress_cached(self, body, encoding):
+        """Compressed body, reused when the same bytes were compressed before"""
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        with self._lock:
+            compressed = self._cache.get(key)
+            if compressed is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return compressed
+            self.cache_misses += 1
+        compressed = compress(body, encoding)
+        if len(compressed) > self.cache_bytes:
+            return compressed
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = compressed
+                self._cache_size += len(compressed)
+                while self._cache_size > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_size -= len(evicted)
+        return compressed
+
+    def apply(self, request, response, cache=False):
+        """
+        Compress a finished response in place when the client accepts it.
+
+        cache=True keeps the compressed body for responses whose bytes
+        repeat across requests.
+        """
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or 'Accept-Encoding' in response.vary
+                or not compressible(response)):
+            return response     # streamed, or its encoding was already negotiated
+        response.vary.add('Accept-Encoding')
+        body = response.get_data()
+        encoding = self.choose(request.accept_encodings, len(body))
+        if encoding is None:
+            return response
+        compressed = self.compress_cached(body, encoding) if cache else compress(body, encoding)
+        if len(compressed) >= len(body):
+            return response
+        self.count(encoding, len(body), len(compressed))
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            # A different representation needs a different strong validator
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                "encodings": list(self.encodings),
+                "min_bytes": self.min_bytes,
+                "responses": dict(self.responses),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "ratio": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None,
+                "cache_entries": len(self._cache),
+                "cache_bytes": self._cache_size,
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+            }
@@ -0,0 +1,138 @@
+"""
+Runtime configuration
+
+Settings are read from environment variables so the same image can run as
+a single dev process or as several gunicorn workers sharing state on disk.
+"""
+
+import os
+
+# Order storage backend:
+#   memory - per-process dict, lost on restart (default; gunicorn.conf.py
+#            switches to sqlite with more than one worker)
+#   sqlite - SQLite database in WAL mode, shared by all workers
+#   log    - append-only JSON-lines file, shared by all workers
+ORDER_STORE = os.environ.get('UCP_ORDER_STORE', 'memory')
+ORDER_STORE_PATH = os.environ.get('UCP_ORDER_STORE_PATH', 'orders.db')
+
+# Memory and log store retention (0 disables a limit; the entry and byte
+# limits apply to the memory store only). TEST_ orders from
+# GET /api/ucp/test expire much sooner than real checkouts.
+ORDER_MAX_ENTRIES = int(os.environ.get('UCP_ORDER_MAX_ENTRIES', '100000'))
+ORDER_MAX_BYTES = int(os.environ.get('UCP_ORDER_MAX_BYTES', str(256 * 1024 * 1024)))
+ORDER_TTL = int(os.environ.get('UCP_ORDER_TTL', str(7 * 24 * 3600)))
+TEST_ORDER_TTL = int(os.environ.get('UCP_TEST_ORDER_TTL', '3600'))
+
+# SQLite group commit: wait up to this many milliseconds to batch writes
+SQLITE_BATCH_MS = int(os.environ.get('UCP_SQLITE_BATCH_MS', '2'))
+
+# Log store: fsync after every append (slower, survives power loss), and
+# how often to consider compacting the file
+ORDER_LOG_FSYNC = os.environ.get('UCP_ORDER_LOG_FSYNC', '').lower() in ('1', 'true', 'yes')
+ORDER_LOG_COMPACT_SECONDS = float(os.environ.get('UCP_ORDER_LOG_COMPACT_SECONDS', '300'))
+
+# Product catalog source (.json, .csv or SQLite). Empty uses the PRODUCTS
+# literal in routes.py. With CATALOG_WATCH_SECONDS > 0 the file is polled
+# and reloaded in the background when it changes.
+CATALOG_PATH = os.environ.get('UCP_CATALOG_PATH', '')
+CATALOG_WATCH_SECONDS = float(os.environ.get('UCP_CATALOG_WATCH_SECONDS', '0'))
+
+# Tax, shipping and promo code rules as a JSON file (see pricing.py). Empty
+# uses the PRICING_RULES literal in routes.py.
+PRICING_RULES_PATH = os.environ.get('UCP_PRICING_RULES_PATH', '')
+
+# Multi-tenant hosting: a JSON manifest of extra merchants, each with its
+# own hosts, catalog and pricing rules (see tenants.py). Requests are
+# matched by Host header or by /t/<tenant>/... paths. Tenant catalogs load
+# on first use; past TENANT_MAX_LOADED tenants or TENANT_MAX_PRODUCTS
+# products the least recently used are dropped. Tenant orders go to
+# <store path>-<tenant> with their own retention limits.
+TENANTS_PATH = os.environ.get('UCP_TENANTS_PATH', '')
+TENANT_PATH_PREFIX = os.environ.get('UCP_TENANT_PATH_PREFIX', '/t')
+TENANT_MAX_LOADED = int(os.environ.get('UCP_TENANT_MAX_LOADED', '64'))
+TENANT_MAX_PRODUCTS = int(os.environ.get('UCP_TENANT_MAX_PRODUCTS', '1000000'))
+TENANT_ORDER_MAX_ENTRIES = int(os.environ.get('UCP_TENANT_ORDER_MAX_ENTRIES', '10000'))
+TENANT_ORDER_MAX_BYTES = int(os.environ.get('UCP_TENANT_ORDER_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# Windows, in minutes, that GET /api/ucp/stats/sales keeps running totals
+# for (per worker and merchant); its window= must be one of them or "all"
+SALES_WINDOWS = [int(minutes) for minutes in os.environ.get('UCP_SALES_WINDOWS', '15,60,1440').split(',')
+                 if minutes.strip()]
+
+# Stock and booking slot counts (see inventory.py):
+#   memory - per process; only correct with a single worker
+#   sqlite - one file shared by all workers, kept across restarts
+INVENTORY_STORE = os.environ.get('UCP_INVENTORY_STORE', 'memory')
+INVENTORY_PATH = os.environ.get('UCP_INVENTORY_PATH', 'inventory.db')
+
+# POST /api/ucp/checkout Idempotency-Key store:
+#   memory - per process; only correct with a single worker
+#   sqlite - one file shared by all workers on the host
+IDEMPOTENCY_STORE = os.environ.get('UCP_IDEMPOTENCY_STORE', 'memory')
+IDEMPOTENCY_PATH = os.environ.get('UCP_IDEMPOTENCY_PATH', 'idempotency.db')
+# Idempotency-Key retention
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('UCP_IDEMPOTENCY_MAX_ENTRIES', '10000'))
+IDEMPOTENCY_TTL = int(os.environ.get('UCP_IDEMPOTENCY_TTL', str(24 * 3600)))
+
+
+def _rate(name, default):
+    """Parse "<tokens per second>,<burst>"; 0 or off disables the limit"""
+    value = os.environ.get(name, default).strip().lower()
+    if value in ('', '0', 'off'):
+        return None
+    rate, _, burst = value.partition(',')
+    return float(rate), int(burst or max(1, float(rate)))
+
+
+# Per-client token buckets, keyed on the client IP address
+RATE_LIMITS = {
+    "checkout": _rate('UCP_RATE_CHECKOUT', '2,10'),
+    "test": _rate('UCP_RATE_TEST', '0.2,5'),
+    "products": _rate('UCP_RATE_PRODUCTS', '20,100'),
+}
+# memory - per worker; sqlite - one file shared by all workers on the host
+RATE_LIMIT_STORE = os.environ.get('UCP_RATE_LIMIT_STORE', 'memory')
+RATE_LIMIT_PATH = os.environ.get('UCP_RATE_LIMIT_PATH', 'ratelimit.db')
+# Behind nginx, identify clients by X-Real-IP instead of the proxy address.
+# Without it every client shares the proxy's buckets.
+TRUST_PROXY = os.environ.get('UCP_TRUST_PROXY', '').lower() in ('1', 'true', 'yes')
+
+# Checkouts one worker runs at once before rejecting with 503 (0 = no cap)
+CHECKOUT_MAX_CONCURRENT = int(os.environ.get('UCP_CHECKOUT_MAX_CONCURRENT', '32'))
+
+# Deferred fulfillment: checkout answers 201 with status "processing" and
+# a background job queue (a SQLite file shared by all workers) finishes the
+# order. Needs a shared order store (sqlite or log) with several workers;
+# gunicorn.conf.py refuses to start without one.
+DEFERRED_FULFILLMENT = os.environ.get('UCP_DEFERRED_FULFILLMENT', '').lower() in ('1', 'true', 'yes')
+JOB_QUEUE_PATH = os.environ.get('UCP_JOB_QUEUE_PATH', 'jobs.db')
+JOB_WORKERS = int(os.environ.get('UCP_JOB_WORKERS', '4'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('UCP_JOB_MAX_ATTEMPTS', '5'))
+# First retry delay in seconds; doubles on each further attempt
+JOB_BACKOFF_SECONDS = float(os.environ.get('UCP_JOB_BACKOFF_SECONDS', '1'))
+
+# Response compression: encodings offered, best first ("off" disables).
+# br and zstd need the brotli / zstandard packages and are skipped without
+# them. Bodies under COMPRESS_MIN_BYTES are sent as-is; repeated catalog
+# pages are kept compressed up to COMPRESS_CACHE_BYTES per worker.
+COMPRESSION = [name.strip() for name in os.environ.get('UCP_COMPRESSION', 'zstd,br,gzip').lower().split(',')
+               if name.strip() not in ('', '0', 'off')]
+COMPRESS_MIN_BYTES = int(os.environ.get('UCP_COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_CACHE_BYTES = int(os.environ.get('UCP_COMPRESS_CACHE_BYTES', str(32 * 1024 * 1024)))
+
+# Sandbox order lifecycle pushed over the event streams: seconds between
+# shipping steps (0 turns the simulation off), between subscription
+# renewals, and renewals per subscription before the order settles
+LIFECYCLE_STEP_SECONDS = float(os.environ.get('UCP_LIFECYCLE_STEP_SECONDS', '30'))
+RENEWAL_SECONDS = float(os.environ.get('UCP_RENEWAL_SECONDS', '60'))
+MAX_RENEWALS = int(os.environ.get('UCP_MAX_RENEWALS', '3'))
+# Events kept per worker for Last-Event-ID resume
+EVENT_HISTORY = int(os.environ.get('UCP_EVENT_HISTORY', '10000'))
+
+# Sampling profiler: profile 1 in N requests per route (0 = off, no
+# overhead). Results via GET /api/ucp/admin/profile; see profiling.py.
+PROFILE_EVERY = int(os.environ.get('UCP_PROFILE_EVERY', '0'))
+PROFILE_MODE = os.environ.get('UCP_PROFILE_MODE', 'cprofile')
+
+# Bearer token for the /api/ucp/admin endpoints; empty disables them
+ADMIN_TOKEN = os.environ.get('UCP_ADMIN_TOKEN', '')
@@ -0,0 +1,359 @@
+"""
+Order events: simulated fulfillment lifecycle and server-sent event streams
+
+Instead of polling GET /orders/<id>, agents open an event stream for one
+order or for everything they bought, and state changes are pushed:
+
+    order.created         checkout stored the order
+    order.completed       deferred fulfillment finished (see jobs.py)
+    order.failed          deferred fulfillment gave up
+    fulfillment.updated   sandbox_shipped -> sandbox_in_transit -> sandbox_delivered
+    subscription.renewed  a sandbox billing date came around
+    order.settled         nothing further will happen to the order
+
+OrderLifecycle drives the sandbox progression. All pending transitions
+sit in one Scheduler (a heap and a single thread), so an open order
+costs a heap entry rather than a timer thread. EventHub fans each event
+out to the streams subscribed to its order or agent and keeps a short
+history so a reconnecting client can resume from Last-Event-ID.
+
+Events are published by the worker that took the checkout (or, with
+deferred fulfillment, ran its job); with several workers, streams see live
+events published on their own worker.
+"""
+
+import calendar
+import heapq
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import date, datetime
+
+from fulfillment import BILLING_MONTHS
+
+# Next status for shipped goods; each step takes OrderLifecycle.step_seconds
+SHIPPING_STAGES = {
+    "sandbox_shipped": "sandbox_in_transit",
+    "sandbox_in_transit": "sandbox_delivered",
+}
+
+HEARTBEAT_SECONDS = 15
+KEEPALIVE = ": keep-alive\n\n"
+
+
+def _now():
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+# =============================================================================
+# SCHEDULER
+# =============================================================================
+
+class Scheduler:
+    """Run callbacks after a delay, all from one background thread"""
+
+    def __init__(self, log=print):
+        self.log = log
+        self._heap = []         # (due, seq, callback, args)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pid = None
+
+    def call_later(self, delay, callback, *args):
+        with self._cond:
+            if self._pid != os.getpid():
+                # First use, or first use in this forked worker
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='scheduler', daemon=True).start()
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), callback, args))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, callback, args = heapq.heappop(self._heap)
+            try:
+                callback(*args)
+            except Exception:
+                self.log(f"Scheduled {getattr(callback, '__name__', callback)} failed:\n"
+                         f"{traceback.format_exc()}")
+
+    def __len__(self):
+        return len(self._heap)
+
+
+# =============================================================================
+# EVENT HUB
+# =============================================================================
+
+class EventHub:
+    """Publish order events to subscribers by order id and by agent"""
+
+    def __init__(self, history=10000):
+        self._history = deque(maxlen=history)
+        self._subscribers = {}      # topic -> set of deliver callables
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    @staticmethod
+    def topics(event):
+        topics = [f"order:{event['order_id']}"]
+        if event.get('agent'):
+            topics.append(f"agent:{event['agent']}")
+        return topics
+
+    def publish(self, event_type, order, data=None):
+        with self._lock:
+            event = {
+                "id": next(self._ids),
+                "type": event_type,
+                "order_id": order['order_id'],
+                "agent": order.get('agent'),
+                "at": _now(),
+                "data": data or {},
+            }
+            self._history.append(event)
+            self.published += 1
+            deliver = [d for topic in self.topics(event) for d in self._subscribers.get(topic, ())]
+        for callback in deliver:
+            callback(event)
+        return event
+
+    def subscribe(self, topic, deliver, last_event_id=None):
+        """
+        Start delivering events for `topic` ("order:<id>" or "agent:<name>").
+
+        Returns the retained events after `last_event_id` for that topic,
+        so a reconnecting stream can replay what it missed.
+        """
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(deliver)
+            if last_event_id is None:
+                return []
+            return [e for e in self._history
+                    if e['id'] > last_event_id and topic in self.topics(e)]
+
+    def unsubscribe(self, topic, deliver):
+        with self._lock:
+            subscribers = self._subscribers.get(topic)
+            if subscribers:
+                subscribers.discard(deliver)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "published": self.published,
+                "retained": len(self._history),
+                "streams": sum(len(s) for s in self._subscribers.values()),
+            }
+
+
+# =============================================================================
+# SANDBOX LIFECYCLE
+# =============================================================================
+
+class OrderLifecycle:
+    """Advance sandbox fulfillment states over time and publish each change"""
+
+    def __init__(self, store, hub, scheduler, step_seconds=30, renewal_seconds=60, max_renewals=3):
+        self.store = store
+        self.hub = hub
+        self.scheduler = scheduler
+        self.step_seconds = step_seconds
+        self.renewal_seconds = renewal_seconds
+        self.max_renewals = max_renewals
+        self._pending = {}      # order id -> transitions still scheduled
+        self._lock = threading.Lock()
+
+    def tracking(self, order_id):
+        """True while the order still has transitions to come"""
+        return order_id in self._pending
+
+    def track(self, order, event="order.created"):
+        """Publish `event` and schedule the order's sandbox progression"""
+        self.hub.publish(event, order, {"status": order['status']})
+        chains = []
+        if self.step_seconds > 0:
+            for index, record in enumerate(order.get('fulfillment', ())):
+                if record.get('status') in SHIPPING_STAGES:
+                    chains.append((self.step_seconds, self._advance, index))
+                elif (record.get('type') == 'subscription' and record.get('next_billing_date')
+                      and self.max_renewals > 0):
+                    chains.append((self.renewal_seconds, self._renew, index))
+        if not chains:
+            self.hub.publish("order.settled", order, {"status": order['status']})
+            return
+        with self._lock:
+            self._pending[order['order_id']] = len(chains)
+        for delay, step, index in chains:
+            self.scheduler.call_later(delay, step, order['order_id'], index)
+
+    def _update(self, order_id, index, changes):
+        # Replace rather than mutate: other threads may hold this order from get()
+        order = self.store.get(order_id)
+        if order is None:
+            return None, None
+        fulfillment = list(order['fulfillment'])
+        previous = fulfillment[index]
+        fulfillment[index] = dict(previous, **changes)
+        order = dict(order, fulfillment=fulfillment)
+        self.store.put(order)
+        return order, previous
+
+    def _finish(self, order_id, order=None):
+        with self._lock:
+            left = self._pending.get(order_id, 1) - 1
+            if left > 0:
+                self._pending[order_id] = left
+                return
+            self._pending.pop(order_id, None)
+        if order is not None:
+            self.hub.publish("order.settled", order, {"status": order['status']})
+
+    def _advance(self, order_id, index):
+        order = self.store.get(order_id)
+        status = order and SHIPPING_STAGES.get(order['fulfillment'][index].get('status'))
+        if not status:
+            return self._finish(order_id, order)
+        order, previous = self._update(order_id, index, {"status": status})
+        self.hub.publish("fulfillment.updated", order, {
+            "product_id": previous['product_id'],
+            "index": index,
+            "type": previous.get('type'),
+            "previous": previous['status'],
+            "status": status,
+        })
+        if status in SHIPPING_STAGES:
+            self.scheduler.call_later(self.step_seconds, self._advance, order_id, index)
+        else:
+            self._finish(order_id, order)
+
+    def _renew(self, order_id, index):
+        order = self.store.get(order_id)
+        if order is None:
+            return self._finish(order_id)
+        record = order['fulfillment'][index]
+        billed = date.fromisoformat(record['next_billing_date'])
+        months = BILLING_MONTHS.get(record.get('billing_period'), 1)
+        renewals = record.get('renewals', 0) + 1
+        order, previous = self._update(order_id, index, {
+            "next_billing_date": _add_months(billed, months).isoformat(),
+            "renewals": renewals,
+        })
+        self.hub.publish("subscription.renewed", order, {
+            "product_id": previous['product_id'],
+            "index": index,
+            "subscription_id": previous.get('subscription_id'),
+            "billed_date": billed.isoformat(),
+            "next_billing_date": order['fulfillment'][index]['next_billing_date'],
+            "renewals": renewals,
+            "status": previous.get('status'),
+        })
+        if renewals < self.max_renewals:
+            self.scheduler.call_later(self.renewal_seconds, self._renew, order_id, index)
+        else:
+            self._finish(order_id, order)
+
+    def stats(self):
+        return {"orders_in_progress": len(self._pending), "scheduled": len(self.scheduler)}
+
+
+# =============================================================================
+# SSE STREAMS
+# =============================================================================
+
+def format_event(event):
+    """One server-sent event; events with an id can be resumed from"""
+    head = f"id: {event['id']}\n" if event.get('id') else ""
+    return f"{head}event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+def last_event_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+class EventStream:
+    """
+    One subscriber's view of the hub, independent of how bytes are sent.
+
+    `deliver` is called (from any thread) with each new event; the caller
+    feeds those events back through encode() in order. Order streams
+    finish once the order settles; agent streams stay open.
+    """
+
+    def __init__(self, hub, topic, deliver, last_id=None, snapshot=None, settled=False):
+        self.hub = hub
+        self.topic = topic
+        self.deliver = deliver
+        self.finished = False
+        self._replay = hub.subscribe(topic, deliver, last_id)
+        self._snapshot = snapshot
+        self._settled = settled
+        self._closes = topic.startswith('order:')
+
+    def opening(self):
+        """Chunks to send right away: reconnect delay, snapshot, missed events"""
+        chunks = ["retry: 3000\n\n"]
+        if self._snapshot is not None:
+            chunks.append(format_event({
+                "type": "order.snapshot",
+                "order_id": self._snapshot['order_id'],
+                "at": _now(),
+                "data": self._snapshot,
+            }))
+        chunks += [self.encode(event) for event in self._replay]
+        if self._closes and self._settled and not self.finished:
+            chunks.append(format_event({
+                "type": "order.settled",
+                "order_id": self._snapshot['order_id'],
+                "at": _now(),
+                "data": {"status": self._snapshot['status']},
+            }))
+            self.finished = True
+        return chunks
+
+    def encode(self, event):
+        if self._closes and event['type'] == 'order.settled':
+            self.finished = True
+        return format_event(event)
+
+    def close(self):
+        self.hub.unsubscribe(self.topic, self.deliver)
+
+
+def sse_chunks(stream, events):
+    """
+    Blocking generator of a stream's chunks for WSGI servers (one thread
+    per open stream); `events` is the queue.SimpleQueue the stream delivers to.
+    """
+    try:
+        for chunk in stream.opening():
+            yield chunk
+        while not stream.finished:
+            try:
+                yield stream.encode(events.get(timeout=HEARTBEAT_SECONDS))
+            except queue.Empty:
+                yield KEEPALIVE
+    finally:
+        stream.close()
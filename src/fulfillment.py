@@ -0,0 +1,143 @@
+"""
+Fulfillment handlers for checkout
+
+Each handler builds the fulfillment record for one purchased product.
+Handlers are registered by the product's `fulfillment` value, with the
+product `type` as a fallback, and resolved once per product when the
+catalog loads or changes - checkout just looks the handler up by id.
+
+Add a new fulfillment kind by registering a handler, naming the product
+fields it reads so catalog files missing them are rejected at load time:
+
+    @handles(fulfillment='gift_card', requires=('gift_card_value',))
+    def gift_card(product, base_url):
+        return {"product_id": product['id'], "type": "gift_card", ...}
+"""
+
+import uuid
+
+BY_FULFILLMENT = {}
+BY_TYPE = {}
+
+# Months between subscription charges, by the product's billing_period
+BILLING_MONTHS = {"monthly": 1, "annual": 12, "yearly": 12}
+
+
+def handles(fulfillment=None, product_type=None, requires=()):
+    """Register a handler for a fulfillment value and/or a product type"""
+    def register(handler):
+        handler.requires = tuple(requires)
+        if fulfillment:
+            BY_FULFILLMENT[fulfillment] = handler
+        if product_type:
+            BY_TYPE[product_type] = handler
+        return handler
+    return register
+
+
+@handles(fulfillment='instant_download', requires=('download_url',))
+def instant_download(product, base_url):
+    return {
+        "product_id": product['id'],
+        "type": "instant_download",
+        "download_url": f"{base_url}{product['download_url']}",
+        "status": "delivered"
+    }
+
+
+@handles(fulfillment='redirect', requires=('experience_url',))
+def redirect(product, base_url):
+    return {
+        "product_id": product['id'],
+        "type": "redirect",
+        "redirect_url": product['experience_url'],
+        "status": "delivered"
+    }
+
+
+@handles(fulfillment='subscription_activation')
+def subscription_activation(product, base_url):
+    billing_period = product.get('billing_period', 'monthly')
+    return {
+        "product_id": product['id'],
+        "type": "subscription",
+        "subscription_id": f"SUB_{uuid.uuid4().hex[:10].upper()}",
+        "billing_period": billing_period,
+        "next_billing_date": "2027-01-13" if BILLING_MONTHS.get(billing_period) == 12 else "2026-02-13",
+        "signup_url": product.get('signup_url'),
+        "status": "sandbox_active",
+        "note": "Sandbox subscription - no actual billing"
+    }
+
+
+@handles(product_type='subscription')
+def subscription(product, base_url):
+    # Generic subscription handler
+    return {
+        "product_id": product['id'],
+        "type": "subscription",
+        "subscription_id": f"SUB_{uuid.uuid4().hex[:10].upper()}",
+        "status": "sandbox_active"
+    }
+
+
+@handles(product_type='physical')
+def shipping(product, base_url):
+    return {
+        "product_id": product['id'],
+        "type": "shipping",
+        "tracking_number": f"SANDBOX_{uuid.uuid4().hex[:8].upper()}",
+        "carrier": "USPS",
+        "status": "sandbox_shipped"
+    }
+
+
+@handles(product_type='booking')
+def reservation(product, base_url):
+    return {
+        "product_id": product['id'],
+        "type": "reservation",
+        "confirmation_code": f"SH_{uuid.uuid4().hex[:6].upper()}",
+        "status": "sandbox_confirmed"
+    }
+
+
+def digital(product, base_url):
+    return {
+        "product_id": product['id'],
+        "type": "digital",
+        "status": "sandbox_delivered"
+    }
+
+
+def missing_fields(product):
+    """Fields the product's handler needs that the product doesn't have"""
+    handler = resolve(product)
+    return [field for field in getattr(handler, 'requires', ()) if not product.get(field)]
+
+
+def resolve(product):
+    """Pick the handler for a product: fulfillment value, then type, then digital"""
+    return (BY_FULFILLMENT.get(product.get('fulfillment'))
+            or BY_TYPE.get(product.get('type'))
+            or digital)
+
+
+class FulfillmentTable:
+    """Resolved handler per product id, kept in sync with a Catalog"""
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+        self._handlers = {pid: resolve(p) for pid, p in catalog.products.items()}
+        catalog.on_change(self.refresh)
+
+    def refresh(self, product_id):
+        product = self._catalog.get(product_id)
+        if product:
+            self._handlers[product_id] = resolve(product)
+        else:
+            self._handlers.pop(product_id, None)
+
+    def fulfill(self, product, base_url):
+        handler = self._handlers.get(product['id']) or resolve(product)
+        return handler(product, base_url)
@@ -0,0 +1,271 @@
+"""
+Idempotency-Key handling for POST /api/ucp/checkout
+
+Agents retry checkouts on timeouts. A request carrying an Idempotency-Key
+runs once; retries with the same key and body get the stored response
+back instead of creating another order. Concurrent duplicates wait for
+the first request to finish and share its result.
+
+Successful responses are kept for `ttl` seconds, at most `max_entries`
+of them (oldest dropped first). Failures are not stored: they release the
+key, so a waiting duplicate or a later retry runs the checkout itself.
+
+IdempotencyCache keeps keys in process memory, so each gunicorn worker
+only knows its own. SQLiteIdempotency keeps them in a file shared by all
+workers on the host; a key is claimed by inserting its row, so exactly one
+worker runs the checkout and the others wait for its stored response.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import Response, current_app, jsonify
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'done', 'response', 'expires_at')
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None     # (body, status, mimetype) once finished
+        self.expires_at = None
+
+
+MAX_KEY_LENGTH = 255
+
+
+def _too_long():
+    return jsonify({
+        "error": "Idempotency-Key too long",
+        "max_length": MAX_KEY_LENGTH
+    }), 400
+
+
+def _conflict():
+    return jsonify({
+        "error": "Idempotency-Key was already used with a different request body",
+        "hint": "Use a new key for a different checkout"
+    }), 422
+
+
+def _replay(stored):
+    body, status, mimetype = stored
+    response = Response(body, status=status, mimetype=mimetype)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotencyCache:
+    """Bounded, TTL-evicted map of Idempotency-Key -> stored response"""
+
+    def __init__(self, max_entries=10000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> _Entry, oldest first
+        self._lock = threading.Lock()
+        self.replays = 0
+        self.coalesced = 0
+
+    def _evict(self, now):
+        # Finished entries share one TTL, so the oldest expire first
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at is not None and entry.expires_at <= now:
+                del self._entries[key]
+            elif len(self._entries) > self.max_entries and entry.done.is_set():
+                del self._entries[key]
+            else:
+                break
+
+    def respond(self, key, body, handler, namespace=None):
+        """
+        Run handler() once per key and return its response; replay it for
+        retries whose request body matches. handler may return anything a
+        Flask view can. Keys in different namespaces (merchants) never meet.
+        """
+        if len(key) > MAX_KEY_LENGTH:
+            return _too_long()
+        fingerprint = hashlib.sha256(body).hexdigest()
+        slot = (namespace, key) if namespace else key
+
+        with self._lock:
+            self._evict(time.monotonic())
+            entry = self._entries.get(slot)
+            owner = entry is None
+            if owner:
+                entry = self._entries[slot] = _Entry(fingerprint)
+
+        if not owner:
+            if entry.fingerprint != fingerprint:
+                return _conflict()
+            if not entry.done.is_set():
+                with self._lock:
+                    self.coalesced += 1
+            entry.done.wait()
+            if entry.response is not None:
+                with self._lock:
+                    self.replays += 1
+                return _replay(entry.response)
+            # The first attempt failed and released the key; run this one ourselves
+            return self.respond(key, body, handler, namespace)
+
+        try:
+            response = current_app.make_response(handler())
+        except BaseException:
+            with self._lock:
+                self._entries.pop(slot, None)
+            entry.done.set()
+            raise
+
+        # Only successes are stored; waiters on a failure run again
+        with self._lock:
+            if 200 <= response.status_code < 300:
+                entry.response = (response.get_data(), response.status_code, response.mimetype)
+                entry.expires_at = time.monotonic() + self.ttl
+            else:
+                self._entries.pop(slot, None)
+        entry.done.set()
+        return response
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "replays": self.replays,
+            "coalesced": self.coalesced,
+        }
+
+
+class SQLiteIdempotency:
+    """Idempotency-Keys in a SQLite file, shared by every worker that opens it"""
+
+    # A claim not finished within this many seconds (its worker died) can
+    # be taken over by a retry
+    LEASE_SECONDS = 60
+    POLL_SECONDS = 0.05
+
+    def __init__(self, path, max_entries=10000, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._claims = 0
+        self.replays = 0
+        self.coalesced = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency (
+                slot TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                status INTEGER,
+                mimetype TEXT,
+                body BLOB
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idempotency_expiry ON idempotency (expires_at)")
+
+    def _conn(self):
+        # One connection per thread, reopened in each forked worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _claim(self, slot, fingerprint, owner):
+        """Insert the key's row -> None if we own it now, else the existing row"""
+        now = time.time()   # wall clock: shared across processes
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM idempotency WHERE slot = ? AND expires_at <= ?", (slot, now))
+            claimed = conn.execute(
+                "INSERT OR IGNORE INTO idempotency (slot, fingerprint, owner, expires_at) VALUES (?, ?, ?, ?)",
+                (slot, fingerprint, owner, now + self.LEASE_SECONDS)).rowcount
+            row = None if claimed else conn.execute(
+                "SELECT fingerprint, status, body, mimetype FROM idempotency WHERE slot = ?", (slot,)).fetchone()
+            self._claims += 1
+            if self._claims % 1000 == 0:
+                self._trim(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _trim(self, conn, now):
+        conn.execute("DELETE FROM idempotency WHERE expires_at <= ?", (now,))
+        extra = conn.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0] - self.max_entries
+        if extra > 0:
+            conn.execute("""
+                DELETE FROM idempotency WHERE slot IN (
+                    SELECT slot FROM idempotency WHERE status IS NOT NULL ORDER BY expires_at LIMIT ?
+                )
+            """, (extra,))
+
+    def respond(self, key, body, handler, namespace=None):
+        """Same contract as IdempotencyCache.respond, across workers"""
+        if len(key) > MAX_KEY_LENGTH:
+            return _too_long()
+        fingerprint = hashlib.sha256(body).hexdigest()
+        slot = f"{namespace}\x00{key}" if namespace else key
+        owner = uuid.uuid4().hex
+
+        waited = False
+        while True:
+            row = self._claim(slot, fingerprint, owner)
+            if row is None:
+                break
+            if row[0] != fingerprint:
+                return _conflict()
+            if row[1] is not None:
+                self.replays += 1
+                return _replay((row[2], row[1], row[3]))
+            if not waited:
+                waited = True
+                self.coalesced += 1
+            # Another request is running it; poll until it stores or releases the key
+            time.sleep(self.POLL_SECONDS)
+
+        try:
+            response = current_app.make_response(handler())
+        except BaseException:
+            self._release(slot, owner)
+            raise
+        if 200 <= response.status_code < 300:
+            self._conn().execute(
+                "UPDATE idempotency SET status = ?, body = ?, mimetype = ?, expires_at = ? "
+                "WHERE slot = ? AND owner = ?",
+                (response.status_code, response.get_data(), response.mimetype,
+                 time.time() + self.ttl, slot, owner))
+        else:
+            self._release(slot, owner)
+        return response
+
+    def _release(self, slot, owner):
+        self._conn().execute("DELETE FROM idempotency WHERE slot = ? AND owner = ?", (slot, owner))
+
+    def stats(self):
+        return {
+            "entries": self._conn().execute("SELECT COUNT(*) FROM idempotency").fetchone()[0],
+            "replays": self.replays,
+            "coalesced": self.coalesced,
+        }
+
+
+def make_idempotency(kind, path, max_entries, ttl):
+    """Build the Idempotency-Key store named in config.IDEMPOTENCY_STORE"""
+    if kind == 'memory':
+        return IdempotencyCache(max_entries, ttl)
+    if kind == 'sqlite':
+        return SQLiteIdempotency(path, max_entries, ttl)
+    raise ValueError(f"Unknown idempotency store: {kind!r} (expected memory or sqlite)")
@@ -0,0 +1,336 @@
+"""
+Stock counts and booking calendars for checkout
+
+Products may carry a `stock` count; without one they are unlimited while
+`in_stock` is true. Booking products may carry `available_dates` and a
+`slot_capacity` (default 1) - each date is a slot that checkout reserves.
+
+Reservations take one lock per SKU - striped over a fixed pool, so hot
+items contend only with themselves and there is no global lock. A cart
+reserves its lines one at a time and rolls back what it already took if
+a later line fails, so nothing is oversold and no lock is ever held
+while waiting for another.
+
+Each booking product keeps a sorted list of dates with capacity left,
+updated on every reservation, so availability is a lookup.
+
+Inventory keeps the counts in one process. With several workers each
+would sell the full stock, so SQLiteInventory keeps them in a file shared
+by every worker instead: a cart is reserved in one transaction of
+conditional `UPDATE ... WHERE left >= ?` statements. Its counts also
+survive restarts and tenant evictions; they are reset only when a
+product's stock settings change in the catalog.
+"""
+
+import bisect
+import json
+import os
+import sqlite3
+import threading
+
+
+class Inventory:
+    """Per-process stock and slot counts, kept in sync with a Catalog"""
+
+    def __init__(self, catalog, stripes=64):
+        self._catalog = catalog
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._stock = {}        # product id -> units left (absent = unlimited)
+        self._slots = {}        # product id -> {date: bookings left}
+        self._open_dates = {}   # product id -> sorted dates with bookings left
+        self._configured = {}   # product id -> catalog settings the counts came from
+        for product_id in list(catalog.products):
+            self.refresh(product_id)
+        catalog.on_change(self.refresh)
+
+    def _lock(self, product_id):
+        return self._locks[hash(product_id) % len(self._locks)]
+
+    def refresh(self, product_id):
+        """
+        Reset counts when a product's stock settings change in the catalog,
+        then make its in_stock flag match the count left either way
+        """
+        product = self._catalog.get(product_id)
+        with self._lock(product_id):
+            if product is None:
+                for table in (self._stock, self._slots, self._open_dates, self._configured):
+                    table.pop(product_id, None)
+                return
+            settings = _settings(product)
+            if self._configured.get(product_id) != settings:
+                self._reset(product_id, settings)
+        self._sync_in_stock([product_id])
+
+    def _reset(self, product_id, settings):
+        self._configured[product_id] = settings
+        stock, dates, capacity = settings
+
+        self._stock.pop(product_id, None)
+        if stock is not None:
+            self._stock[product_id] = stock
+        self._slots.pop(product_id, None)
+        self._open_dates.pop(product_id, None)
+        if dates:
+            self._slots[product_id] = {date: capacity for date in dates}
+            self._open_dates[product_id] = sorted(d for d in dates if capacity > 0)
+
+    def has_calendar(self, product_id):
+        return product_id in self._slots
+
+    def stock(self, product_id):
+        """Units left, or None when unlimited"""
+        return self._stock.get(product_id)
+
+    def available_dates(self, product_id):
+        return list(self._open_dates.get(product_id, ()))
+
+    def _reserve_one(self, product_id, quantity, date):
+        with self._lock(product_id):
+            left = self._stock.get(product_id)
+            if left is not None and left < quantity:
+                return {
+                    "error": f"Insufficient stock: {product_id}",
+                    "code": "out_of_stock",
+                    "available": left
+                }
+            slots = self._slots.get(product_id)
+            if slots is not None:
+                if date is None or slots.get(date, 0) < quantity:
+                    return {
+                        "error": f"Date not available: {date}" if date else f"Booking date required: {product_id}",
+                        "code": "slot_unavailable",
+                        "available_dates": list(self._open_dates.get(product_id, ()))
+                    }
+                slots[date] -= quantity
+                if slots[date] == 0:
+                    dates = self._open_dates[product_id]
+                    del dates[bisect.bisect_left(dates, date)]
+            if left is not None:
+                self._stock[product_id] = left - quantity
+        return None
+
+    def _release_one(self, product_id, quantity, date):
+        with self._lock(product_id):
+            if product_id in self._stock:
+                self._stock[product_id] += quantity
+            slots = self._slots.get(product_id)
+            if slots is not None and date is not None and date in slots:
+                if slots[date] == 0:
+                    bisect.insort(self._open_dates[product_id], date)
+                slots[date] += quantity
+
+    def reserve(self, items):
+        """
+        Reserve every (product_id, quantity, date) line or none of them.
+
+        Returns None on success, or an error dict with a "code" of
+        out_of_stock or slot_unavailable. A booking line must name one of
+        the product's dates; without one it is slot_unavailable too.
+        """
+        taken = []
+        for product_id, quantity, date in items:
+            error = self._reserve_one(product_id, quantity, date)
+            if error:
+                self.release(taken)
+                return error
+            taken.append((product_id, quantity, date))
+        self._sync_in_stock(product_id for product_id, _, _ in items)
+        return None
+
+    def release(self, items):
+        """Give back what reserve() took, e.g. when a checkout is abandoned"""
+        for product_id, quantity, date in reversed(items):
+            self._release_one(product_id, quantity, date)
+        self._sync_in_stock(product_id for product_id, _, _ in items)
+
+    def _sync_in_stock(self, product_ids):
+        # Flip the catalog's in_stock flag (and so its indexes and caches)
+        # only when a counted product sells out or comes back
+        for product_id in set(product_ids):
+            left = self._stock.get(product_id)
+            product = self._catalog.get(product_id)
+            if left is None or product is None:
+                continue
+            if product.get('in_stock') != (left > 0):
+                self._catalog.put(dict(product, in_stock=left > 0))
+
+
+def _settings(product):
+    return (product.get('stock'), tuple(product.get('available_dates') or ()),
+            product.get('slot_capacity', 1))
+
+
+class SQLiteInventory(Inventory):
+    """Stock and slot counts in a SQLite file, shared by every worker that opens it"""
+
+    def __init__(self, catalog, path):
+        self._catalog = catalog
+        self.path = path
+        self._local = threading.local()
+        self._calendars = set()     # product ids with available_dates
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        # date is '' for a product's stock row, else one booking date
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS counts (
+                product_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                left INTEGER NOT NULL,
+                PRIMARY KEY (product_id, date)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                product_id TEXT PRIMARY KEY,
+                settings TEXT NOT NULL
+            )
+        """)
+        for product_id in list(catalog.products):
+            self.refresh(product_id)
+        catalog.on_change(self.refresh)
+
+    def _conn(self):
+        # One connection per thread, reopened in each forked worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _write(self, work):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def refresh(self, product_id):
+        """
+        Reset counts when a product's stock settings change in the catalog,
+        then make its in_stock flag match the count left either way
+        """
+        product = self._catalog.get(product_id)
+        if product is None:
+            # Removed here; another worker or a later reload may still sell it
+            self._calendars.discard(product_id)
+            return
+        stock, dates, capacity = settings = _settings(product)
+        if dates:
+            self._calendars.add(product_id)
+        else:
+            self._calendars.discard(product_id)
+        encoded = json.dumps(settings)
+
+        def reset(conn):
+            row = conn.execute("SELECT settings FROM settings WHERE product_id = ?",
+                               (product_id,)).fetchone()
+            if row and row[0] == encoded:
+                return      # same settings: keep what has been sold so far
+            conn.execute("DELETE FROM counts WHERE product_id = ?", (product_id,))
+            rows = [(product_id, date, capacity) for date in dates]
+            if stock is not None:
+                rows.append((product_id, '', stock))
+            conn.executemany("INSERT INTO counts (product_id, date, left) VALUES (?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO settings (product_id, settings) VALUES (?, ?)",
+                         (product_id, encoded))
+        self._write(reset)
+        # A reloaded file says nothing of what has sold since; the count does
+        self._sync_in_stock([product_id])
+
+    def has_calendar(self, product_id):
+        return product_id in self._calendars
+
+    def stock(self, product_id):
+        row = self._conn().execute("SELECT left FROM counts WHERE product_id = ? AND date = ''",
+                                   (product_id,)).fetchone()
+        return row[0] if row else None
+
+    def available_dates(self, product_id):
+        return [date for (date,) in self._conn().execute(
+            "SELECT date FROM counts WHERE product_id = ? AND date != '' AND left > 0 ORDER BY date",
+            (product_id,))]
+
+    def reserve(self, items):
+        """
+        Reserve every (product_id, quantity, date) line or none of them.
+
+        Returns None on success, or an error dict with a "code" of
+        out_of_stock or slot_unavailable.
+        """
+        def take(conn):
+            for product_id, quantity, date in items:
+                if self._take(conn, product_id, '', quantity) is False:
+                    return {
+                        "error": f"Insufficient stock: {product_id}",
+                        "code": "out_of_stock",
+                        "available": self._left(conn, product_id, '')
+                    }
+                if product_id in self._calendars \
+                        and (date is None or self._take(conn, product_id, date, quantity) is not True):
+                    return {
+                        "error": f"Date not available: {date}" if date else f"Booking date required: {product_id}",
+                        "code": "slot_unavailable",
+                        "available_dates": self.available_dates(product_id)
+                    }
+            return None
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            error = take(conn)
+            conn.execute("ROLLBACK" if error else "COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._sync_in_stock(product_id for product_id, _, _ in items)
+        return error
+
+    def _take(self, conn, product_id, date, quantity):
+        """True if taken, False if too few left, None if the row isn't counted"""
+        taken = conn.execute("UPDATE counts SET left = left - ? "
+                             "WHERE product_id = ? AND date = ? AND left >= ?",
+                             (quantity, product_id, date, quantity)).rowcount
+        if taken:
+            return True
+        return False if self._left(conn, product_id, date) is not None else None
+
+    def _left(self, conn, product_id, date):
+        row = conn.execute("SELECT left FROM counts WHERE product_id = ? AND date = ?",
+                           (product_id, date)).fetchone()
+        return row[0] if row else None
+
+    def release(self, items):
+        """Give back what reserve() took, e.g. when a checkout is abandoned"""
+        def give_back(conn):
+            for product_id, quantity, date in items:
+                conn.execute("UPDATE counts SET left = left + ? WHERE product_id = ? AND date = ?",
+                             (quantity, product_id, ''))
+                if date is not None:
+                    conn.execute("UPDATE counts SET left = left + ? WHERE product_id = ? AND date = ?",
+                                 (quantity, product_id, date))
+        self._write(give_back)
+        self._sync_in_stock(product_id for product_id, _, _ in items)
+
+    def _sync_in_stock(self, product_ids):
+        # Other workers may have sold the last unit; read the shared count
+        for product_id in set(product_ids):
+            left = self.stock(product_id)
+            product = self._catalog.get(product_id)
+            if left is None or product is None:
+                continue
+            if product.get('in_stock') != (left > 0):
+                self._catalog.put(dict(product, in_stock=left > 0))
+
+
+def make_inventory(kind, catalog, path):
+    """Build the inventory store named in config.INVENTORY_STORE"""
+    if kind == 'memory':
+        return Inventory(catalog)
+    if kind == 'sqlite':
+        return SQLiteInventory(catalog, path)
+    raise ValueError(f"Unknown inventory store: {kind!r} (expected memory or sqlite)")
@@ -0,0 +1,236 @@
+"""
+Persistent background job queue
+
+Work that doesn't have to finish inside a request - deferred order
+fulfillment - is written to a SQLite file and run by a pool of worker
+threads. Jobs survive restarts: whatever is still queued (or was running
+when a process died) is picked up again once its lease runs out.
+
+Every worker process that opens the same file shares one queue; a job is
+claimed by exactly one thread. A job whose handler raises is retried with
+exponential backoff and marked failed after max_attempts.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+
+class JobQueue:
+    """SQLite-backed job queue drained by a thread pool"""
+
+    def __init__(self, path, workers=4, max_attempts=5, backoff=1.0, max_backoff=300,
+                 lease=60, poll=1.0, log=print):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease          # seconds before a running job is presumed dead
+        self.poll = poll            # idle re-check, for jobs queued by other processes
+        self.log = log
+        self._handlers = {}         # kind -> (run, on_failure)
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._pid = None
+        self._lock = threading.Lock()
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                error TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (run_at) WHERE state != 'failed'")
+
+    def _conn(self):
+        # One connection per thread, reopened in each forked worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def handler(self, kind, on_failure=None):
+        """
+        Register the function that runs jobs of `kind`; it gets the payload.
+
+        on_failure(payload, error) is called once a job has used up its
+        attempts.
+        """
+        def register(run):
+            self._handlers[kind] = (run, on_failure)
+            return run
+        return register
+
+    # -- producers -----------------------------------------------------------
+
+    def enqueue(self, kind, payload, delay=0):
+        return self.enqueue_many([(kind, payload)], delay)[0]
+
+    def enqueue_many(self, jobs, delay=0):
+        """Queue (kind, payload) pairs in one transaction; returns their ids"""
+        if not jobs:
+            return []
+        now = time.time()   # wall clock: shared across processes and restarts
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [
+                conn.execute("INSERT INTO jobs (kind, payload, run_at, created_at) VALUES (?, ?, ?, ?)",
+                             (kind, json.dumps(payload, separators=(',', ':')), now + delay, now)).lastrowid
+                for kind, payload in jobs
+            ]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._cond:
+            self._cond.notify(len(ids))
+        return ids
+
+    # -- workers -------------------------------------------------------------
+
+    def start(self):
+        """Start the worker threads in this process (again after a fork)"""
+        with self._cond:
+            if self._pid == os.getpid():
+                return self
+            self._pid = os.getpid()
+            self._generation += 1
+            generation = self._generation
+        for n in range(self.workers):
+            threading.Thread(target=self._work, args=(generation,),
+                             name=f'job-worker-{n}', daemon=True).start()
+        return self
+
+    def stop(self):
+        """Let this process's worker threads exit after their current job"""
+        with self._cond:
+            self._pid = None
+            self._generation += 1
+            self._cond.notify_all()
+
+    def _claim(self):
+        """Take the next due job; returns (job, None) or (None, when the next one is due)"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs WHERE state != 'failed' AND run_at <= ? "
+                "ORDER BY run_at LIMIT 1", (now,)).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, run_at = ? "
+                             "WHERE id = ?", (now + self.lease, row[0]))
+                conn.execute("COMMIT")
+                return (row[0], row[1], json.loads(row[2]), row[3] + 1), None
+            due = conn.execute("SELECT MIN(run_at) FROM jobs WHERE state != 'failed'").fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return None, due
+
+    def _work(self, generation):
+        while self._generation == generation:
+            try:
+                job, due = self._claim()
+            except sqlite3.Error:
+                self.log(f"Job queue unavailable:\n{traceback.format_exc()}")
+                job, due = None, None
+            if job is None:
+                wait = self.poll if due is None else min(self.poll, max(0.0, due - time.time()))
+                with self._cond:
+                    if self._generation == generation:
+                        self._cond.wait(wait)
+                continue
+            try:
+                self._run(*job)
+            except sqlite3.Error:
+                # The job stays claimed and is retried once its lease expires
+                self.log(f"Job {job[0]} ({job[1]}) result not recorded:\n{traceback.format_exc()}")
+
+    def _run(self, job_id, kind, payload, attempts):
+        # Handlers must tolerate running twice: a job whose worker died
+        # mid-run is handed out again when its lease expires
+        with self._lock:
+            self.busy += 1
+        started = time.monotonic()
+        error = None
+        try:
+            run, _ = self._handlers[kind]
+            run(payload)
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            with self._lock:
+                self.busy -= 1
+                self.busy_seconds += time.monotonic() - started
+        conn = self._conn()
+        if error is None:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            with self._lock:
+                self.completed += 1
+            return
+        if attempts < self.max_attempts and kind in self._handlers:
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+            conn.execute("UPDATE jobs SET state = 'pending', run_at = ?, error = ? WHERE id = ?",
+                         (time.time() + delay, error, job_id))
+            with self._lock:
+                self.retried += 1
+            self.log(f"Job {job_id} ({kind}) attempt {attempts} failed, retrying in {delay:g}s:\n{error}")
+            return
+        conn.execute("UPDATE jobs SET state = 'failed', error = ? WHERE id = ?", (error, job_id))
+        with self._lock:
+            self.failed += 1
+        self.log(f"Job {job_id} ({kind}) failed after {attempts} attempts:\n{error}")
+        on_failure = self._handlers.get(kind, (None, None))[1]
+        if on_failure:
+            try:
+                on_failure(payload, error)
+            except Exception:
+                self.log(f"Job {job_id} ({kind}) failure handler raised:\n{traceback.format_exc()}")
+
+    # -- reporting -----------------------------------------------------------
+
+    def depth(self):
+        """Jobs waiting or running, across every process sharing the file"""
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE state != 'failed'").fetchone()[0]
+
+    def stats(self):
+        counts = dict(self._conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        oldest = self._conn().execute(
+            "SELECT MIN(created_at) FROM jobs WHERE state != 'failed'").fetchone()[0]
+        with self._lock:
+            return {
+                "depth": counts.get('pending', 0) + counts.get('running', 0),
+                "pending": counts.get('pending', 0),
+                "running": counts.get('running', 0),
+                "failed_stored": counts.get('failed', 0),
+                "oldest_seconds": round(time.time() - oldest, 3) if oldest else 0,
+                "workers": self.workers if self._pid == os.getpid() else 0,
+                "busy": self.busy,
+                "utilization": round(self.busy / self.workers, 3) if self.workers else 0,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "completed": self.completed,
+                "retried": self.retried,
+                "failed": self.failed,
+            }
@@ -0,0 +1,116 @@
+"""
+Request metrics in Prometheus text format
+
+Counters and fixed-bucket histograms updated on every request: one bisect
+and a short lock per observation, cheap enough to leave on. Values are
+per worker process, like /api/ucp/stats; scrape each worker (or run one)
+for exact totals.
+"""
+
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SERIALIZATION_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+LINE_ITEM_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a running sum and count"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.sum += value
+
+    def render(self, name, **labels):
+        prefix = _labels(**labels)
+        prefix = prefix + ',' if prefix else ''
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            le = bound if bound == '+Inf' else _number(bound)
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+        braces = f'{{{_labels(**labels)}}}' if labels else ''
+        lines.append(f'{name}_sum{braces} {total!r}')
+        lines.append(f'{name}_count{braces} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """Per-route request metrics plus checkout, serialization and gauges"""
+
+    def __init__(self):
+        self.latency = {}       # (route, method) -> Histogram
+        self.responses = {}     # (route, method, status) -> count
+        self.line_items = Histogram(LINE_ITEM_BUCKETS)
+        self.serialization = Histogram(SERIALIZATION_BUCKETS)
+        self._gauges = []       # (name, help, callable)
+        self._lock = threading.Lock()
+
+    def observe_request(self, route, method, status, seconds):
+        key = (route, method)
+        histogram = self.latency.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.latency.setdefault(key, Histogram(LATENCY_BUCKETS))
+        histogram.observe(seconds)
+        key = (route, method, status)
+        with self._lock:
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def gauge(self, name, help, read):
+        """Report read() as a gauge at scrape time"""
+        self._gauges.append((name, help, read))
+
+    def render(self):
+        """All metrics in Prometheus text exposition format"""
+        lines = [
+            '# HELP ucp_request_duration_seconds Time to handle a request, until the response starts',
+            '# TYPE ucp_request_duration_seconds histogram',
+        ]
+        for (route, method), histogram in sorted(self.latency.items()):
+            lines += histogram.render('ucp_request_duration_seconds', route=route, method=method)
+
+        lines += [
+            '# HELP ucp_requests_total Requests by route, method and status code',
+            '# TYPE ucp_requests_total counter',
+        ]
+        with self._lock:
+            responses = sorted(self.responses.items())
+        for (route, method, status), count in responses:
+            lines.append(f'ucp_requests_total{{{_labels(route=route, method=method, status=status)}}} {count}')
+
+        lines += [
+            '# HELP ucp_checkout_line_items Line items per successful checkout',
+            '# TYPE ucp_checkout_line_items histogram',
+        ]
+        lines += self.line_items.render('ucp_checkout_line_items')
+        lines += [
+            '# HELP ucp_json_encode_seconds Time spent encoding JSON response bodies',
+            '# TYPE ucp_json_encode_seconds histogram',
+        ]
+        lines += self.serialization.render('ucp_json_encode_seconds')
+
+        for name, help, read in self._gauges:
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge', f'{name} {_number(read())}']
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,295 @@
+"""
+Compact in-memory order records
+
+The memory order store keeps millions of orders, and as plain dicts each
+one repeats every key, the sandbox flag, the payment note and the product
+names copied from the catalog. pack() turns an order into slotted records
+instead:
+
+    - product id, name and unit price live in one ProductRef shared by
+      every line item that bought that product at that price
+    - order status, fulfillment type and fulfillment status are enum
+      members rather than per-order strings
+    - small dicts (buyer, totals, type-specific fulfillment fields) become
+      a tuple of values plus one shared tuple of keys per distinct shape;
+      only shapes made of known fields are shared, since buyer dicts come
+      from clients and arbitrary keys would grow the shape table forever
+    - the sandbox payment block is reduced to its token
+
+unpack() rebuilds the exact dict that was packed - anything that doesn't
+fit the usual shape is carried along as-is - so responses are unchanged.
+"""
+
+import enum
+import sys
+import threading
+import weakref
+
+SANDBOX_PAYMENT_STATUS = "sandbox_success"
+SANDBOX_PAYMENT_NOTE = "No actual charge - sandbox mode"
+
+# Fulfillment fields whose values repeat across orders (per product or per
+# handler), so are worth interning; ids, codes and dates are unique per order
+_SHARED_FIELDS = frozenset((
+    'download_url', 'redirect_url', 'signup_url', 'carrier', 'billing_period', 'note',
+))
+
+
+class OrderStatus(enum.Enum):
+    COMPLETED = "completed"
+    PROCESSING = "processing"
+    FAILED = "failed"
+
+
+class FulfillmentType(enum.Enum):
+    INSTANT_DOWNLOAD = "instant_download"
+    REDIRECT = "redirect"
+    SUBSCRIPTION = "subscription"
+    SHIPPING = "shipping"
+    RESERVATION = "reservation"
+    DIGITAL = "digital"
+
+
+class FulfillmentStatus(enum.Enum):
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+    SANDBOX_ACTIVE = "sandbox_active"
+    SANDBOX_CONFIRMED = "sandbox_confirmed"
+    SANDBOX_DELIVERED = "sandbox_delivered"
+    SANDBOX_SHIPPED = "sandbox_shipped"
+    SANDBOX_IN_TRANSIT = "sandbox_in_transit"
+
+
+# Marks a key the packed dict didn't have (None is a real value)
+_MISSING = type('Missing', (), {'__repr__': lambda self: '<missing>'})()
+
+# Keys a shared shape may contain: what checkout, pricing and the
+# fulfillment handlers write, and the buyer fields agents send
+_KNOWN_FIELDS = frozenset((
+    'name', 'email', 'phone', 'company', 'address',
+    'subtotal', 'discount', 'tax', 'shipping', 'total', 'currency', 'promo_code',
+    'download_url', 'redirect_url', 'signup_url', 'carrier', 'billing_period', 'note',
+    'subscription_id', 'next_billing_date', 'renewals', 'tracking_number', 'confirmation_code',
+))
+_MAX_SHAPES = 1024  # distinct orderings of the known fields still add up
+
+_SHAPES = {}    # key tuple -> the one shared instance of it
+_SHAPE_IDS = set()
+_SHAPES_LOCK = threading.Lock()
+
+
+def _code(value, codes):
+    """Enum member for a known string, else the value itself"""
+    if isinstance(value, str):
+        return codes._value2member_map_.get(value, value)
+    return value
+
+
+def _decode(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+
+def _pack_fields(fields, intern=frozenset()):
+    """(shape, value, ...) for a flat dict with a shared keys tuple; else the dict itself"""
+    keys = tuple(fields)
+    shape = _SHAPES.get(keys)
+    if shape is None:
+        if not _KNOWN_FIELDS.issuperset(keys):
+            return dict(fields)
+        with _SHAPES_LOCK:
+            if len(_SHAPES) >= _MAX_SHAPES:
+                return dict(fields)
+            shape = _SHAPES.setdefault(keys, keys)
+            _SHAPE_IDS.add(id(shape))
+    values = tuple(
+        sys.intern(value) if key in intern and type(value) is str else value
+        for key, value in fields.items()
+    )
+    return (shape,) + values
+
+
+def _unpack_fields(packed):
+    if isinstance(packed, dict):
+        return dict(packed)
+    return dict(zip(packed[0], packed[1:]))
+
+
+class ProductRef:
+    """What a line item copies from the catalog, shared across orders"""
+
+    __slots__ = ('product_id', 'name', 'unit_price', '__weakref__')
+
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, product_id, name, unit_price):
+        self.product_id = product_id
+        self.name = name
+        self.unit_price = unit_price
+
+    @classmethod
+    def get(cls, product_id, name, unit_price):
+        key = (product_id, name, type(unit_price), unit_price)
+        try:
+            ref = cls._interned.get(key)
+        except TypeError:   # unhashable value from an odd order; don't share it
+            return cls(product_id, name, unit_price)
+        if ref is None:
+            ref = cls._interned[key] = cls(product_id, name, unit_price)
+        return ref
+
+
+class LineRecord:
+    __slots__ = ('product', 'quantity', 'total', 'date', 'extra')
+
+    @classmethod
+    def pack(cls, item):
+        item = dict(item)
+        record = cls()
+        record.product = ProductRef.get(item.pop('product_id', _MISSING),
+                                        item.pop('product_name', _MISSING),
+                                        item.pop('unit_price', _MISSING))
+        record.quantity = item.pop('quantity', _MISSING)
+        record.total = item.pop('total', _MISSING)
+        record.date = item.pop('date', _MISSING)
+        record.extra = item or None
+        return record
+
+    def unpack(self):
+        product = self.product
+        pairs = (
+            ("product_id", product.product_id),
+            ("product_name", product.name),
+            ("quantity", self.quantity),
+            ("unit_price", product.unit_price),
+            ("total", self.total),
+            ("date", self.date),
+        )
+        item = {key: value for key, value in pairs if value is not _MISSING}
+        if self.extra:
+            item.update(self.extra)
+        return item
+
+
+class FulfillmentRecord:
+    __slots__ = ('product_id', 'type', 'status', 'fields')
+
+    @classmethod
+    def pack(cls, fulfillment):
+        fulfillment = dict(fulfillment)
+        record = cls()
+        product_id = fulfillment.pop('product_id', _MISSING)
+        record.product_id = sys.intern(product_id) if type(product_id) is str else product_id
+        record.type = _code(fulfillment.pop('type', _MISSING), FulfillmentType)
+        record.status = _code(fulfillment.pop('status', _MISSING), FulfillmentStatus)
+        record.fields = _pack_fields(fulfillment, _SHARED_FIELDS) if fulfillment else None
+        return record
+
+    def unpack(self):
+        pairs = (("product_id", self.product_id), ("type", _decode(self.type)))
+        fulfillment = {key: value for key, value in pairs if value is not _MISSING}
+        if self.fields:
+            fulfillment.update(_unpack_fields(self.fields))
+        if self.status is not _MISSING:
+            fulfillment["status"] = _decode(self.status)
+        return fulfillment
+
+
+def _pack_list(values, record):
+    """Tuple of records for a list of dicts; anything else stays as-is"""
+    if isinstance(values, list) and all(isinstance(v, dict) for v in values):
+        return tuple(record.pack(v) for v in values)
+    return values
+
+
+def _unpack_list(values):
+    return [v.unpack() for v in values] if isinstance(values, tuple) else values
+
+
+def _pack_dict(value):
+    return _pack_fields(value) if isinstance(value, dict) else value
+
+
+def _unpack_dict(value):
+    return _unpack_fields(value) if isinstance(value, (tuple, dict)) else value
+
+
+class OrderRecord:
+    """
+    One stored order. Packed values are tuples (lists and dicts in the
+    order are never tuples), so a field that didn't fit is kept verbatim.
+    """
+
+    __slots__ = ('order_id', 'status', 'sandbox', 'created_at', 'buyer', 'line_items',
+                 'totals', 'payment', 'fulfillment', 'agent', 'extra')
+
+    def unpack(self):
+        """The order as the JSON-shaped dict it was stored as"""
+        pairs = (
+            ("order_id", self.order_id),
+            ("status", _decode(self.status)),
+            ("sandbox", self.sandbox),
+            ("created_at", self.created_at),
+            ("buyer", _unpack_dict(self.buyer)),
+            ("line_items", _unpack_list(self.line_items)),
+            ("totals", _unpack_dict(self.totals)),
+            ("payment", self._payment()),
+            ("fulfillment", _unpack_list(self.fulfillment)),
+            ("agent", self.agent),
+        )
+        order = {key: value for key, value in pairs if value is not _MISSING}
+        if self.extra:
+            order.update(self.extra)
+        return order
+
+    def _payment(self):
+        if type(self.payment) is not tuple:
+            return self.payment
+        return {"token": self.payment[0], "status": SANDBOX_PAYMENT_STATUS,
+                "note": SANDBOX_PAYMENT_NOTE}
+
+
+def pack(order):
+    """Compact OrderRecord for an order dict; unpack() gives back an equal dict"""
+    order = dict(order)
+    record = OrderRecord()
+    record.order_id = order.pop('order_id')
+    record.status = _code(order.pop('status', _MISSING), OrderStatus)
+    record.sandbox = order.pop('sandbox', _MISSING)
+    record.created_at = order.pop('created_at', _MISSING)
+    record.buyer = _pack_dict(order.pop('buyer', _MISSING))
+    record.line_items = _pack_list(order.pop('line_items', _MISSING), LineRecord)
+    record.totals = _pack_dict(order.pop('totals', _MISSING))
+    payment = order.pop('payment', _MISSING)
+    if (isinstance(payment, dict) and len(payment) == 3 and
+            payment.get('status') == SANDBOX_PAYMENT_STATUS and
+            payment.get('note') == SANDBOX_PAYMENT_NOTE and 'token' in payment):
+        payment = (payment['token'],)
+    record.payment = payment
+    record.fulfillment = _pack_list(order.pop('fulfillment', _MISSING), FulfillmentRecord)
+    record.agent = order.pop('agent', _MISSING)
+    record.extra = order or None
+    return record
+
+
+def sizeof(value):
+    """
+    Approximate bytes a packed order adds: its own objects, not the
+    product refs, enum members, key shapes and interned strings it shares.
+    """
+    if value is None or value is _MISSING or isinstance(value, (bool, enum.Enum, ProductRef)):
+        return 0
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    elif isinstance(value, list):
+        size += sum(sizeof(v) for v in value)
+    elif isinstance(value, tuple):
+        if value and id(value[0]) in _SHAPE_IDS:
+            size += sum(sizeof(v) for k, v in zip(value[0], value[1:]) if k not in _SHARED_FIELDS)
+        else:
+            size += sum(sizeof(v) for v in value)
+    elif hasattr(type(value), '__slots__'):
+        size += sum(sizeof(getattr(value, slot)) for slot in type(value).__slots__
+                    if slot != 'product_id')
+    return size
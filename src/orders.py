@@ -0,0 +1,783 @@
+"""
+Order storage backends
+
+All order reads and writes go through an OrderStore so the backend can be
+picked in config.py:
+
+    MemoryOrderStore  - a bounded dict in this process (the original behaviour),
+                        holding compact records (see order_records.py)
+    SQLiteOrderStore  - SQLite in WAL mode with group commit, shared by workers
+    LogOrderStore     - append-only JSON-lines file, shared by workers and
+                        compacted now and then
+
+Orders are plain JSON-serializable dicts keyed by "order_id". Listing is
+paged by a per-store sequence number that increases with creation order,
+so a page costs time proportional to its size, not to the table size.
+"""
+
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:     # Windows: single-process dev server, no file locks
+    fcntl = None
+
+import order_records
+
+
+class OrderStore:
+    """Interface every order backend implements"""
+
+    # Whether orders survive a restart and are visible to other workers
+    persistent = False
+
+    def put(self, order):
+        """Insert or replace an order"""
+        raise NotImplementedError
+
+    def put_many(self, orders):
+        """Insert or replace several orders; backends may write them together"""
+        for order in orders:
+            self.put(order)
+
+    def get(self, order_id):
+        """Return the order dict, or None"""
+        raise NotImplementedError
+
+    def page(self, limit=10, before=None, after=None, status=None, email=None,
+             created_from=None, created_to=None):
+        """
+        Return (orders, before_cursor, after_cursor) for one page, oldest first.
+
+        With no cursor this is the newest page. `before`/`after` are cursors
+        from a previous page: pass `before` to step back to older orders and
+        `after` to fetch orders created since. before_cursor is None when
+        there is nothing older; after_cursor is always set for polling.
+        `created_from`/`created_to` are inclusive ISO-8601 string bounds.
+        """
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": type(self).__name__, "count": self.count()}
+
+    def close(self):
+        pass
+
+
+def _buyer_email(order):
+    buyer = order.get('buyer')
+    email = buyer.get('email') if isinstance(buyer, dict) else None
+    return email.lower() if isinstance(email, str) else None
+
+
+def _before_cursor(seqs, more):
+    return seqs[0] if seqs and more else None
+
+
+def _after_cursor(seqs, after):
+    return seqs[-1] if seqs else after
+
+
+class OrderTimeline:
+    """
+    Creation-ordered index of orders for the in-process backends.
+
+    Entries are keyed by sequence number. Besides the list of all seqs,
+    seqs are kept per status and per buyer email so filtered pages start
+    at the right place with bisect. Removed entries stay in the lists as
+    tombstones until they outnumber the live ones, then the lists are
+    compacted in one pass.
+    """
+
+    def __init__(self):
+        self._entries = {}     # seq -> [order_id, created_at, status, email, live]
+        self._all = []         # ascending seqs
+        self._by_status = {}   # status -> ascending seqs
+        self._by_email = {}    # lowercased buyer email -> ascending seqs
+        self._live = 0
+
+    def __len__(self):
+        return self._live
+
+    def order_id(self, seq):
+        return self._entries[seq][0]
+
+    def _lists(self, status, email):
+        lists = [self._all, self._by_status.setdefault(status, [])]
+        if email:
+            lists.append(self._by_email.setdefault(email, []))
+        return lists
+
+    def add(self, seq, order):
+        """Index a new order, or refresh the metadata of an existing seq"""
+        status, email = order.get('status'), _buyer_email(order)
+        entry = self._entries.get(seq)
+        if entry is not None:
+            if not entry[4]:
+                return
+            entry[0], entry[1] = order['order_id'], order.get('created_at', entry[1])
+            if (entry[2], entry[3]) == (status, email):
+                return
+            # Status or buyer changed: move the seq between secondary lists
+            for seqs in self._lists(entry[2], entry[3])[1:]:
+                i = bisect.bisect_left(seqs, seq)
+                if i < len(seqs) and seqs[i] == seq:
+                    del seqs[i]
+            entry[2], entry[3] = status, email
+            for seqs in self._lists(status, email)[1:]:
+                bisect.insort(seqs, seq)
+            return
+
+        self._entries[seq] = [order['order_id'], order.get('created_at', ''), status, email, True]
+        self._live += 1
+        for seqs in self._lists(status, email):
+            if seqs and seqs[-1] > seq:
+                bisect.insort(seqs, seq)
+            else:
+                seqs.append(seq)
+
+    def remove(self, seq):
+        entry = self._entries.get(seq)
+        if entry is None or not entry[4]:
+            return
+        entry[4] = False
+        self._live -= 1
+        if len(self._entries) > 1024 and len(self._entries) > 2 * self._live:
+            self._compact()
+
+    def _compact(self):
+        self._entries = {seq: e for seq, e in self._entries.items() if e[4]}
+        self._all = [seq for seq in self._all if seq in self._entries]
+        for lists in (self._by_status, self._by_email):
+            for key in list(lists):
+                lists[key] = [seq for seq in lists[key] if seq in self._entries]
+                if not lists[key]:
+                    del lists[key]
+
+    def page(self, limit, before=None, after=None, status=None, email=None,
+             created_from=None, created_to=None):
+        """Return (seqs oldest first, has_older) for one page"""
+        if email:
+            seqs = self._by_email.get(email.lower(), [])
+        elif status:
+            seqs = self._by_status.get(status, [])
+        else:
+            seqs = self._all
+
+        lo, hi = 0, len(seqs)
+        if after is not None:
+            lo = bisect.bisect_right(seqs, after)
+        if before is not None:
+            hi = max(lo, bisect.bisect_left(seqs, before, lo))
+        created = lambda seq: self._entries[seq][1]
+        if created_from:
+            lo = bisect.bisect_left(seqs, created_from, lo, hi, key=created)
+        if created_to:
+            # Bounds are inclusive, so a date-only bound covers that whole day
+            hi = bisect.bisect_right(seqs, created_to + '\uffff', lo, hi, key=created)
+
+        def matches(seq):
+            entry = self._entries[seq]
+            return entry[4] and (not status or entry[2] == status) \
+                and (not email or entry[3] == email.lower())
+
+        # Walk forward from an `after` cursor, otherwise back from the newest
+        forward = after is not None and before is None
+        positions = range(lo, hi) if forward else range(hi - 1, lo - 1, -1)
+        found = []
+        for i in positions:
+            if matches(seqs[i]):
+                found.append(seqs[i])
+                if len(found) > limit:
+                    break
+        more = len(found) > limit
+        found = found[:limit]
+        if forward:
+            return found, True
+        found.reverse()
+        return found, more
+
+
+class MemoryOrderStore(OrderStore):
+    """
+    Orders in a dict - fast, but per-process and lost on restart.
+
+    The dict is bounded so a long-running worker's memory stays flat:
+    orders expire after `ttl` seconds (`test_ttl` for TEST_ orders), and
+    the least recently used are evicted once there are more than
+    `max_entries` orders or they take more than `max_bytes`. A limit of 0
+    disables it.
+
+    Orders are kept packed as order_records.OrderRecord; get() and page()
+    build a fresh dict per order they return.
+    """
+
+    def __init__(self, max_entries=0, max_bytes=0, ttl=0, test_ttl=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.test_ttl = test_ttl
+        self._orders = {}           # order_id -> OrderRecord
+        self._lru = OrderedDict()   # order_id -> (size, expires_at, seq), least recent first
+        self._timeline = OrderTimeline()
+        self._seq = 0
+        self._expiry = {}           # ttl -> deque of (expires_at, order_id), soonest first
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.high_water_bytes = 0
+        self.evictions = {"capacity": 0, "bytes": 0, "ttl": 0}
+
+    def _ttl_for(self, order_id):
+        if order_id.startswith('TEST_') and self.test_ttl:
+            return self.test_ttl
+        return self.ttl
+
+    def _discard(self, order_id):
+        del self._orders[order_id]
+        size, _, seq = self._lru.pop(order_id)
+        self._timeline.remove(seq)
+        self.bytes -= size
+
+    def _expire(self, now):
+        # Each TTL class expires in insertion order, so only the heads can be due
+        for queue in self._expiry.values():
+            while queue and queue[0][0] <= now:
+                expires_at, order_id = queue.popleft()
+                entry = self._lru.get(order_id)
+                if entry and entry[1] == expires_at:
+                    self._discard(order_id)
+                    self.evictions["ttl"] += 1
+
+    def put(self, order):
+        order_id = order['order_id']
+        record = order_records.pack(order)
+        size = order_records.sizeof(record)
+        now = time.monotonic()
+        ttl = self._ttl_for(order_id)
+        expires_at = now + ttl if ttl else None
+
+        with self._lock:
+            previous = self._lru.pop(order_id, None)
+            if previous:
+                # Updating an order keeps its place in the timeline
+                seq = previous[2]
+                self.bytes -= previous[0]
+            else:
+                self._seq += 1
+                seq = self._seq
+            self._orders[order_id] = record
+            self._lru[order_id] = (size, expires_at, seq)
+            self._timeline.add(seq, order)
+            if expires_at is not None:
+                self._expiry.setdefault(ttl, deque()).append((expires_at, order_id))
+            self.bytes += size
+            self.high_water_bytes = max(self.high_water_bytes, self.bytes)
+
+            self._expire(now)
+            while self.max_entries and len(self._orders) > self.max_entries:
+                self._discard(next(iter(self._lru)))
+                self.evictions["capacity"] += 1
+            while self.max_bytes and self.bytes > self.max_bytes and len(self._orders) > 1:
+                self._discard(next(iter(self._lru)))
+                self.evictions["bytes"] += 1
+
+    def get(self, order_id):
+        with self._lock:
+            entry = self._lru.get(order_id)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                self._discard(order_id)
+                self.evictions["ttl"] += 1
+                return None
+            self._lru.move_to_end(order_id)
+            record = self._orders[order_id]
+        return record.unpack()
+
+    def page(self, limit=10, before=None, after=None, status=None, email=None,
+             created_from=None, created_to=None):
+        with self._lock:
+            self._expire(time.monotonic())
+            seqs, more = self._timeline.page(limit, before, after, status, email,
+                                             created_from, created_to)
+            records = [self._orders[self._timeline.order_id(seq)] for seq in seqs]
+        return [record.unpack() for record in records], _before_cursor(seqs, more), _after_cursor(seqs, after)
+
+    def count(self):
+        return len(self._orders)
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "count": len(self._orders),
+            "bytes": self.bytes,
+            "high_water_bytes": self.high_water_bytes,
+            "evictions": dict(self.evictions),
+            "limits": {
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "test_ttl": self.test_ttl,
+            },
+        }
+
+
+class SQLiteOrderStore(OrderStore):
+    """
+    Orders in SQLite using WAL mode, so readers never block the writer.
+
+    Writes are group-committed: put() queues the row and waits while a
+    single writer thread commits everything queued within batch_ms in one
+    transaction. Concurrent checkouts share one fsync instead of each
+    taking the database lock in turn.
+    """
+
+    persistent = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS orders (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT NOT NULL UNIQUE,
+            body TEXT NOT NULL
+        )
+    """
+
+    # Listing columns, added to databases created before they existed
+    COLUMNS = {"created_at": "TEXT", "status": "TEXT", "email": "TEXT"}
+    INDEXES = [
+        "CREATE INDEX IF NOT EXISTS orders_created ON orders (created_at)",
+        "CREATE INDEX IF NOT EXISTS orders_status ON orders (status, seq)",
+        "CREATE INDEX IF NOT EXISTS orders_email ON orders (email, seq)",
+    ]
+
+    # Running row count, kept by triggers in the writing transaction so
+    # count() doesn't scan the table. An upsert that updates fires neither.
+    COUNTER = [
+        "CREATE TABLE IF NOT EXISTS order_count (id INTEGER PRIMARY KEY CHECK (id = 0), n INTEGER NOT NULL)",
+        "CREATE TRIGGER IF NOT EXISTS order_count_insert AFTER INSERT ON orders "
+        "BEGIN UPDATE order_count SET n = n + 1 WHERE id = 0; END",
+        "CREATE TRIGGER IF NOT EXISTS order_count_delete AFTER DELETE ON orders "
+        "BEGIN UPDATE order_count SET n = n - 1 WHERE id = 0; END",
+        # Databases from before the counter are counted once, here
+        "INSERT OR IGNORE INTO order_count (id, n) SELECT 0, COUNT(*) FROM orders",
+    ]
+
+    def __init__(self, path, batch_ms=2):
+        self.path = path
+        self.batch_ms = batch_ms
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._queue = []
+        self._writer_pid = None
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(self.SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(orders)")}
+        for column, sql_type in self.COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE orders ADD COLUMN {column} {sql_type}")
+                conn.execute(f"UPDATE orders SET {column} = json_extract(body, '$.{column}')"
+                             if column != 'email' else
+                             "UPDATE orders SET email = lower(json_extract(body, '$.buyer.email'))")
+        for statement in self.INDEXES:
+            conn.execute(statement)
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in self.COUNTER:
+            conn.execute(statement)
+        conn.execute("COMMIT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        # One connection per thread, and never one inherited across fork()
+        cached = getattr(self._local, 'conn', None)
+        if cached is None or cached[0] != os.getpid():
+            cached = (os.getpid(), self._connect())
+            self._local.conn = cached
+        return cached[1]
+
+    def _ensure_writer(self):
+        if self._writer_pid != os.getpid():
+            self._writer_pid = os.getpid()
+            self._queue = []
+            threading.Thread(target=self._write_loop, name='order-store-writer',
+                             daemon=True).start()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            # Give concurrent requests a moment to join this transaction
+            time.sleep(self.batch_ms / 1000)
+            with self._cond:
+                batch, self._queue = self._queue, []
+
+            error = None
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT INTO orders (order_id, body, created_at, status, email) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(order_id) DO UPDATE SET body = excluded.body, "
+                    "status = excluded.status, email = excluded.email",
+                    [pending['row'] for pending in batch])
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                error = e
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            for pending in batch:
+                pending['error'] = error
+                pending['done'].set()
+
+    def put(self, order):
+        self.put_many([order])
+
+    def put_many(self, orders):
+        pending = [{
+            "row": (order['order_id'], json.dumps(order), order.get('created_at', ''),
+                    order.get('status'), _buyer_email(order)),
+            "done": threading.Event(),
+            "error": None,
+        } for order in orders]
+        if not pending:
+            return
+        with self._cond:
+            self._ensure_writer()
+            self._queue.extend(pending)
+            self._cond.notify()
+        for item in pending:
+            item['done'].wait()
+            if item['error']:
+                raise item['error']
+
+    def get(self, order_id):
+        row = self._reader().execute(
+            "SELECT body FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def page(self, limit=10, before=None, after=None, status=None, email=None,
+             created_from=None, created_to=None):
+        where, params = [], []
+        for clause, value in (("seq < ?", before), ("seq > ?", after),
+                              ("status = ?", status),
+                              ("email = ?", email.lower() if email else None),
+                              ("created_at >= ?", created_from),
+                              ("created_at <= ?", created_to + '\uffff' if created_to else None)):
+            if value is not None and value != '':
+                where.append(clause)
+                params.append(value)
+        forward = after is not None and before is None
+        sql = ("SELECT seq, body FROM orders"
+               + (" WHERE " + " AND ".join(where) if where else "")
+               + (" ORDER BY seq ASC" if forward else " ORDER BY seq DESC")
+               + " LIMIT ?")
+        rows = self._reader().execute(sql, params + [limit + 1]).fetchall()
+        more = forward or len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+        seqs = [seq for seq, _ in rows]
+        orders = [json.loads(body) for _, body in rows]
+        return orders, _before_cursor(seqs, more), _after_cursor(seqs, after)
+
+    def count(self):
+        return self._reader().execute("SELECT n FROM order_count WHERE id = 0").fetchone()[0]
+
+
+class LogOrderStore(OrderStore):
+    """
+    Orders appended to a log file, one "<order_id>\\t<json>\\n" line each.
+
+    Every worker appends with O_APPEND and keeps its own index of
+    order_id -> (seq, offset, length), where seq is 1 + the file offset of the
+    order's first line (plus the file's base, below). On a lookup miss the
+    index catches up by scanning only the bytes other workers appended
+    since the last scan. Rewriting an order appends a new line; the latest
+    line wins.
+
+    Orders expire like in the memory store: `ttl` seconds after their
+    created_at (`test_ttl` for TEST_ orders); expired orders drop out of the
+    index and their later lines are skipped. At most every
+    `compact_seconds`, once superseded and expired lines make up most of a
+    file over COMPACT_MIN_BYTES, the live orders are rewritten to a new file
+    that is renamed into place. Its lines carry their seq
+    ("<order_id>\\t<seq>\\t<json>") and it starts with "#base <n>", the
+    old file's end, so new seqs keep increasing and cursors stay valid.
+    Appends hold a shared flock on "<path>.lock" and compaction an
+    exclusive one; other workers notice the new file and reload it.
+    """
+
+    persistent = True
+    COMPACT_MIN_BYTES = 1 << 20
+
+    def __init__(self, path, fsync=False, ttl=0, test_ttl=0, compact_seconds=300):
+        self.path = path
+        self.fsync = fsync
+        self.ttl = ttl
+        self.test_ttl = test_ttl
+        self.compact_seconds = compact_seconds
+        self.compactions = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._lock_fd = None
+        self._next_compact = time.monotonic() + compact_seconds
+        with self._lock, self._file_lock():
+            self._open()
+
+    def _file_lock(self, exclusive=False):
+        """flock on "<path>.lock"; each forked worker needs its own open file for it"""
+        if self._lock_fd is None or self._lock_pid != os.getpid():
+            self._lock_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock_pid = os.getpid()
+        return _FileLock(self._lock_fd, exclusive)
+
+    def _open(self):
+        """(Re)open the log and index it from the start (hold _lock)"""
+        self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+        self._index = {}
+        self._timeline = OrderTimeline()
+        self._expiry = {}       # ttl -> deque of (expires_at, order_id, seq), soonest first
+        self._base = 0
+        self._scanned = 0
+        self._live_bytes = 0
+        # A crash mid-append can leave a partial last line; terminate it so
+        # the next record starts cleanly (the fragment is skipped on scan).
+        size = os.fstat(self._fd).st_size
+        if size and os.pread(self._fd, 1, size - 1) != b'\n':
+            os.write(self._fd, b'\n')
+        self._catch_up()
+
+    def _replaced(self):
+        """True once another worker has renamed a compacted file into place"""
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            return False
+
+    def _ttl_for(self, order_id):
+        if order_id.startswith('TEST_') and self.test_ttl:
+            return self.test_ttl
+        return self.ttl
+
+    def _catch_up(self):
+        """Index any complete lines appended since the last scan (hold _lock)"""
+        if self._replaced():
+            os.close(self._fd)
+            self._open()
+            return
+        size = os.fstat(self._fd).st_size
+        if size <= self._scanned:
+            return
+        now = time.time()
+        data = os.pread(self._fd, size - self._scanned, self._scanned)
+        offset = self._scanned
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break
+            if line.startswith(b'#base ') and offset == 0:
+                self._base = int(line[6:])
+            order_id, tab, rest = line.partition(b'\t')
+            seq = None
+            if tab and not rest.startswith(b'{'):
+                seq, _, rest = rest.partition(b'\t')
+                seq = int(seq) if seq.isdigit() else None
+            body = rest if tab else b''
+            try:
+                order = json.loads(body) if body else None
+            except ValueError:
+                order = None
+            if order is not None:
+                self._index_line(order_id.decode(), order, seq, offset + len(line) - len(body),
+                                 len(body) - 1, now)
+            offset += len(line)
+        self._scanned = offset
+
+    def _index_line(self, order_id, order, seq, offset, length, now):
+        previous = self._index.get(order_id)
+        if previous is None:
+            ttl = self._ttl_for(order_id)
+            expires_at = _created_epoch(order, now) + ttl if ttl else None
+            if expires_at is not None and expires_at <= now:
+                return      # expired: neither indexed nor revived by later lines
+            seq = seq or self._base + offset - len(order_id)   # from 1, like the other stores
+            if expires_at is not None:
+                self._expiry.setdefault(ttl, deque()).append((expires_at, order_id, seq))
+        else:
+            seq = previous[0]
+            self._live_bytes -= previous[2]
+        self._index[order_id] = (seq, offset, length)
+        self._live_bytes += length
+        self._timeline.add(seq, order)
+
+    def _expire(self, now):
+        # Each TTL class expires in creation order, so only the heads can be due
+        for queue in self._expiry.values():
+            while queue and queue[0][0] <= now:
+                _, order_id, seq = queue.popleft()
+                location = self._index.get(order_id)
+                if location and location[0] == seq:
+                    del self._index[order_id]
+                    self._timeline.remove(seq)
+                    self._live_bytes -= location[2]
+                    self.expired += 1
+
+    def _read(self, location):
+        _, offset, length = location
+        return json.loads(os.pread(self._fd, length, offset))
+
+    def put(self, order):
+        self.put_many([order])
+
+    def put_many(self, orders):
+        data = b''.join(f"{order['order_id']}\t{json.dumps(order)}\n".encode()
+                        for order in orders)
+        if not data:
+            return
+        with self._lock:
+            with self._file_lock():
+                if self._replaced():
+                    self._catch_up()    # write to the new file, not the old one
+                os.write(self._fd, data)
+                if self.fsync:
+                    os.fsync(self._fd)
+                self._catch_up()
+            self._expire(time.time())
+            if time.monotonic() >= self._next_compact:
+                self._next_compact = time.monotonic() + self.compact_seconds
+                self._maybe_compact()
+
+    def _maybe_compact(self):
+        """Rewrite the live orders to a new file when most of this one is dead (hold _lock)"""
+        size = os.fstat(self._fd).st_size
+        if size < self.COMPACT_MIN_BYTES or size < 2 * self._live_bytes:
+            return
+        with self._file_lock(exclusive=True):
+            self._catch_up()    # everything other workers wrote, or their compacted file
+            self._expire(time.time())
+            size = os.fstat(self._fd).st_size
+            if size < self.COMPACT_MIN_BYTES or size < 2 * self._live_bytes:
+                return
+            temp = self.path + '.compact'
+            with open(temp, 'wb') as out:
+                out.write(f"#base {self._base + size}\n".encode())
+                for order_id, (seq, offset, length) in sorted(self._index.items(), key=lambda kv: kv[1][0]):
+                    out.write(f"{order_id}\t{seq}\t".encode() + os.pread(self._fd, length, offset) + b'\n')
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(temp, self.path)
+            os.close(self._fd)
+            self._open()
+            self.compactions += 1
+
+    def get(self, order_id):
+        # Under the lock: a compaction may swap the file being read
+        with self._lock:
+            location = self._index.get(order_id)
+            if location is None:
+                self._catch_up()
+                location = self._index.get(order_id)
+            if location is None:
+                return None
+            order = self._read(location)
+        ttl = self._ttl_for(order_id)
+        if ttl and _created_epoch(order, time.time()) + ttl <= time.time():
+            return None
+        return order
+
+    def page(self, limit=10, before=None, after=None, status=None, email=None,
+             created_from=None, created_to=None):
+        with self._lock:
+            self._catch_up()
+            self._expire(time.time())
+            seqs, more = self._timeline.page(limit, before, after, status, email,
+                                             created_from, created_to)
+            locations = [self._index[self._timeline.order_id(seq)] for seq in seqs]
+            orders = [self._read(location) for location in locations]
+        return orders, _before_cursor(seqs, more), _after_cursor(seqs, after)
+
+    def count(self):
+        with self._lock:
+            self._catch_up()
+            self._expire(time.time())
+            return len(self._index)
+
+    def stats(self):
+        with self._lock:
+            self._catch_up()
+            self._expire(time.time())
+            return {
+                "backend": type(self).__name__,
+                "count": len(self._index),
+                "file_bytes": os.fstat(self._fd).st_size,
+                "live_bytes": self._live_bytes,
+                "expired": self.expired,
+                "compactions": self.compactions,
+                "limits": {"ttl": self.ttl, "test_ttl": self.test_ttl},
+            }
+
+    def close(self):
+        os.close(self._fd)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+
+
+class _FileLock:
+    """flock() held for a with block; does nothing without fcntl"""
+
+    def __init__(self, fd, exclusive):
+        self.fd = fd
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+def _created_epoch(order, default):
+    """An order's created_at as epoch seconds, or `default` if it has none"""
+    created = order.get('created_at')
+    try:
+        return datetime.fromisoformat(created.rstrip('Z')).replace(tzinfo=timezone.utc).timestamp()
+    except (AttributeError, ValueError):
+        return default
+
+
+def make_order_store(kind, path=None, **options):
+    """Build the backend named in config.ORDER_STORE"""
+    if kind == 'memory':
+        return MemoryOrderStore(
+            max_entries=options.get('max_entries', 0),
+            max_bytes=options.get('max_bytes', 0),
+            ttl=options.get('ttl', 0),
+            test_ttl=options.get('test_ttl', 0),
+        )
+    if kind == 'sqlite':
+        return SQLiteOrderStore(path, batch_ms=options.get('batch_ms', 2))
+    if kind == 'log':
+        return LogOrderStore(path, fsync=options.get('fsync', False),
+                             ttl=options.get('ttl', 0), test_ttl=options.get('test_ttl', 0),
+                             compact_seconds=options.get('compact_seconds', 300))
+    raise ValueError(f"Unknown order store: {kind!r} (expected memory, sqlite or log)")
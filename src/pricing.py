@@ -0,0 +1,317 @@
+"""
+Cart pricing in integer minor units
+
+Catalog prices are decimal numbers (18.74 USD); adding them up as floats
+drifts by fractions of a cent. PricingEngine converts every price to
+integer minor units (cents) once, when the catalog loads or a product
+changes, and compiles the pricing rules into lookup tables:
+
+    tax       - rate by "COUNTRY-REGION" (falling back to "COUNTRY"),
+                optionally per product type
+    shipping  - first-item / additional-item charge by the product's
+                fulfillment value or type, free over a threshold
+    promos    - percent or fixed discounts, optionally limited to product
+                types (a list; a single string is taken as one type) or a
+                minimum subtotal of those types' items, or free shipping
+
+A cart is then priced in one pass over its line items. Amounts go back out
+as plain numbers in the currency's major unit (56.22), exact to the cent.
+
+Rules are a dict (or a JSON file, see load_rules):
+
+    {
+        "currency": "USD",
+        "tax": {"US-CA": 7.25, "US-WA": {"*": 6.5, "subscription": 0}},
+        "shipping": {"physical": {"first": 4.99, "additional": 1.50}},
+        "free_shipping_over": 35,
+        "promos": {"SANDBOX10": {"percent": 10},
+                   "BOOKS5": {"amount": 5, "min_subtotal": 20, "types": ["physical"]},
+                   "FREESHIP": {"free_shipping": true}}
+    }
+"""
+
+import json
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Digits after the decimal point, for currencies that don't use two
+MINOR_DIGITS = {"JPY": 0, "KRW": 0, "VND": 0, "BHD": 3, "KWD": 3, "OMR": 3}
+
+PPM = 1000000   # tax and percent-off rates are kept in parts per million
+
+
+class PricingRulesError(ValueError):
+    """Raised when pricing rules cannot be read or fail validation"""
+
+    def __init__(self, source, problems):
+        self.source = source
+        self.problems = problems
+        super().__init__(f"{source}: " + "; ".join(problems))
+
+
+def to_minor(amount, currency="USD"):
+    """Decimal amount -> integer minor units, rounded half up"""
+    minor = Decimal(str(amount)).scaleb(MINOR_DIGITS.get(currency, 2))
+    return int(minor.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor, currency="USD"):
+    """Integer minor units -> the number to put in a response"""
+    scale = 10 ** MINOR_DIGITS.get(currency, 2)
+    return minor // scale if minor % scale == 0 else minor / scale
+
+
+def _ppm(percent):
+    return int((Decimal(str(percent)) * 10000).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def _apply_rate(amount, ppm):
+    return (amount * ppm + PPM // 2) // PPM
+
+
+def load_rules(path):
+    """Read pricing rules from a JSON file"""
+    try:
+        with open(path) as f:
+            rules = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PricingRulesError(path, [str(e)])
+    if not isinstance(rules, dict):
+        raise PricingRulesError(path, ["rules must be a JSON object"])
+    return rules
+
+
+def compile_rules(rules, source="pricing rules"):
+    """
+    Validate rules and build the lookup tables PricingEngine uses:
+    (currency, tax, shipping, free_shipping_over, promos).
+    """
+    problems = []
+    currency = rules.get('currency', 'USD')
+
+    def amount(value, where):
+        try:
+            minor = to_minor(value, currency)
+        except (InvalidOperation, TypeError, ValueError):
+            minor = -1
+        if isinstance(value, bool) or minor < 0:
+            problems.append(f"{where}: expected an amount >= 0, got {value!r}")
+            return 0
+        return minor
+
+    def percent(value, where):
+        try:
+            ppm = _ppm(value)
+        except (InvalidOperation, TypeError, ValueError):
+            ppm = -1
+        if isinstance(value, bool) or not 0 <= ppm <= PPM:
+            problems.append(f"{where}: expected a percentage from 0 to 100, got {value!r}")
+            return 0
+        return ppm
+
+    # region -> (default rate, {product type: rate})
+    tax = {}
+    for region, rates in (rules.get('tax') or {}).items():
+        if not isinstance(rates, dict):
+            rates = {"*": rates}
+        by_type = {t: percent(r, f"tax.{region}.{t}") for t, r in rates.items()}
+        tax[region.upper()] = (by_type.pop('*', 0), by_type)
+
+    # fulfillment value or product type -> (first item, each additional item)
+    shipping = {}
+    for key, rule in (rules.get('shipping') or {}).items():
+        if not isinstance(rule, dict):
+            rule = {"first": rule}
+        first = amount(rule.get('first', 0), f"shipping.{key}.first")
+        shipping[key] = (first, amount(rule.get('additional', first), f"shipping.{key}.additional"))
+
+    free_over = rules.get('free_shipping_over')
+    free_over = None if free_over is None else amount(free_over, "free_shipping_over")
+
+    # CODE -> (percent off, amount off, min subtotal, product types or None, free shipping)
+    promos = {}
+    for code, rule in (rules.get('promos') or {}).items():
+        if not isinstance(rule, dict):
+            problems.append(f"promos.{code}: expected an object")
+            continue
+        types = rule.get('types')
+        if isinstance(types, str):
+            types = [types]
+        elif types is not None and not (isinstance(types, list) and
+                                        all(isinstance(t, str) for t in types)):
+            problems.append(f"promos.{code}.types: expected a list of product types, got {types!r}")
+            types = None
+        promos[code.upper()] = (
+            percent(rule.get('percent', 0), f"promos.{code}.percent"),
+            amount(rule.get('amount', 0), f"promos.{code}.amount"),
+            amount(rule.get('min_subtotal', 0), f"promos.{code}.min_subtotal"),
+            frozenset(types) if types else None,
+            bool(rule.get('free_shipping')),
+        )
+
+    if problems:
+        raise PricingRulesError(source, problems)
+    return currency, tax, shipping, free_over, promos
+
+
+class PricingEngine:
+    """Prices carts from compiled rules; per-product prices kept in sync with a Catalog"""
+
+    def __init__(self, catalog, rules):
+        self.currency, self._tax, self._shipping, self._free_over, self._promos = compile_rules(rules)
+        self._catalog = catalog
+        self._entries = {pid: self._compile(p) for pid, p in catalog.products.items()}
+        catalog.on_change(self.refresh)
+
+    def _compile(self, product):
+        """(product, unit price in minor units, type, shipping key, currency)"""
+        currency = product.get('currency', 'USD')
+        fulfillment = product.get('fulfillment')
+        product_type = product.get('type')
+        if fulfillment in self._shipping:
+            ship = fulfillment
+        elif product_type in self._shipping:
+            ship = product_type
+        else:
+            ship = None
+        return product, to_minor(product['price'], currency), product_type, ship, currency
+
+    def refresh(self, product_id):
+        product = self._catalog.get(product_id)
+        if product:
+            self._entries[product_id] = self._compile(product)
+        else:
+            self._entries.pop(product_id, None)
+
+    def promo_codes(self):
+        return sorted(self._promos)
+
+    def quote(self, items, products, promo_code=None, address=None):
+        """
+        Price a cart. Returns ({"line_items", "totals"}, None) or
+        (None, error) where error is the 400 response body. `products` is
+        the catalog to price against.
+        """
+        currency = self.currency
+        entries = self._entries
+        promo_code = str(promo_code).upper() if promo_code else None
+        line_items = []
+        subtotal = 0
+        by_type = {}    # product type -> subtotal, for tax and type-limited promos
+        shipped = {}    # shipping key -> quantity
+
+        for item in items:
+            product_id = item.get('product_id')
+            quantity = item.get('quantity', 1)
+
+            product = products.get(product_id)
+            if not product:
+                return None, {
+                    "error": f"Product not found: {product_id}",
+                    "available_products": list(products.keys())
+                }
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+                return None, {"error": f"Invalid quantity for {product_id}: {quantity!r}"}
+
+            entry = entries.get(product_id)
+            if entry is None or entry[0] is not product:
+                # Products swapped in by a reload without changing aren't
+                # re-announced; compile them on first use
+                entry = self._compile(product)
+                if self._catalog.get(product_id) is product:
+                    entries[product_id] = entry
+            _, unit, product_type, ship, product_currency = entry
+            if product_currency != currency:
+                return None, {"error": f"Product {product_id} is priced in {product_currency}; "
+                                       f"carts are priced in {currency}"}
+
+            line_total = unit * quantity
+            subtotal += line_total
+            by_type[product_type] = by_type.get(product_type, 0) + line_total
+            if ship is not None:
+                shipped[ship] = shipped.get(ship, 0) + quantity
+
+            line_item = {
+                "product_id": product_id,
+                "product_name": product['name'],
+                "quantity": quantity,
+                "unit_price": product['price'],
+                "total": from_minor(line_total, currency)
+            }
+            if item.get('date'):
+                line_item["date"] = item['date']
+            line_items.append(line_item)
+
+        discount, free_shipping, error = self._discount(promo_code, by_type)
+        if error:
+            return None, error
+
+        shipping = 0
+        if shipped and not free_shipping and (self._free_over is None or
+                                              subtotal - discount < self._free_over):
+            for key, quantity in shipped.items():
+                first, additional = self._shipping[key]
+                shipping += first + additional * (quantity - 1)
+
+        tax, error = self._tax_for(address, by_type)
+        if error:
+            return None, error
+
+        totals = {
+            "subtotal": from_minor(subtotal, currency),
+            "discount": from_minor(discount, currency),
+            "tax": from_minor(tax, currency),
+            "shipping": from_minor(shipping, currency),
+            "total": from_minor(subtotal - discount + tax + shipping, currency),
+            "currency": currency,
+        }
+        if promo_code:
+            totals["promo_code"] = promo_code
+        return {"line_items": line_items, "totals": totals}, None
+
+    def _discount(self, promo_code, by_type):
+        """(discount, free shipping, error); by_type is reduced by each type's share"""
+        if not promo_code:
+            return 0, False, None
+        promo = self._promos.get(promo_code)
+        if promo is None:
+            return 0, False, {
+                "error": f"Unknown promo code: {promo_code}",
+                "available_promo_codes": self.promo_codes()
+            }
+        percent, amount, min_subtotal, types, free_shipping = promo
+        eligible_types = [t for t in by_type if types is None or t in types]
+        eligible = sum(by_type[t] for t in eligible_types)
+        # The minimum counts eligible items only: BOOKS5 needs 20.00 of physical items
+        if eligible < min_subtotal:
+            return 0, False, {
+                "error": f"Promo code {promo_code} needs a subtotal of at least "
+                         f"{from_minor(min_subtotal, self.currency)} {self.currency}"
+                         + (f" on {', '.join(sorted(types))} items" if types else "")
+            }
+
+        discount = min(eligible, _apply_rate(eligible, percent) + amount)
+        if discount == 0:
+            return 0, free_shipping, None   # nothing eligible costs anything
+
+        # Tax is charged on what's left after the discount, split by type
+        left = discount
+        for i, product_type in enumerate(eligible_types):
+            share = left if i == len(eligible_types) - 1 else discount * by_type[product_type] // eligible
+            by_type[product_type] -= share
+            left -= share
+        return discount, free_shipping, None
+
+    def _tax_for(self, address, by_type):
+        if not address:
+            return 0, None
+        if not isinstance(address, dict):
+            return 0, {"error": "shipping_address must be an object",
+                       "example": {"country": "US", "region": "CA"}}
+        country = str(address.get('country') or '').upper()
+        region = str(address.get('region') or '').upper()
+        rates = self._tax.get(f"{country}-{region}") or self._tax.get(country)
+        if rates is None:
+            return 0, None
+        default, by_rate_type = rates
+        return sum(_apply_rate(amount, by_rate_type.get(t, default))
+                   for t, amount in by_type.items()), None
@@ -0,0 +1,165 @@
+"""
+Opt-in sampling profiler for finding where request time goes
+
+Set UCP_PROFILE_EVERY=N to profile one in every N requests to each route
+(per worker). Two modes, picked with UCP_PROFILE_MODE:
+
+    cprofile - run sampled requests under cProfile and merge the results
+               per route; dump as pstats text or a binary .pstats file
+    stack    - a background thread snapshots the sampled requests' Python
+               stacks every millisecond; dump as collapsed stacks
+               for flamegraph.pl / speedscope
+
+Only one request is profiled at a time per worker, so sampling never
+stacks profilers on top of each other. With UCP_PROFILE_EVERY unset no
+Profiler is built and no request hooks are registered.
+"""
+
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+MODES = ('cprofile', 'stack')
+SORTS = ('cumulative', 'tottime', 'ncalls')
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """1-in-N request sampler with per-route aggregates"""
+
+    def __init__(self, every, mode='cprofile', interval=0.001):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profile mode: {mode!r} (expected cprofile or stack)")
+        self.every = every
+        self.mode = mode
+        self.interval = interval
+        self._seen = {}         # route -> requests seen
+        self._samples = {}      # route -> requests profiled
+        self._stats = {}        # route -> pstats.Stats (cprofile mode)
+        self._stacks = {}       # route -> {collapsed stack: count} (stack mode)
+        self._active = {}       # thread id -> route being sampled (stack mode)
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler_pid = None
+
+    def start(self, route):
+        """Begin profiling this request if it is sampled; returns a token for stop()"""
+        seen = self._seen[route] = self._seen.get(route, 0) + 1
+        if seen % self.every or not self._busy.acquire(blocking=False):
+            return None
+        if self.mode == 'stack':
+            self._ensure_sampler()
+            self._active[threading.get_ident()] = route
+            self._wake.set()
+            return (route, None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler (e.g. a debugger) owns the hook
+            self._busy.release()
+            return None
+        return (route, profile)
+
+    def stop(self, token):
+        route, profile = token
+        if profile is None:
+            self._active.pop(threading.get_ident(), None)
+        else:
+            profile.disable()
+        self._busy.release()
+        with self._lock:
+            self._samples[route] = self._samples.get(route, 0) + 1
+            if profile is not None:
+                if route in self._stats:
+                    self._stats[route].add(profile)
+                else:
+                    self._stats[route] = pstats.Stats(profile)
+
+    # -- stack mode ----------------------------------------------------------
+
+    def _ensure_sampler(self):
+        if self._sampler_pid != os.getpid():
+            self._sampler_pid = os.getpid()
+            threading.Thread(target=self._sample_stacks, name='profiler', daemon=True).start()
+
+    def _sample_stacks(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            if not self._active:
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for thread_id, route in list(self._active.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(route)
+                collapsed = ';'.join(reversed(stack))
+                with self._lock:
+                    counts = self._stacks.setdefault(route, {})
+                    counts[collapsed] = counts.get(collapsed, 0) + 1
+
+    # -- reports -------------------------------------------------------------
+
+    def summary(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "every": self.every,
+                "routes": {
+                    route: {"requests": seen, "profiled": self._samples.get(route, 0)}
+                    for route, seen in sorted(self._seen.items())
+                },
+            }
+
+    def _merged_stats(self, route=None):
+        with self._lock:
+            selected = [s for r, s in self._stats.items() if route in (None, r)]
+            if not selected:
+                return None
+            merged = pstats.Stats()
+            merged.add(*selected)
+        return merged
+
+    def pstats_text(self, route=None, sort='cumulative', limit=50):
+        stats = self._merged_stats(route)
+        if stats is None:
+            return None
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def pstats_dump(self, route=None):
+        """Binary pstats, readable with pstats.Stats(path) or snakeviz"""
+        stats = self._merged_stats(route)
+        return None if stats is None else marshal.dumps(stats.stats)
+
+    def collapsed(self, route=None):
+        """One "frame;frame;... count" line per distinct stack"""
+        with self._lock:
+            lines = [
+                f"{stack} {count}"
+                for r, counts in sorted(self._stacks.items()) if route in (None, r)
+                for stack, count in sorted(counts.items())
+            ]
+        return '\n'.join(lines) + '\n' if lines else None
+
+    def reset(self):
+        with self._lock:
+            self._seen.clear()
+            self._samples.clear()
+            self._stats.clear()
+            self._stacks.clear()
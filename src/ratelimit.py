@@ -0,0 +1,197 @@
+"""
+Per-agent rate limiting and checkout admission control
+
+Each client IP address gets a token bucket per endpoint group (not the
+UCP-Agent header: a client picks that, and could dodge its limit with a
+new value per request). A request takes a token; tokens refill
+at `rate` per second up to `burst`. An empty bucket means 429 with a
+Retry-After telling the agent when the next token is due.
+
+Buckets live in process memory by default, so each gunicorn worker
+enforces its own limit. SQLiteBuckets keeps them in a file shared by all
+workers on the host so limits hold across the whole server.
+
+ConcurrencyLimit caps how many checkouts a worker runs at once. Past the
+cap, requests are turned away immediately (503) instead of queueing up
+behind each other until everything times out.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# A bucket idle long enough to have refilled completely is the same as no
+# bucket; an hour covers any sane rate/burst setting
+IDLE_SECONDS = 3600
+
+
+def _refill(tokens, stamp, now, rate, burst, cost):
+    """Token-bucket step -> (allowed, tokens left, seconds until `cost` is available)"""
+    tokens = min(burst, tokens + (now - stamp) * rate)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / rate
+
+
+class MemoryBuckets:
+    """
+    Buckets in least-recently-used order, split into stripes with a lock
+    each. Idle buckets, and past max_keys the least recently used, are
+    dropped from the old end as new ones come in, so a flood of new
+    clients costs O(1) per request rather than a scan of the table.
+    """
+
+    def __init__(self, stripes=64, max_keys=100000):
+        self._stripes = [(threading.Lock(), OrderedDict()) for _ in range(stripes)]
+        self._stripe_keys = max(1, max_keys // stripes)
+        self.max_keys = max_keys
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        lock, buckets = self._stripes[hash(key) % len(self._stripes)]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = [burst, now]
+            else:
+                buckets.move_to_end(key)
+            allowed, bucket[0], wait = _refill(bucket[0], bucket[1], now, rate, burst, cost)
+            bucket[1] = now
+            while len(buckets) > self._stripe_keys or now - next(iter(buckets.values()))[1] > IDLE_SECONDS:
+                buckets.popitem(last=False)
+        return allowed, bucket[0], wait
+
+    def __len__(self):
+        return sum(len(buckets) for _, buckets in self._stripes)
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite file, shared by every worker that opens it"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                stamp REAL NOT NULL
+            )
+        """)
+
+    def _conn(self):
+        # One connection per thread, reopened in each forked worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=OFF")  # losing a few tokens on power loss is fine
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.time()   # wall clock: shared across processes
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, stamp FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, stamp = row if row else (burst, now)
+            allowed, tokens, wait = _refill(tokens, min(stamp, now), now, rate, burst, cost)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, stamp) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            self._takes += 1
+            if self._takes % 10000 == 0:
+                conn.execute("DELETE FROM buckets WHERE stamp < ?", (now - IDLE_SECONDS,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, tokens, wait
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+
+class RateLimiter:
+    """Token buckets per (group, client) with per-group rate and burst"""
+
+    def __init__(self, rules, buckets=None):
+        self.rules = {group: rule for group, rule in rules.items() if rule}
+        self.buckets = buckets if buckets is not None else MemoryBuckets()
+        self.allowed = {group: 0 for group in self.rules}
+        self.limited = {group: 0 for group in self.rules}
+
+    def check(self, group, client, cost=1):
+        """
+        Take `cost` tokens from the client's bucket for `group`.
+
+        Returns None when allowed, or the whole seconds to wait before
+        retrying. Groups without a rule are unlimited. A bucket never holds
+        more than the burst, so a larger cost raises ValueError; callers
+        cap it with max_cost().
+        """
+        rule = self.rules.get(group)
+        if rule is None:
+            return None
+        rate, burst = rule
+        if cost > burst:
+            raise ValueError(f"cost {cost} exceeds the {group} burst of {burst}")
+        allowed, _, wait = self.buckets.take(f"{group}:{client}", rate, burst, cost)
+        if allowed:
+            self.allowed[group] += 1
+            return None
+        self.limited[group] += 1
+        return max(1, math.ceil(wait))
+
+    def max_cost(self, group):
+        """Most tokens one request can take from `group` (None: unlimited)"""
+        rule = self.rules.get(group)
+        return rule[1] if rule else None
+
+    def stats(self):
+        return {
+            "rules": {g: {"per_second": r, "burst": b} for g, (r, b) in self.rules.items()},
+            "allowed": dict(self.allowed),
+            "limited": dict(self.limited),
+            "clients": len(self.buckets),
+        }
+
+
+class ConcurrencyLimit:
+    """Non-blocking cap on requests in flight; 0 means unlimited"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """True if admitted; callers must release() afterwards"""
+        with self._lock:
+            if self.limit and self.in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "rejected": self.rejected}
+
+
+def make_buckets(kind, path):
+    """Build the bucket store named in config.RATE_LIMIT_STORE"""
+    if kind == 'memory':
+        return MemoryBuckets()
+    if kind == 'sqlite':
+        return SQLiteBuckets(path)
+    raise ValueError(f"Unknown rate limit store: {kind!r} (expected memory or sqlite)")
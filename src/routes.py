@@ -6,9 +6,35 @@ GitHub: https://github.com/steven2030/ucp-merchant
 Live: https://puddingheroes.com/api/ucp/
 """
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, g, jsonify, request, stream_with_context
 from datetime import datetime
+import hmac
+import itertools
+import queue
+import threading
+import time
 import uuid
+import zlib
+
+import config
+from cache import ResponseCache
+from catalog import Catalog, InvalidCursor, SORTS, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from analytics import SalesStats
+from catalog_loader import CatalogError, CatalogWatcher, load_products, reload_catalog
+from compression import Compressor
+from events import EventHub, EventStream, OrderLifecycle, Scheduler, last_event_id, sse_chunks
+from fulfillment import FulfillmentTable
+from idempotency import make_idempotency
+from inventory import make_inventory
+from jobs import JobQueue
+from metrics import Metrics
+from pricing import PricingEngine, PricingRulesError, load_rules
+from orders import make_order_store
+from profiling import Profiler, SORTS as PROFILE_SORTS
+from ratelimit import ConcurrencyLimit, RateLimiter, make_buckets
+from serialization import FastJSONProvider, ProductFragments, dumps_bytes
+from tenants import DEFAULT_TENANT, Tenant, TenantRegistry, load_manifest, tenant_file
+from werkzeug.local import LocalProxy
 
 ucp_bp = Blueprint('ucp', __name__, url_prefix='/api/ucp')
 
@@ -26,8 +52,38 @@ MERCHANT = {
 
 BASE_URL = "https://puddingheroes.com"  # Change for local dev
 
+# Cache-Control max-age (seconds) for the pre-encoded responses
+STATIC_MAX_AGE = 300    # discovery, docs, examples
+PRODUCT_MAX_AGE = 60    # product detail
+
+# Tax by "COUNTRY-REGION" or "COUNTRY" in percent (a dict sets rates per
+# product type, "*" for the rest), shipping by fulfillment value or product
+# type, and promo codes. Or set UCP_PRICING_RULES_PATH (see pricing.py).
+PRICING_RULES = {
+    "currency": "USD",
+    "tax": {
+        "US-CA": 7.25,
+        "US-NY": 4,
+        "US-TX": 6.25,
+        "US-WA": {"*": 6.5, "subscription": 0},
+        "US-OR": 0,
+        "GB": 20,
+        "DE": 19,
+    },
+    "shipping": {
+        "physical": {"first": 4.99, "additional": 1.50},
+    },
+    "free_shipping_over": 35,
+    "promos": {
+        "SANDBOX10": {"percent": 10},
+        "BOOKS5": {"amount": 5, "min_subtotal": 20, "types": ["physical"]},
+        "FREESHIP": {"free_shipping": True},
+    },
+}
+
 # =============================================================================
-# PRODUCT CATALOG - Edit these for your own products
+# PRODUCT CATALOG - Edit these for your own products, or point
+# UCP_CATALOG_PATH at a JSON/CSV/SQLite file (see catalog_loader.py)
 # =============================================================================
 
 PRODUCTS = {
@@ -89,6 +145,8 @@ PRODUCTS = {
         "fulfillment": "reservation_confirmation",
         "location": "Portland, OR",
         "in_stock": True,
+        "available_dates": ["2026-01-20", "2026-01-21", "2026-01-27", "2026-01-28"],
+        "slot_capacity": 1,
         "image_url": f"{BASE_URL}/images/signal-house.jpg"
     },
     "signal-house-weekend": {
@@ -101,6 +159,8 @@ PRODUCTS = {
         "fulfillment": "reservation_confirmation",
         "location": "Portland, OR",
         "in_stock": True,
+        "available_dates": ["2026-01-20", "2026-01-21", "2026-01-27", "2026-01-28"],
+        "slot_capacity": 1,
         "image_url": f"{BASE_URL}/images/signal-house.jpg"
     },
     "house-membership-monthly": {
@@ -157,21 +217,201 @@ PRODUCTS = {
     }
 }
 
-# In-memory order storage
-ORDERS = {}
+# =============================================================================
+# MERCHANT STATE - one set per tenant, built by build_tenant() (see TENANTS
+# below and tenants.py). Each name resolves to the merchant serving the
+# current request; with no tenants configured that is always the default
+# one, built from the settings above. Read and change products through
+# CATALOG so indexes and caches stay in sync (PRODUCTS is only the built-in
+# default).
+# =============================================================================
+
+TENANT = LocalProxy(lambda: TENANTS.current())
+CATALOG = LocalProxy(lambda: TENANTS.current().catalog)
+INVENTORY = LocalProxy(lambda: TENANTS.current().inventory)
+FRAGMENTS = LocalProxy(lambda: TENANTS.current().fragments)
+FULFILLMENT = LocalProxy(lambda: TENANTS.current().fulfillment)
+PRICING = LocalProxy(lambda: TENANTS.current().pricing)
+RESPONSE_CACHE = LocalProxy(lambda: TENANTS.current().response_cache)
+ORDERS = LocalProxy(lambda: TENANTS.current().orders)
+EVENTS = LocalProxy(lambda: TENANTS.current().events)
+LIFECYCLE = LocalProxy(lambda: TENANTS.current().lifecycle)
+SALES = LocalProxy(lambda: TENANTS.current().sales)
+
+# One thread runs every tenant's simulated fulfillment steps
+SCHEDULER = Scheduler()
+
+# Background fulfillment queue; None unless UCP_DEFERRED_FULFILLMENT is set.
+# Workers start once the job handlers are registered (DEFERRED FULFILLMENT).
+JOBS = None
+if config.DEFERRED_FULFILLMENT:
+    JOBS = JobQueue(config.JOB_QUEUE_PATH, workers=config.JOB_WORKERS,
+                    max_attempts=config.JOB_MAX_ATTEMPTS, backoff=config.JOB_BACKOFF_SECONDS)
+
+# Stored checkout responses for Idempotency-Key retries
+IDEMPOTENCY = make_idempotency(config.IDEMPOTENCY_STORE, config.IDEMPOTENCY_PATH,
+                               config.IDEMPOTENCY_MAX_ENTRIES, config.IDEMPOTENCY_TTL)
+
+# Per-agent token buckets and the checkout concurrency cap (see config.py)
+RATE_LIMITER = RateLimiter(config.RATE_LIMITS,
+                           make_buckets(config.RATE_LIMIT_STORE, config.RATE_LIMIT_PATH))
+CHECKOUT_SLOTS = ConcurrencyLimit(config.CHECKOUT_MAX_CONCURRENT)
+
+# Request latency, status counts and gauges for GET /api/ucp/metrics
+METRICS = Metrics()
+METRICS.gauge('ucp_orders_stored', 'Orders in the default merchant\'s order store',
+              lambda: TENANTS.default.orders.count())
+METRICS.gauge('ucp_catalog_products', 'Products in loaded catalogs',
+              lambda: sum(len(t.catalog.products) for t in TENANTS.loaded()))
+METRICS.gauge('ucp_checkouts_in_flight', 'Checkouts being processed now', lambda: CHECKOUT_SLOTS.in_flight)
+if JOBS:
+    METRICS.gauge('ucp_job_queue_depth', 'Jobs queued or running (all workers)', JOBS.depth)
+    METRICS.gauge('ucp_job_workers_busy', 'Job worker threads running a job now', lambda: JOBS.busy)
+    METRICS.gauge('ucp_job_busy_seconds', 'Time job workers have spent running jobs', lambda: JOBS.busy_seconds)
+
+# Opt-in sampling profiler; None (and no request hooks) unless UCP_PROFILE_EVERY is set
+PROFILER = Profiler(config.PROFILE_EVERY, config.PROFILE_MODE) if config.PROFILE_EVERY > 0 else None
+
+# Content-Encoding negotiation; None when UCP_COMPRESSION is off
+COMPRESSOR = Compressor(config.COMPRESSION, config.COMPRESS_MIN_BYTES,
+                        config.COMPRESS_CACHE_BYTES) if config.COMPRESSION else None
+if COMPRESSOR:
+    METRICS.gauge('ucp_compression_bytes_in', 'Response bytes before compression',
+                  lambda: COMPRESSOR.bytes_in)
+    METRICS.gauge('ucp_compression_bytes_out', 'Response bytes sent compressed',
+                  lambda: COMPRESSOR.bytes_out)
+
+
+# =============================================================================
+# METRICS - registered before the rate limiter so 429s are timed too
+# =============================================================================
+
+@ucp_bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@ucp_bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        rule = request.url_rule
+        METRICS.observe_request(rule.rule if rule else 'unmatched', request.method,
+                                response.status_code, time.perf_counter() - started)
+    return response
+
+
+@ucp_bp.record_once
+def time_json_encoding(state):
+    if isinstance(state.app.json, FastJSONProvider):
+        state.app.json.on_encode = METRICS.serialization.observe
+
+
+if PROFILER:
+    @ucp_bp.before_app_request
+    def start_profile():
+        rule = request.url_rule
+        g.profile = PROFILER.start(rule.rule if rule else 'unmatched')
+
+    @ucp_bp.teardown_app_request
+    def stop_profile(exc):
+        token = g.pop('profile', None)
+        if token:
+            PROFILER.stop(token)
+
+
+@ucp_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for this worker"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+
+# =============================================================================
+# RATE LIMITING
+# =============================================================================
+
+# Endpoint -> rate limit group in config.RATE_LIMITS. Batch checkout is
+# charged per cart inside the view.
+RATE_GROUPS = {
+    'ucp.checkout': 'checkout',
+    'ucp.test_purchase': 'test',
+    'ucp.list_products': 'products',
+    'ucp.search_products': 'products',
+    'ucp.export_products': 'products',
+    'ucp.get_product': 'products',
+    'ucp.check_availability': 'products',
+    'ucp.quote': 'products',
+}
+
+
+def client_id():
+    """Who a request counts against: its IP address (UCP-Agent is the client's to change)"""
+    ip = request.headers.get('X-Real-IP') if config.TRUST_PROXY else None
+    return 'ip:' + (ip or request.remote_addr or 'unknown')
+
+
+def too_many_requests(group, retry_after):
+    response = jsonify({
+        "error": "Rate limit exceeded",
+        "limit": group,
+        "retry_after": retry_after,
+        "hint": "Slow down and retry after the Retry-After delay"
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def overloaded():
+    response = jsonify({
+        "error": "Too many checkouts in progress",
+        "hint": "Retry shortly"
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+def check_rate_limit(group):
+    """429 response when the client is over `group`'s limit, else None"""
+    retry_after = RATE_LIMITER.check(group, client_id())
+    if retry_after:
+        return too_many_requests(group, retry_after)
+    return None
+
+
+@ucp_bp.before_request
+def rate_limit():
+    group = RATE_GROUPS.get(request.endpoint)
+    if request.endpoint == 'ucp.checkout' and request.headers.get('Idempotency-Key'):
+        return  # charged in checkout() only if the key's request actually runs
+    if group:
+        return check_rate_limit(group)
+
+
+# =============================================================================
+# COMPRESSION - ResponseCache bodies and the NDJSON export negotiate their own
+# =============================================================================
+
+# Endpoints whose bodies repeat across requests until the catalog changes,
+# so each distinct body is compressed once and kept
+COMPRESSION_CACHED = {'ucp.list_products', 'ucp.search_products'}
+
+if COMPRESSOR:
+    @ucp_bp.after_request
+    def compress_response(response):
+        return COMPRESSOR.apply(request, response, cache=request.endpoint in COMPRESSION_CACHED)
 
 
 # =============================================================================
 # DISCOVERY ENDPOINT
 # =============================================================================
 
-@ucp_bp.route('/discovery', methods=['GET'])
-def discovery():
-    """UCP Discovery endpoint - tells agents what this merchant supports"""
-    return jsonify({
+def discovery_payload(tenant):
+    return {
         "ucp": {
             "version": "1.0",
-            "merchant": MERCHANT,
+            "merchant": tenant.merchant,
             "sandbox": True,
             "sandbox_note": "This is a developer sandbox. Use payment_token 'sandbox_test' for test transactions. Free items are actually delivered.",
             "capabilities": [
@@ -180,9 +420,9 @@ def discovery():
                 "dev.ucp.shopping.fulfillment"
             ],
             "services": {
-                "products": "/api/ucp/products",
-                "checkout": "/api/ucp/checkout",
-                "orders": "/api/ucp/orders"
+                "products": f"{tenant.root}/api/ucp/products",
+                "checkout": f"{tenant.root}/api/ucp/checkout",
+                "orders": f"{tenant.root}/api/ucp/orders"
             }
         },
         "payment": {
@@ -192,55 +432,184 @@ def discovery():
         },
         "documentation": {
             "github": "https://github.com/steven2030/ucp-merchant",
-            "api_docs": f"{BASE_URL}/api/ucp/docs"
+            "api_docs": f"{tenant.base_url}/api/ucp/docs"
         }
-    })
+    }
+
+
+@ucp_bp.route('/discovery', methods=['GET'])
+def discovery():
+    """UCP Discovery endpoint - tells agents what this merchant supports"""
+    return serve_static('discovery', discovery_payload)
 
 
 # =============================================================================
 # PRODUCTS ENDPOINTS
 # =============================================================================
 
+def _price_arg(name):
+    """Parse a price query parameter; bad values are ignored like before"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
 @ucp_bp.route('/products', methods=['GET'])
 def list_products():
-    """List all available products with optional filters"""
-    products = list(PRODUCTS.values())
+    """List available products with optional filters, sorting and cursor pagination"""
+    sort = request.args.get('sort', 'catalog')
+    if sort not in SORTS:
+        return jsonify({
+            "error": f"Unknown sort: {sort}",
+            "available_sorts": list(SORTS)
+        }), 400
 
-    # Filter by type
-    product_type = request.args.get('type')
-    if product_type:
-        products = [p for p in products if p['type'] == product_type]
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
 
-    # Filter by stock
     in_stock = request.args.get('in_stock')
-    if in_stock and in_stock.lower() == 'true':
-        products = [p for p in products if p['in_stock']]
 
-    # Filter by max price
-    max_price = request.args.get('max_price')
-    if max_price:
-        try:
-            max_price = float(max_price)
-            products = [p for p in products if p['price'] <= max_price]
-        except ValueError:
-            pass
+    try:
+        products, count, next_cursor = CATALOG.index.query(
+            product_type=request.args.get('type'),
+            in_stock=bool(in_stock and in_stock.lower() == 'true'),
+            min_price=_price_arg('min_price'),
+            max_price=_price_arg('max_price'),
+            sort=sort,
+            cursor=request.args.get('cursor'),
+            limit=limit,
+        )
+    except InvalidCursor:
+        return jsonify({
+            "error": "Invalid cursor",
+            "hint": "Pass the next_cursor value from the previous page with the same filters and sort"
+        }), 400
 
-    return jsonify({
-        "products": products,
-        "count": len(products),
-        "sandbox": True
-    })
+    # Same document jsonify would build, assembled from pre-encoded products
+    body = b''.join([
+        b'{"count":', dumps_bytes(count),
+        b',"next_cursor":', dumps_bytes(next_cursor),
+        b',"products":', FRAGMENTS.array(products),
+        b',"sandbox":true}\n',
+    ])
+    return current_app.response_class(body, mimetype='application/json')
+
+
+@ucp_bp.route('/products/search', methods=['GET'])
+def search_products():
+    """
+    Full-text search over product name, description, features and location.
+
+    Ranked best match first; takes the same filters and cursor pagination
+    as /products.
+    """
+    text = request.args.get('q', '').strip()[:500]
+    if not text:
+        return jsonify({
+            "error": "Missing q",
+            "hint": "Pass search words, e.g. /api/ucp/products/search?q=sci-fi+book"
+        }), 400
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    in_stock = request.args.get('in_stock')
+
+    try:
+        products, count, next_cursor, match = CATALOG.index.search(
+            text,
+            product_type=request.args.get('type'),
+            in_stock=bool(in_stock and in_stock.lower() == 'true'),
+            min_price=_price_arg('min_price'),
+            max_price=_price_arg('max_price'),
+            cursor=request.args.get('cursor'),
+            limit=limit,
+        )
+    except InvalidCursor:
+        return jsonify({
+            "error": "Invalid cursor",
+            "hint": "Pass the next_cursor value from the previous page with the same query and filters"
+        }), 400
+
+    body = b''.join([
+        b'{"count":', dumps_bytes(count),
+        b',"match":', dumps_bytes(match),
+        b',"next_cursor":', dumps_bytes(next_cursor),
+        b',"products":', FRAGMENTS.array(products),
+        b',"query":', dumps_bytes(text),
+        b',"sandbox":true}\n',
+    ])
+    return current_app.response_class(body, mimetype='application/json')
+
+
+@ucp_bp.route('/products/export', methods=['GET'])
+def export_products():
+    """
+    Stream the catalog as newline-delimited JSON, oldest change first.
+
+    With `since`, only products changed after that updated_at are sent,
+    plus {"id", "deleted": true} tombstones for removed ones. To resume an
+    interrupted sync pass the last line's updated_at as `since` and its
+    id as `after`. Gzipped when the client accepts it.
+    """
+    since = request.args.get('since')
+    after_id = request.args.get('after')
+    changes = CATALOG.changes(since=since, after_id=after_id if since else None)
+
+    def lines():
+        for product in changes:
+            if product.get('deleted'):
+                yield dumps_bytes(product) + b'\n'
+            else:
+                yield FRAGMENTS.get(product) + b'\n'
+
+    def gzipped(chunks, flush_every=64 * 1024):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+        pending = 0
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= flush_every:
+                out += compressor.flush(zlib.Z_SYNC_FLUSH)
+                pending = 0
+            if out:
+                yield out
+        yield compressor.flush()
+
+    use_gzip = 'gzip' in request.accept_encodings
+    response = Response(
+        stream_with_context(gzipped(lines()) if use_gzip else lines()),
+        mimetype='application/x-ndjson'
+    )
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 
 @ucp_bp.route('/products/<product_id>', methods=['GET'])
 def get_product(product_id):
     """Get details for a specific product"""
-    product = PRODUCTS.get(product_id)
+    cached = RESPONSE_CACHE.serve(f'product:{product_id}')
+    if cached:
+        return cached
+
+    product = CATALOG.get(product_id)
     if not product:
         return jsonify({
             "error": "Product not found",
             "product_id": product_id,
-            "available_products": list(PRODUCTS.keys())
+            "available_products": list(CATALOG.products.keys())
         }), 404
 
     return jsonify({"product": product, "sandbox": True})
@@ -248,158 +617,120 @@ def get_product(product_id):
 
 @ucp_bp.route('/products/<product_id>/availability', methods=['GET'])
 def check_availability(product_id):
-    """Check availability (for bookings)"""
-    product = PRODUCTS.get(product_id)
+    """Check availability - stock left, and open dates for bookings"""
+    product = CATALOG.get(product_id)
     if not product:
         return jsonify({"error": "Product not found"}), 404
 
-    if product_id.startswith('signal-house'):
+    if INVENTORY.has_calendar(product_id):
+        dates = INVENTORY.available_dates(product_id)
         return jsonify({
             "product_id": product_id,
-            "available": True,
+            "available": bool(dates) and product['in_stock'],
             "sandbox": True,
-            "note": "Sandbox mode - always shows available.",
-            "available_dates": ["2026-01-20", "2026-01-21", "2026-01-27", "2026-01-28"]
+            "available_dates": dates
         })
 
-    return jsonify({
+    availability = {
         "product_id": product_id,
         "available": product['in_stock'],
         "sandbox": True
-    })
+    }
+    stock = INVENTORY.stock(product_id)
+    if stock is not None:
+        availability["stock"] = stock
+    return jsonify(availability)
 
 
 # =============================================================================
 # CHECKOUT ENDPOINT
 # =============================================================================
 
-@ucp_bp.route('/checkout', methods=['POST'])
-def checkout():
-    """Process a checkout request"""
-    data = request.get_json() or {}
+MAX_BATCH_CHECKOUTS = 1000   # carts per POST /checkout/batch
+BATCH_CHUNK_SIZE = 100       # carts priced, stored and streamed together
+
+
+def error_status(error):
+    """HTTP status for a build_order error: 409 when stock or a slot ran out"""
+    return 409 if error.get('code') in ('out_of_stock', 'slot_unavailable') else 400
+
+
+def build_order(data, products=None):
+    """
+    Price and fulfill one checkout request.
+
+    With deferred fulfillment the order comes back "processing" with
+    pending fulfillment records; place_orders() queues the rest.
+
+    Returns (order, None) on success or (None, error) where error is the
+    400 response body. `products` is the catalog to validate against
+    (default: the live catalog).
+    """
+    if products is None:
+        products = CATALOG.products
 
     if not data.get('line_items'):
-        return jsonify({
+        return None, {
             "error": "Missing line_items",
             "example": {
                 "line_items": [{"product_id": "pudding-theory-pdf", "quantity": 1}],
                 "buyer": {"name": "Test Agent", "email": "agent@example.com"},
                 "payment_token": "sandbox_test"
             }
-        }), 400
+        }
 
-    # Process line items
-    line_items = []
-    subtotal = 0
+    quote, error = PRICING.quote(data['line_items'], products,
+                                 promo_code=data.get('promo_code'),
+                                 address=data.get('shipping_address'))
+    if error:
+        return None, error
 
+    # Every line is priced and valid; fulfill it and collect what to reserve
+    fulfillment = []
+    reservations = []
     for item in data['line_items']:
-        product_id = item.get('product_id')
-        quantity = item.get('quantity', 1)
-
-        product = PRODUCTS.get(product_id)
-        if not product:
-            return jsonify({
-                "error": f"Product not found: {product_id}",
-                "available_products": list(PRODUCTS.keys())
-            }), 400
-
-        item_total = product['price'] * quantity
-        subtotal += item_total
-
-        line_items.append({
-            "product_id": product_id,
-            "product_name": product['name'],
-            "quantity": quantity,
-            "unit_price": product['price'],
-            "total": item_total
-        })
+        product = products[item['product_id']]
+        dates = product.get('available_dates')
+        if dates and item.get('date') not in dates:
+            # Without a date from the calendar no slot would be taken
+            return None, {
+                "error": f"Booking needs a date from available_dates: {product['id']}",
+                "code": "invalid_date",
+                "product_id": product['id'],
+                "available_dates": INVENTORY.available_dates(product['id'])
+            }
+        if config.DEFERRED_FULFILLMENT:
+            fulfillment.append({"product_id": product['id'], "status": "pending"})
+        else:
+            fulfillment.append(FULFILLMENT.fulfill(product, TENANT.base_url))
+        reservations.append((product['id'], item.get('quantity', 1), item.get('date')))
 
     # Check payment token (sandbox mode)
     payment_token = data.get('payment_token', '')
     is_sandbox = payment_token.startswith('sandbox_') or payment_token == 'test' or payment_token == ''
 
     if not is_sandbox:
-        return jsonify({
+        return None, {
             "error": "Production payments not enabled. Use sandbox mode.",
             "hint": "Set payment_token to 'sandbox_test'"
-        }), 400
+        }
+
+    # Take stock and booking slots for every line, or fail without taking any
+    error = INVENTORY.reserve(reservations)
+    if error:
+        return None, error
 
     # Generate order
     order_id = f"ORD_{uuid.uuid4().hex[:12].upper()}"
 
-    # Build fulfillment
-    fulfillment = []
-    for item in data['line_items']:
-        product = PRODUCTS.get(item['product_id'])
-        if product['id'] == 'pudding-theory-pdf':
-            fulfillment.append({
-                "product_id": product['id'],
-                "type": "instant_download",
-                "download_url": f"{BASE_URL}/downloads/pudding-theory.pdf",
-                "status": "delivered"
-            })
-        elif product['id'] == 'mind-lottery':
-            fulfillment.append({
-                "product_id": product['id'],
-                "type": "redirect",
-                "redirect_url": "https://bookofhouses.com/mind-lottery",
-                "status": "delivered"
-            })
-        elif product['id'] in ['house-membership-monthly', 'house-membership-annual']:
-            billing_period = product.get('billing_period', 'monthly')
-            fulfillment.append({
-                "product_id": product['id'],
-                "type": "subscription",
-                "subscription_id": f"SUB_{uuid.uuid4().hex[:10].upper()}",
-                "billing_period": billing_period,
-                "next_billing_date": "2026-02-13" if billing_period == "monthly" else "2027-01-13",
-                "signup_url": "https://boho.team/join",
-                "status": "sandbox_active",
-                "note": "Sandbox subscription - no actual billing"
-            })
-        elif product['type'] == 'subscription':
-            # Generic subscription handler
-            fulfillment.append({
-                "product_id": product['id'],
-                "type": "subscription",
-                "subscription_id": f"SUB_{uuid.uuid4().hex[:10].upper()}",
-                "status": "sandbox_active"
-            })
-        elif product['type'] == 'physical':
-            fulfillment.append({
-                "product_id": product['id'],
-                "type": "shipping",
-                "tracking_number": f"SANDBOX_{uuid.uuid4().hex[:8].upper()}",
-                "carrier": "USPS",
-                "status": "sandbox_shipped"
-            })
-        elif product['type'] == 'booking':
-            fulfillment.append({
-                "product_id": product['id'],
-                "type": "reservation",
-                "confirmation_code": f"SH_{uuid.uuid4().hex[:6].upper()}",
-                "status": "sandbox_confirmed"
-            })
-        else:
-            fulfillment.append({
-                "product_id": product['id'],
-                "type": "digital",
-                "status": "sandbox_delivered"
-            })
-
     order = {
         "order_id": order_id,
-        "status": "completed",
+        "status": "processing" if config.DEFERRED_FULFILLMENT else "completed",
         "sandbox": True,
         "created_at": datetime.utcnow().isoformat() + "Z",
         "buyer": data.get('buyer', {"name": "Anonymous Agent"}),
-        "line_items": line_items,
-        "totals": {
-            "subtotal": subtotal,
-            "tax": 0,
-            "shipping": 0,
-            "total": subtotal
-        },
+        "line_items": quote['line_items'],
+        "totals": quote['totals'],
         "payment": {
             "token": payment_token or "sandbox_default",
             "status": "sandbox_success",
@@ -407,11 +738,264 @@ def checkout():
         },
         "fulfillment": fulfillment
     }
+    agent = request.headers.get('UCP-Agent')
+    if agent:
+        order["agent"] = agent[:200]
+
+    METRICS.line_items.observe(len(quote['line_items']))
+    return order, None
+
 
-    ORDERS[order_id] = order
+@ucp_bp.route('/checkout', methods=['POST'])
+def checkout():
+    """
+    Process a checkout request.
+
+    With an Idempotency-Key header, retries of the same request return the
+    original order instead of placing a new one.
+    """
+    if not CHECKOUT_SLOTS.acquire():
+        return overloaded()
+    try:
+        key = request.headers.get('Idempotency-Key')
+        if key:
+            # Replays and key conflicts don't use up the retrying agent's tokens
+            return IDEMPOTENCY.respond(key, request.get_data(),
+                                       lambda: check_rate_limit('checkout') or _place_order(),
+                                       namespace=TENANT.id)
+        return _place_order()
+    finally:
+        CHECKOUT_SLOTS.release()
+
+
+def _place_order():
+    data = request.get_json() or {}
+
+    products = CATALOG.products
+    order, error = build_order(data, products)
+    if error:
+        return jsonify(error), error_status(error)
+
+    ORDERS.put(order)
+    place_orders([order], products)
     return jsonify(order), 201
 
 
+@ucp_bp.route('/checkout/batch', methods=['POST'])
+def checkout_batch():
+    """
+    Process many checkout requests in one call.
+
+    Each cart succeeds or fails on its own. Results are streamed back in
+    request order as they are stored, one JSON object per cart.
+    """
+    data = request.get_json(silent=True)
+    carts = data.get('checkouts') if isinstance(data, dict) else data
+    if not isinstance(carts, list) or not carts:
+        return jsonify({
+            "error": "Expected a non-empty checkouts array",
+            "example": {
+                "checkouts": [
+                    {"line_items": [{"product_id": "pudding-theory-pdf", "quantity": 1}],
+                     "payment_token": "sandbox_test"}
+                ]
+            }
+        }), 400
+    if len(carts) > MAX_BATCH_CHECKOUTS:
+        return jsonify({
+            "error": f"Too many checkouts: {len(carts)}",
+            "max_checkouts": MAX_BATCH_CHECKOUTS
+        }), 400
+
+    # One token per cart, so batching doesn't sidestep the checkout limit;
+    # a batch bigger than the whole bucket could never be admitted
+    max_carts = RATE_LIMITER.max_cost('checkout')
+    if max_carts is not None and len(carts) > max_carts:
+        return jsonify({
+            "error": f"Too many checkouts for the checkout rate limit: {len(carts)}",
+            "max_checkouts": max_carts,
+            "hint": "Split the batch; each cart uses one checkout token"
+        }), 400
+    retry_after = RATE_LIMITER.check('checkout', client_id(), cost=len(carts))
+    if retry_after:
+        return too_many_requests('checkout', retry_after)
+    if not CHECKOUT_SLOTS.acquire():
+        return overloaded()
+
+    # Resolve every referenced product once for the whole batch
+    product_ids = {
+        item.get('product_id')
+        for cart in carts if isinstance(cart, dict)
+        for item in cart.get('line_items') or [] if isinstance(item, dict)
+    }
+    catalog = CATALOG.products
+    products = {pid: catalog[pid] for pid in product_ids if pid in catalog}
+    dumps = current_app.json.dumps
+
+    def generate():
+        succeeded = failed = 0
+        yield '{"results":['
+        for start in range(0, len(carts), BATCH_CHUNK_SIZE):
+            results, orders = [], []
+            for index, cart in enumerate(carts[start:start + BATCH_CHUNK_SIZE], start):
+                if not isinstance(cart, dict):
+                    order, error = None, {"error": "Each checkout must be an object"}
+                else:
+                    try:
+                        order, error = build_order(cart, products)
+                    except (AttributeError, KeyError, TypeError) as e:
+                        order, error = None, {"error": f"Malformed checkout: {e}"}
+                if error:
+                    failed += 1
+                    error.pop('available_products', None)
+                    results.append({"index": index, "status": error_status(error), **error})
+                else:
+                    succeeded += 1
+                    orders.append(order)
+                    results.append({"index": index, "status": 201, "order": order})
+            ORDERS.put_many(orders)
+            place_orders(orders, products)
+            yield ('' if start == 0 else ',') + ','.join(dumps(r) for r in results)
+        yield '],' + dumps({
+            "summary": {"total": len(carts), "succeeded": succeeded, "failed": failed},
+            "sandbox": True
+        })[1:] + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    response.call_on_close(CHECKOUT_SLOTS.release)
+    return response
+
+
+MAX_QUOTE_CARTS = 100   # carts per POST /quote
+
+
+def quote_cart(data, products):
+    """(quote, None) or (None, error) for one checkout-shaped body"""
+    if not isinstance(data, dict) or not isinstance(data.get('line_items'), list) or not data['line_items']:
+        return None, {
+            "error": "Missing line_items",
+            "example": {
+                "line_items": [{"product_id": "pudding-heroes-paperback", "quantity": 2}],
+                "promo_code": "SANDBOX10",
+                "shipping_address": {"country": "US", "region": "CA"}
+            }
+        }
+    if not all(isinstance(item, dict) for item in data['line_items']):
+        return None, {"error": "Each line item must be an object"}
+    return PRICING.quote(data['line_items'], products,
+                         promo_code=data.get('promo_code'),
+                         address=data.get('shipping_address'))
+
+
+@ucp_bp.route('/quote', methods=['POST'])
+def quote():
+    """
+    Price a cart without placing an order.
+
+    Takes the same line_items, promo_code and shipping_address as checkout,
+    or {"carts": [...]} to price several at once for comparison. Nothing is
+    reserved or stored.
+    """
+    data = request.get_json(silent=True) or {}
+    products = CATALOG.products
+
+    carts = data.get('carts') if isinstance(data, dict) else None
+    if carts is None:
+        result, error = quote_cart(data, products)
+        if error:
+            return jsonify(error), 400
+        return jsonify({"quote": result, "sandbox": True})
+
+    if not isinstance(carts, list) or not carts or len(carts) > MAX_QUOTE_CARTS:
+        return jsonify({
+            "error": f"Expected a carts array of 1 to {MAX_QUOTE_CARTS} carts",
+            "max_carts": MAX_QUOTE_CARTS
+        }), 400
+    results = []
+    for index, cart in enumerate(carts):
+        result, error = quote_cart(cart, products)
+        if error:
+            error.pop('available_products', None)
+            results.append({"index": index, "status": 400, **error})
+        else:
+            results.append({"index": index, "status": 200, "quote": result})
+    return jsonify({"results": results, "sandbox": True})
+
+
+# =============================================================================
+# DEFERRED FULFILLMENT - enabled by setting UCP_DEFERRED_FULFILLMENT
+# =============================================================================
+
+def place_orders(orders, products):
+    """
+    Start stored orders on their way: queue fulfillment jobs for
+    "processing" orders, or go straight to the sandbox lifecycle.
+    """
+    for order in orders:
+        if order['status'] == 'completed':
+            SALES.record(order, products)
+    if not JOBS:
+        for order in orders:
+            LIFECYCLE.track(order)
+        return
+    # The product as it was at checkout, so a catalog reload can't change what was bought
+    JOBS.enqueue_many([("fulfill", {
+        "tenant": TENANT.id,
+        "order_id": order['order_id'],
+        "products": [products[item['product_id']] for item in order['line_items']],
+    }) for order in orders])
+    for order in orders:
+        EVENTS.publish("order.created", order, {"status": order['status']})
+
+
+def job_tenant(job):
+    """Context making the job's merchant current (jobs run outside requests)"""
+    tenant = TENANTS.get(job.get('tenant'))
+    if tenant is None:
+        raise LookupError(f"Unknown merchant: {job.get('tenant')}")
+    return TENANTS.use(tenant)
+
+
+def fulfill_order(job):
+    """Job handler: fulfill a processing order and mark it completed"""
+    with job_tenant(job):
+        order = ORDERS.get(job['order_id'])
+        if order is None:
+            # Expired, or stored by another worker's memory store: retry
+            # rather than drop the job and leave the order processing
+            raise LookupError(f"Order not found: {job['order_id']}")
+        if order['status'] != 'processing':
+            return  # finished by an earlier run of this job
+        fulfillment = [FULFILLMENT.fulfill(product, TENANT.base_url) for product in job['products']]
+        order = dict(order, status="completed", fulfillment=fulfillment)
+        ORDERS.put(order)
+        SALES.record(order, {product['id']: product for product in job['products']})
+        LIFECYCLE.track(order, "order.completed")
+
+
+def fail_order(job, error):
+    """Out of retries: mark the order failed and give back its stock"""
+    with job_tenant(job):
+        order = ORDERS.get(job['order_id'])
+        if order is None or order['status'] != 'processing':
+            return
+        INVENTORY.release([(item['product_id'], item['quantity'], item.get('date'))
+                           for item in order['line_items']])
+        order = dict(order, status="failed",
+                     fulfillment=[dict(record, status="failed") for record in order['fulfillment']])
+        ORDERS.put(order)
+        LIFECYCLE.track(order, "order.failed")
+
+
+def order_settled(order):
+    """True once nothing further will happen to the order in this worker"""
+    return order['status'] != 'processing' and not LIFECYCLE.tracking(order['order_id'])
+
+
+if JOBS:
+    JOBS.handler('fulfill', on_failure=fail_order)(fulfill_order)
+
+
 # =============================================================================
 # ORDER STATUS ENDPOINTS
 # =============================================================================
@@ -421,20 +1005,85 @@ def get_order(order_id):
     """Get order status and details"""
     order = ORDERS.get(order_id)
     if not order:
-        return jsonify({
-            "error": "Order not found",
-            "order_id": order_id,
-            "note": "Orders are stored in memory and reset on server restart."
-        }), 404
+        error = {"error": "Order not found", "order_id": order_id}
+        if not ORDERS.persistent:
+            error["note"] = "Orders are stored in memory and reset on server restart."
+        return jsonify(error), 404
     return jsonify(order)
 
 
+def sse_response(stream, events):
+    response = Response(sse_chunks(stream, events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'   # let nginx pass events straight through
+    response.call_on_close(stream.close)
+    return response
+
+
+@ucp_bp.route('/orders/<order_id>/events', methods=['GET'])
+def order_events(order_id):
+    """
+    Server-sent events for one order: a snapshot, then each status change
+    until the order settles.
+    """
+    order = ORDERS.get(order_id)
+    if not order:
+        return jsonify({"error": "Order not found", "order_id": order_id}), 404
+    events = queue.SimpleQueue()
+    stream = EventStream(TENANT.events, f"order:{order_id}", events.put,
+                         last_event_id(request.headers.get('Last-Event-ID')),
+                         snapshot=order, settled=order_settled(order))
+    return sse_response(stream, events)
+
+
+@ucp_bp.route('/events', methods=['GET'])
+def agent_events():
+    """Server-sent events for every order placed with the same UCP-Agent"""
+    agent = request.args.get('agent') or request.headers.get('UCP-Agent')
+    if not agent:
+        return jsonify({
+            "error": "Missing agent",
+            "hint": "Pass ?agent=<your UCP-Agent value> or send the UCP-Agent header"
+        }), 400
+    events = queue.SimpleQueue()
+    stream = EventStream(TENANT.events, f"agent:{agent[:200]}", events.put,
+                         last_event_id(request.headers.get('Last-Event-ID')))
+    return sse_response(stream, events)
+
+
+ORDER_PAGE_SIZE = 10
+MAX_ORDER_PAGE_SIZE = 100
+
+
 @ucp_bp.route('/orders', methods=['GET'])
 def list_orders():
-    """List recent orders"""
+    """List recent orders with cursor pagination and filters"""
+    try:
+        limit = int(request.args.get('limit', ORDER_PAGE_SIZE))
+        before = request.args.get('before')
+        after = request.args.get('after')
+        before = int(before) if before else None
+        after = int(after) if after else None
+    except ValueError:
+        return jsonify({
+            "error": "limit, before and after must be integers",
+            "hint": "Pass cursors.before or cursors.after from a previous page"
+        }), 400
+    limit = max(1, min(limit, MAX_ORDER_PAGE_SIZE))
+
+    orders, before_cursor, after_cursor = ORDERS.page(
+        limit=limit,
+        before=before,
+        after=after,
+        status=request.args.get('status'),
+        email=request.args.get('email'),
+        created_from=request.args.get('created_from'),
+        created_to=request.args.get('created_to'),
+    )
     return jsonify({
-        "orders": list(ORDERS.values())[-10:],
-        "count": len(ORDERS),
+        "orders": orders,
+        "count": ORDERS.count(),
+        "cursors": {"before": before_cursor, "after": after_cursor},
         "sandbox": True
     })
 
@@ -455,42 +1104,57 @@ def health():
     })
 
 
-@ucp_bp.route('/docs', methods=['GET'])
-def docs():
-    """API documentation"""
-    return jsonify({
-        "name": "Pudding Heroes UCP Sandbox",
+def _sample_products(tenant, test, limit=20):
+    return list(itertools.islice((pid for pid, product in tenant.catalog.products.items() if test(product)),
+                                 limit))
+
+
+def docs_payload(tenant):
+    return {
+        "name": f"{tenant.merchant.get('name', tenant.id)} UCP Sandbox",
         "description": "The first indie UCP merchant implementation.",
         "version": "1.0.0",
         "sandbox": True,
-        "base_url": BASE_URL,
+        "base_url": tenant.base_url,
         "endpoints": {
             "GET /api/ucp/discovery": "UCP discovery manifest",
-            "GET /api/ucp/products": "List products (filters: type, max_price, in_stock)",
+            "GET /api/ucp/products": "List products (filters: type, min_price, max_price, in_stock; sort; limit/cursor pagination)",
+            "GET /api/ucp/products/search": "Full-text product search (q; same filters and limit/cursor as /products)",
             "GET /api/ucp/products/<id>": "Get product details",
+            "GET /api/ucp/products/export": "Stream the catalog as NDJSON (since/after for incremental sync, gzip)",
             "POST /api/ucp/checkout": "Create an order",
+            "POST /api/ucp/checkout/batch": "Create many orders (body: {\"checkouts\": [...]}), per-cart results",
+            "POST /api/ucp/quote": "Price a cart (or {\"carts\": [...]}) with tax, shipping and promo_code, without ordering",
             "GET /api/ucp/orders/<id>": "Get order status",
-            "GET /api/ucp/test": "Quick test - creates sample order"
+            "GET /api/ucp/orders": "List orders (filters: status, email, created_from, created_to; limit/before/after cursors)",
+            "GET /api/ucp/test": "Quick test - creates sample order",
+            "GET /api/ucp/stats": "Runtime statistics (response cache, order store)",
+            "GET /api/ucp/stats/sales": "Sales per product, type and minute (window=15m/1h/24h/all)"
         },
-        "free_products": ["pudding-theory-pdf", "mind-lottery", "npc-or-player"],
-        "subscription_products": ["house-membership-monthly", "house-membership-annual"],
+        "free_products": _sample_products(tenant, lambda p: not p.get('price')),
+        "subscription_products": _sample_products(tenant, lambda p: p.get('type') == 'subscription'),
         "github": "https://github.com/steven2030/ucp-merchant"
-    })
+    }
 
 
-@ucp_bp.route('/examples', methods=['GET'])
-def examples():
-    """Code examples"""
-    return jsonify({
+@ucp_bp.route('/docs', methods=['GET'])
+def docs():
+    """API documentation"""
+    return serve_static('docs', docs_payload)
+
+
+def examples_payload(tenant):
+    base_url = tenant.base_url
+    return {
         "curl": {
-            "discovery": f"curl {BASE_URL}/.well-known/ucp.json",
-            "products": f"curl {BASE_URL}/api/ucp/products",
-            "checkout": f'curl -X POST {BASE_URL}/api/ucp/checkout -H "Content-Type: application/json" -d \'{{"line_items": [{{"product_id": "pudding-theory-pdf", "quantity": 1}}], "payment_token": "sandbox_test"}}\''
+            "discovery": f"curl {base_url}/.well-known/ucp.json",
+            "products": f"curl {base_url}/api/ucp/products",
+            "checkout": f'curl -X POST {base_url}/api/ucp/checkout -H "Content-Type: application/json" -d \'{{"line_items": [{{"product_id": "pudding-theory-pdf", "quantity": 1}}], "payment_token": "sandbox_test"}}\''
         },
         "python": f'''import requests
 
 order = requests.post(
-    "{BASE_URL}/api/ucp/checkout",
+    "{base_url}/api/ucp/checkout",
     json={{
         "line_items": [{{"product_id": "pudding-theory-pdf", "quantity": 1}}],
         "payment_token": "sandbox_test"
@@ -498,32 +1162,40 @@ order = requests.post(
 ).json()
 
 print(order["fulfillment"][0]["download_url"])'''
-    })
+    }
+
+
+@ucp_bp.route('/examples', methods=['GET'])
+def examples():
+    """Code examples"""
+    return RESPONSE_CACHE.serve('examples') or jsonify(examples_payload(TENANT))
 
 
 @ucp_bp.route('/test', methods=['GET'])
 def test_purchase():
     """Quick test - creates a sample order"""
     order_id = f"TEST_{uuid.uuid4().hex[:12].upper()}"
+    products = CATALOG.products
+    if not products:
+        return jsonify({"error": "No products in the catalog"}), 404
+    # The merchant's first free product (a download for the built-in catalog)
+    product_id, product = next(((pid, p) for pid, p in products.items() if not p.get('price')),
+                               next(iter(products.items())))
 
     order = {
         "order_id": order_id,
         "status": "completed",
         "sandbox": True,
         "test_mode": True,
+        "created_at": datetime.utcnow().isoformat() + "Z",
         "message": "Test order via GET /api/ucp/test",
         "line_items": [{
-            "product_id": "pudding-theory-pdf",
-            "product_name": "Pudding Theory: A Guide to Warping Reality",
+            "product_id": product_id,
+            "product_name": product['name'],
             "quantity": 1,
-            "total": 0
-        }],
-        "fulfillment": [{
-            "product_id": "pudding-theory-pdf",
-            "type": "instant_download",
-            "download_url": f"{BASE_URL}/downloads/pudding-theory.pdf",
-            "status": "delivered"
+            "total": product.get('price', 0)
         }],
+        "fulfillment": [FULFILLMENT.fulfill(product, TENANT.base_url)],
         "next_steps": [
             "Download the PDF at fulfillment.download_url",
             "Try POST /api/ucp/checkout with your own data",
@@ -531,5 +1203,312 @@ def test_purchase():
         ]
     }
 
-    ORDERS[order_id] = order
+    ORDERS.put(order)
+    LIFECYCLE.track(order)
     return jsonify(order)
+
+
+@ucp_bp.route('/stats', methods=['GET'])
+def stats():
+    """Runtime statistics"""
+    return jsonify({
+        "response_cache": RESPONSE_CACHE.stats(),
+        "orders": ORDERS.stats(),
+        "idempotency": IDEMPOTENCY.stats(),
+        "rate_limits": RATE_LIMITER.stats(),
+        "events": {**EVENTS.stats(), **LIFECYCLE.stats()},
+        "checkout_concurrency": CHECKOUT_SLOTS.stats(),
+        "jobs": JOBS.stats() if JOBS else None,
+        "compression": COMPRESSOR.stats() if COMPRESSOR else None,
+        "sales": SALES.stats(),
+        "tenant": TENANT.id,
+        "tenants": TENANTS.stats() if TENANTS.specs else None,
+        "sandbox": True
+    })
+
+
+WINDOW_UNITS = {"m": 1, "h": 60, "d": 1440}
+MAX_SALES_PRODUCTS = 500
+
+
+def parse_window(value):
+    """Minutes in a window like "15m", "1h" or "1d"; None for "all" (raises ValueError)"""
+    value = (value or 'all').strip().lower()
+    if value == 'all':
+        return None
+    if value[-1:] in WINDOW_UNITS:
+        return int(value[:-1]) * WINDOW_UNITS[value[-1]]
+    return int(value)
+
+
+def format_window(minutes):
+    for unit, size in sorted(WINDOW_UNITS.items(), key=lambda kv: -kv[1]):
+        if minutes % size == 0:
+            return f"{minutes // size}{unit}"
+
+
+@ucp_bp.route('/stats/sales', methods=['GET'])
+def sales_stats():
+    """Running sales totals per product and type (never reads the order store)"""
+    windows = [format_window(minutes) for minutes in SALES.windows] + ['all']
+    try:
+        minutes = parse_window(request.args.get('window'))
+        limit = int(request.args.get('limit', 50))
+        if minutes is not None and minutes not in SALES.windows:
+            raise ValueError(minutes)
+    except ValueError:
+        return jsonify({
+            "error": f"window must be one of {', '.join(windows)}; limit must be an integer",
+            "hint": "GET /api/ucp/stats/sales?window=1h",
+            "windows": windows
+        }), 400
+    report = SALES.report(minutes, limit=max(1, min(limit, MAX_SALES_PRODUCTS)),
+                          per_minute=request.args.get('per_minute', '').lower() in ('1', 'true', 'yes'))
+    report["window"] = request.args.get('window', 'all')
+    report["sandbox"] = True
+    return jsonify(report)
+
+
+# =============================================================================
+# ADMIN ENDPOINTS - enabled by setting UCP_ADMIN_TOKEN
+# =============================================================================
+
+def _admin_denied():
+    """Error response unless the request carries the admin bearer token"""
+    if not config.ADMIN_TOKEN:
+        return jsonify({"error": "Admin API disabled", "hint": "Set UCP_ADMIN_TOKEN"}), 403
+    supplied = request.headers.get('Authorization', '').encode()
+    if not hmac.compare_digest(supplied, f"Bearer {config.ADMIN_TOKEN}".encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+@ucp_bp.route('/admin/catalog/reload', methods=['POST'])
+def reload_products():
+    """Reload the merchant's catalog file and swap it in (this worker only)"""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if not TENANT.catalog_path:
+        return jsonify({"error": "No catalog file configured", "hint": "Set UCP_CATALOG_PATH"}), 400
+    try:
+        summary = reload_catalog(CATALOG, TENANT.catalog_path)
+    except CatalogError as e:
+        return jsonify({"error": "Catalog failed to load", "problems": e.problems}), 400
+    return jsonify({"reloaded": True, **summary})
+
+
+@ucp_bp.route('/admin/profile', methods=['GET', 'DELETE'])
+def profile_report():
+    """
+    Sampling profiler results for this worker.
+
+    format=summary (default) lists routes with request and sample counts;
+    text and pstats return cProfile data, collapsed returns stacks for a
+    flame graph. route= limits the report to one URL pattern. DELETE
+    clears what has been collected.
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if PROFILER is None:
+        return jsonify({"error": "Profiling is off", "hint": "Set UCP_PROFILE_EVERY=N to sample 1 in N requests"}), 404
+    if request.method == 'DELETE':
+        PROFILER.reset()
+        return jsonify({"reset": True})
+
+    fmt = request.args.get('format', 'summary')
+    route = request.args.get('route')
+    if fmt == 'summary':
+        return jsonify(PROFILER.summary())
+
+    wanted = 'stack' if fmt == 'collapsed' else 'cprofile'
+    if fmt not in ('text', 'pstats', 'collapsed'):
+        return jsonify({"error": f"Unknown format: {fmt}", "formats": ["summary", "text", "pstats", "collapsed"]}), 400
+    if PROFILER.mode != wanted:
+        return jsonify({"error": f"format={fmt} needs UCP_PROFILE_MODE={wanted}", "mode": PROFILER.mode}), 400
+
+    if fmt == 'text':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in PROFILE_SORTS:
+            return jsonify({"error": f"Invalid sort: {sort}", "sorts": list(PROFILE_SORTS)}), 400
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        body = PROFILER.pstats_text(route, sort, limit)
+        mimetype = 'text/plain'
+    elif fmt == 'pstats':
+        body = PROFILER.pstats_dump(route)
+        mimetype = 'application/octet-stream'
+    else:
+        body = PROFILER.collapsed(route)
+        mimetype = 'text/plain'
+
+    if body is None:
+        return jsonify({"error": "No samples yet", "routes": list(PROFILER.summary()["routes"])}), 404
+    response = Response(body, mimetype=mimetype)
+    if fmt == 'pstats':
+        response.headers['Content-Disposition'] = 'attachment; filename=ucp.pstats'
+    return response
+
+
+# =============================================================================
+# TENANTS - the default merchant, plus any listed in UCP_TENANTS_PATH
+# =============================================================================
+
+def order_space(tenant_id, **limits):
+    """
+    Order store, event hub, lifecycle and sales figures for a tenant. These
+    outlive the tenant's catalog: an evicted tenant's orders are still
+    there when its catalog is loaded again.
+    """
+    with _ORDER_SPACES_LOCK:
+        space = _ORDER_SPACES.get(tenant_id)
+        if space is None:
+            path = config.ORDER_STORE_PATH
+            orders = make_order_store(
+                config.ORDER_STORE,
+                path if tenant_id == DEFAULT_TENANT else tenant_file(path, tenant_id),
+                ttl=config.ORDER_TTL,
+                test_ttl=config.TEST_ORDER_TTL,
+                batch_ms=config.SQLITE_BATCH_MS,
+                fsync=config.ORDER_LOG_FSYNC,
+                compact_seconds=config.ORDER_LOG_COMPACT_SECONDS,
+                **limits,
+            )
+            events = EventHub(config.EVENT_HISTORY)
+            lifecycle = OrderLifecycle(orders, events, SCHEDULER,
+                                       step_seconds=config.LIFECYCLE_STEP_SECONDS,
+                                       renewal_seconds=config.RENEWAL_SECONDS,
+                                       max_renewals=config.MAX_RENEWALS)
+            sales = SalesStats(config.SALES_WINDOWS)
+            space = _ORDER_SPACES[tenant_id] = (orders, events, lifecycle, sales)
+        return space
+
+
+_ORDER_SPACES = {}
+_ORDER_SPACES_LOCK = threading.Lock()
+
+
+def build_tenant(tenant_id, merchant, base_url, products, pricing_rules, catalog_path=None,
+                 **order_limits):
+    """Catalog, indexes, caches and pricing for one merchant"""
+    catalog = Catalog(products)
+    orders, events, lifecycle, sales = order_space(tenant_id, **order_limits)
+    tenant = Tenant(
+        tenant_id, merchant, base_url,
+        catalog=catalog,
+        # Stock counts and booking calendars (products' stock / available_dates / slot_capacity)
+        inventory=make_inventory(
+            config.INVENTORY_STORE, catalog,
+            config.INVENTORY_PATH if tenant_id == DEFAULT_TENANT
+            else tenant_file(config.INVENTORY_PATH, tenant_id)),
+        # Pre-encoded JSON per product, joined into catalog pages
+        fragments=ProductFragments(catalog),
+        # Fulfillment handler per product, resolved from its fulfillment/type (see fulfillment.py)
+        fulfillment=FulfillmentTable(catalog),
+        # Prices in cents and compiled tax/shipping/promo tables (see pricing.py)
+        pricing=PricingEngine(catalog, pricing_rules),
+        # Pre-encoded bodies (and their compressed variants) for discovery,
+        # docs, examples and product detail
+        response_cache=ResponseCache(COMPRESSOR),
+        orders=orders,
+        events=events,
+        lifecycle=lifecycle,
+        sales=sales,
+        catalog_path=catalog_path,
+    )
+    warm_response_cache(tenant)
+    catalog.on_change(lambda product_id: catalog_changed(tenant, product_id))
+    return tenant
+
+
+def load_tenant(tenant_id, spec):
+    """TenantRegistry loader for a tenant from the manifest"""
+    return build_tenant(
+        tenant_id, spec['merchant'], spec['base_url'],
+        load_products(spec['catalog']),
+        load_rules(spec['pricing_rules']) if spec['pricing_rules'] else PRICING_RULES,
+        catalog_path=spec['catalog'],
+        max_entries=config.TENANT_ORDER_MAX_ENTRIES,
+        max_bytes=config.TENANT_ORDER_MAX_BYTES,
+    )
+
+
+# Encode static payloads once, product detail again on each catalog change
+def catalog_changed(tenant, product_id):
+    refresh_product_cache(tenant, product_id)
+    # Docs list sample products; both are re-encoded on their next request
+    tenant.response_cache.drop('docs')
+    tenant.response_cache.drop('discovery')
+
+
+def serve_static(name, build):
+    """Cached response for a static payload, encoding it again if a catalog change dropped it"""
+    response = RESPONSE_CACHE.serve(name)
+    if response is None:
+        RESPONSE_CACHE.put(name, build(TENANT), max_age=STATIC_MAX_AGE)
+        response = RESPONSE_CACHE.serve(name)
+    return response
+
+
+def refresh_product_cache(tenant, product_id):
+    product = tenant.catalog.get(product_id)
+    if product:
+        tenant.response_cache.put(f'product:{product_id}', {"product": product, "sandbox": True},
+                                  max_age=PRODUCT_MAX_AGE)
+    else:
+        tenant.response_cache.drop(f'product:{product_id}')
+
+
+def warm_response_cache(tenant):
+    tenant.response_cache.put('discovery', discovery_payload(tenant), max_age=STATIC_MAX_AGE)
+    tenant.response_cache.put('docs', docs_payload(tenant), max_age=STATIC_MAX_AGE)
+    tenant.response_cache.put('examples', examples_payload(tenant), max_age=STATIC_MAX_AGE)
+    for product_id in tenant.catalog.products:
+        refresh_product_cache(tenant, product_id)
+
+
+TENANTS = TenantRegistry(
+    build_tenant(
+        DEFAULT_TENANT, MERCHANT, BASE_URL,
+        load_products(config.CATALOG_PATH) if config.CATALOG_PATH else PRODUCTS,
+        load_rules(config.PRICING_RULES_PATH) if config.PRICING_RULES_PATH else PRICING_RULES,
+        catalog_path=config.CATALOG_PATH or None,
+        max_entries=config.ORDER_MAX_ENTRIES,
+        max_bytes=config.ORDER_MAX_BYTES,
+    ),
+    load_manifest(config.TENANTS_PATH) if config.TENANTS_PATH else {},
+    load_tenant,
+    max_loaded=config.TENANT_MAX_LOADED,
+    max_products=config.TENANT_MAX_PRODUCTS,
+)
+
+CATALOG_WATCHER = None
+if config.CATALOG_PATH and config.CATALOG_WATCH_SECONDS > 0:
+    CATALOG_WATCHER = CatalogWatcher(TENANTS.default.catalog, config.CATALOG_PATH,
+                                     interval=config.CATALOG_WATCH_SECONDS).start()
+
+if TENANTS.specs:
+    METRICS.gauge('ucp_tenants_loaded', 'Tenant catalogs loaded in this worker', lambda: TENANTS.stats()['loaded'])
+    METRICS.gauge('ucp_tenant_loads', 'Tenant catalogs loaded so far', lambda: TENANTS.loads)
+    METRICS.gauge('ucp_tenant_evictions', 'Tenant catalogs dropped to stay under the limits',
+                  lambda: TENANTS.evictions)
+
+    @ucp_bp.before_app_request
+    def select_tenant():
+        """Serve the request as the merchant its path prefix or Host names"""
+        tenant_id = request.environ.get('ucp.tenant') or TENANTS.for_host(request.host)
+        try:
+            tenant = TENANTS.get(tenant_id)
+        except (CatalogError, PricingRulesError) as e:
+            current_app.logger.error("Merchant %s failed to load: %s", tenant_id, e)
+            return jsonify({"error": "Merchant unavailable", "merchant": tenant_id}), 503
+        if tenant is None:
+            return jsonify({"error": "Unknown merchant", "merchant": tenant_id}), 404
+        g.tenant = tenant
+
+# Job workers start once every tenant they could need can be found
+if JOBS:
+    JOBS.start()
@@ -0,0 +1,381 @@
+"""
+Full-text product search
+
+An inverted index over each product's name, description, features and
+location. Text is lowercased, accent-folded, split on non-alphanumerics,
+stripped of a few stopwords and lightly singularised ("stays" -> "stay"),
+for products and queries alike.
+
+Ranking is BM25 with per-field weights (a word in the name counts for more
+than one in the description). The last query term also matches the
+indexed words it is a prefix of, at a discount, so a query still being
+typed finds something ("portl" finds "portland"). A
+product must match every query term; when none does, products matching
+any of them are ranked instead.
+
+Each posting stores the product's precomputed BM25 term-frequency part
+("impact"), normalised by the average product length when the index was
+built, so a score is idf x impact summed over the query terms. Words in
+many products also keep a bitset of those products and an array of them
+sorted by impact: intersections are then big-int ANDs, and the best few
+of a large result set are found by reading those arrays from the top and
+stopping once nothing further down can beat them (Fagin's threshold
+algorithm), not by scoring every match.
+
+The index is keyed by catalog slot number (see catalog.CatalogIndex) and
+updated per product as the catalog changes.
+"""
+
+import bisect
+import heapq
+import itertools
+import math
+import re
+import unicodedata
+from array import array
+
+from catalog import _iter_bits, _mask
+
+# field -> weight in a product's term frequencies and length
+FIELDS = {"name": 3.0, "location": 2.0, "features": 1.5, "description": 1.0}
+
+K1 = 1.2
+B = 0.75
+PREFIX_WEIGHT = 0.5     # score factor for a prefix-only match
+MIN_PREFIX = 2          # shorter query terms match whole words only
+MAX_EXPANSIONS = 64     # indexed words one prefix may expand to
+
+# Words in at least this many products get a bitset and an impact-sorted
+# array; they lose them again below half of it
+DENSE = 1024
+# Result sets up to this size are scored in full instead of by threshold
+SCORE_ALL = 2048
+
+STOPWORDS = frozenset("a an and at by for from in of on or the to with".split())
+
+_WORD = re.compile(r"[^\W_]+")
+# ASCII punctuation -> space, so plain ASCII text can be split without a regex
+_ASCII_WORDS = str.maketrans({c: ' ' for c in map(chr, range(128)) if not c.isalnum()})
+
+# Impacts are stored at fixed precision so they pack into sortable int64
+# keys: (inverted impact << 32) | slot, best first
+_SCALE = 1 << 28
+_TOP = 1 << 31
+
+
+def _words(text):
+    """Lowercased, accent-folded words"""
+    text = text.lower()
+    if text.isascii():
+        return text.translate(_ASCII_WORDS).split()
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _WORD.findall(text)
+
+
+def _term(word):
+    """Index term for a folded word, or None for a stopword"""
+    if word in STOPWORDS:
+        return None
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+_TERMS = {}     # word -> _term(word), '' for stopwords
+
+
+def tokenize(text):
+    """Index terms for a piece of text, in order"""
+    terms, cache = [], _TERMS
+    for word in _words(text):
+        term = cache.get(word)
+        if term is None:
+            term = _term(word) or ''
+            if len(cache) < 1 << 17:
+                cache[word] = term
+        if term:
+            terms.append(term)
+    return terms
+
+
+def _field_text(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return ' '.join(v for v in value if isinstance(v, str))
+    if isinstance(value, dict):
+        return ' '.join(v for v in value.values() if isinstance(v, str))
+    return ''
+
+
+def _frequencies(product):
+    """({term: weighted frequency}, weighted length) for a product"""
+    weights, length = {}, 0.0
+    for field, weight in FIELDS.items():
+        for term in tokenize(_field_text(product.get(field))):
+            weights[term] = weights.get(term, 0.0) + weight
+            length += weight
+    return weights, length
+
+
+def _key(slot, impact):
+    return ((_TOP - round(impact * _SCALE)) << 32) | slot
+
+
+def _bit_test(bits, size):
+    """Membership test for a bitset, via a bytes copy (shifting big ints is O(n))"""
+    data = bits.to_bytes(max(size, bits.bit_length()) // 8 + 1, 'little')
+    return lambda slot: data[slot >> 3] >> (slot & 7) & 1
+
+
+def _decode(ranked, idf):
+    """(score, slot) pairs from a ranked array, best first"""
+    for key in ranked:
+        yield (_TOP - (key >> 32)) / _SCALE * idf, key & 0xFFFFFFFF
+
+
+def _rank(entry):
+    return (-entry[0], entry[1])
+
+
+def _top(entries, limit, after=None):
+    """Best `limit` (score, slot) pairs ranking after `after`, best first"""
+    if after is not None:
+        entries = (entry for entry in entries if _rank(entry) > _rank(after))
+    return heapq.nsmallest(limit, entries, key=_rank)
+
+
+class SearchIndex:
+    """Term -> {slot: impact}, with bitsets and ranked arrays for common terms"""
+
+    def __init__(self, products=()):
+        self.postings = {}      # term -> {slot: impact}
+        self.bits = {}          # dense term -> bitset of slots
+        self.ranked = {}        # dense term -> array of _key()s, best first
+        self.terms = []         # sorted vocabulary, for prefix lookups
+        self.count = 0
+        self.size = 0           # highest slot + 1
+        # Length normalisation is fixed when the index is built, so impacts
+        # (and the ranked arrays) never need recomputing as products change
+        entries = [(slot, *_frequencies(p)) for slot, p in products]
+        lengths = [length for _, _, length in entries if length]
+        self.avg_length = sum(lengths) / len(lengths) if lengths else None
+        for slot, weights, length in entries:
+            self._add(slot, weights, length, bulk=True)
+        self.terms = sorted(self.postings)
+        for term, posting in self.postings.items():
+            if len(posting) >= DENSE:
+                self._densify(term)
+
+    def __len__(self):
+        return self.count
+
+    def _densify(self, term):
+        posting = self.postings[term]
+        self.bits[term] = _mask(posting)
+        self.ranked[term] = array('q', sorted(_key(s, i) for s, i in posting.items()))
+
+    def add(self, slot, product):
+        self._add(slot, *_frequencies(product))
+
+    def _add(self, slot, weights, length, bulk=False):
+        if self.avg_length is None and length:
+            self.avg_length = length
+        self.count += 1
+        self.size = max(self.size, slot + 1)
+        norm = K1 * (1 - B + B * length / self.avg_length) if length else 0.0
+        for term, tf in weights.items():
+            impact = round(tf * (K1 + 1) / (tf + norm) * _SCALE) / _SCALE
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                if not bulk:
+                    bisect.insort(self.terms, term)
+            posting[slot] = impact
+            if bulk:
+                continue
+            if term in self.bits:
+                self.bits[term] |= 1 << slot
+                bisect.insort(self.ranked[term], _key(slot, impact))
+            elif len(posting) >= DENSE:
+                self._densify(term)
+
+    def remove(self, slot, product):
+        """Drop a product; pass the same version of it that was added"""
+        self.count -= 1
+        for term in _frequencies(product)[0]:
+            posting = self.postings[term]
+            impact = posting.pop(slot)
+            if term in self.bits:
+                if len(posting) < DENSE // 2:
+                    del self.bits[term], self.ranked[term]
+                else:
+                    self.bits[term] &= ~(1 << slot)
+                    ranked = self.ranked[term]
+                    del ranked[bisect.bisect_left(ranked, _key(slot, impact))]
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    # -- queries -------------------------------------------------------------
+
+    def _expand(self, term, prefix=False):
+        """[(indexed term, weight)] a query term matches"""
+        matches = [(term, 1.0)] if term in self.postings else []
+        if prefix and len(term) >= MIN_PREFIX:
+            i = bisect.bisect_right(self.terms, term)
+            end = bisect.bisect_left(self.terms, term + '\uffff', i)
+            matches += [(t, PREFIX_WEIGHT) for t in self.terms[i:min(end, i + MAX_EXPANSIONS)]]
+        return matches
+
+    def _idf(self, term):
+        n, df = self.count, len(self.postings[term])
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _matches(self, expansions):
+        """Products matching one query term: a set of slots, or a bitset if large"""
+        if any(term in self.bits for term, _ in expansions):
+            bits = 0
+            for term, _ in expansions:
+                bits |= self.bits[term] if term in self.bits else _mask(self.postings[term])
+            return bits
+        slots = set()
+        for term, _ in expansions:
+            slots.update(self.postings[term])
+        return slots
+
+    def _scorer(self, tokens):
+        """score(slot): per query term its best-scoring expansion, summed"""
+        weighted = [[(self.postings[t], w * self._idf(t)) for t, w in expansions]
+                    for expansions in tokens]
+
+        def score(slot):
+            total = 0.0
+            for expansions in weighted:
+                total += max([idf * posting[slot] for posting, idf in expansions if slot in posting],
+                             default=0.0)
+            return total
+        return score
+
+    def _score_all(self, tokens, slots):
+        """(score, slot) for every slot, each matching all the query terms"""
+        totals = dict.fromkeys(slots, 0.0)
+        for expansions in tokens:
+            if len(expansions) == 1:
+                posting, idf = self.postings[expansions[0][0]], expansions[0][1] * self._idf(expansions[0][0])
+                for slot in totals:
+                    totals[slot] += idf * posting[slot]
+                continue
+            best = {}
+            for term, weight in expansions:
+                posting, idf = self.postings[term], weight * self._idf(term)
+                for slot in totals.keys() & posting.keys():
+                    score = idf * posting[slot]
+                    if score > best.get(slot, 0.0):
+                        best[slot] = score
+            for slot, score in best.items():
+                totals[slot] += score
+        return [(score, slot) for slot, score in totals.items()]
+
+    def _stream(self, expansions):
+        """(score, slot) for one query term's matches, best first"""
+        streams = []
+        for term, weight in expansions:
+            idf = weight * self._idf(term)
+            if term in self.ranked:
+                streams.append(_decode(self.ranked[term], idf))
+            else:
+                streams.append(sorted(((impact * idf, slot)
+                                       for slot, impact in self.postings[term].items()), key=_rank))
+        return heapq.merge(*streams, key=_rank)
+
+    def search(self, query, allowed=None, limit=20, after=None):
+        """
+        Return (best matches, total matches, match).
+
+        Best matches are up to `limit` (score, slot) pairs, highest score
+        first (ties by slot), ranking after the `after` pair of a previous
+        page. `allowed` is an optional bitset the results must fall in (the
+        caller's other filters). match is "all" when the results have every
+        query term, "any" when none did and they have some of them, and
+        "none" when nothing matched at all.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        tokens = [self._expand(term, prefix=i == len(terms) - 1) for i, term in enumerate(terms)]
+        if not tokens or not all(tokens):
+            return self._search_any(tokens, allowed, limit, after)
+
+        # Intersect: walk the smallest slot set, or AND bitsets when all are large
+        matches = [self._matches(expansions) for expansions in tokens]
+        sets = sorted((m for m in matches if isinstance(m, set)), key=len)
+        bits = [m for m in matches if isinstance(m, int)]
+        if allowed is not None:
+            bits.append(allowed)
+        if sets:
+            tests = [_bit_test(b, self.size) for b in bits]
+            found = [slot for slot in sets[0]
+                     if all(slot in s for s in sets[1:]) and all(test(slot) for test in tests)]
+            total = len(found)
+        else:
+            result = bits[0]
+            for b in bits[1:]:
+                result &= b
+            total = result.bit_count()
+            found = _iter_bits(result) if total <= SCORE_ALL else None
+        if not total:
+            return self._search_any(tokens, allowed, limit, after)
+
+        if found is not None:
+            return _top(self._score_all(tokens, found), limit, after), total, "all"
+        score = self._scorer(tokens)
+
+        # Threshold algorithm: read every term's stream best first; a product
+        # not seen yet scores at most the sum of the streams' current scores
+        member = _bit_test(result, self.size)
+        frontier = [math.inf] * len(tokens)
+        positions = [-1] * len(tokens)
+        best, seen = [], set()     # heap of (score, -slot), worst first
+        for row in itertools.zip_longest(*[self._stream(expansions) for expansions in tokens]):
+            for i, entry in enumerate(row):
+                if entry is None:
+                    frontier[i], positions[i] = 0.0, -1
+                    continue
+                frontier[i], slot = entry
+                positions[i] = slot
+                if slot in seen or not member(slot):
+                    continue
+                seen.add(slot)
+                candidate = (score(slot), slot)
+                if after is not None and _rank(candidate) <= _rank(after):
+                    continue
+                if len(best) < limit:
+                    heapq.heappush(best, (candidate[0], -slot))
+                elif (candidate[0], -slot) > best[0]:
+                    heapq.heapreplace(best, (candidate[0], -slot))
+            if len(best) == limit:
+                # An unseen product scoring exactly the bound would come after
+                # every stream's current slot, so it can't beat a lower slot
+                bound, (worst, neg_slot) = sum(frontier), best[0]
+                if worst > bound or (worst == bound and -neg_slot <= max(positions)):
+                    break
+        return sorted(((s, -neg) for s, neg in best), key=_rank), total, "all"
+
+    def _search_any(self, tokens, allowed, limit, after):
+        """Rank products matching any query term (none matched them all)"""
+        totals = {}
+        for expansions in tokens:
+            best = {}
+            for term, weight in expansions:
+                idf = weight * self._idf(term)
+                for slot, impact in self.postings[term].items():
+                    if impact * idf > best.get(slot, 0.0):
+                        best[slot] = impact * idf
+            for slot, score in best.items():
+                totals[slot] = totals.get(slot, 0.0) + score
+        if allowed is not None:
+            test = _bit_test(allowed, self.size)
+            totals = {slot: score for slot, score in totals.items() if test(slot)}
+        ranked = ((score, slot) for slot, score in totals.items())
+        return _top(ranked, limit, after), len(totals), "any" if totals else "none"
@@ -0,0 +1,95 @@
+"""
+JSON serialization for UCP responses
+
+FastJSONProvider replaces Flask's stdlib encoder with orjson when it is
+installed (pip install orjson) and falls back to the stdlib otherwise.
+Output keeps Flask's conventions: sorted keys, compact separators outside
+debug mode, and the same handling of dates, decimals and UUIDs.
+
+ProductFragments keeps every product pre-encoded so catalog pages are
+assembled by joining bytes instead of re-encoding each product dict.
+"""
+
+import json
+import time
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+if orjson:
+    _OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+ENCODER = "orjson" if orjson else "json"
+
+
+def _default(obj):
+    return DefaultJSONProvider.default(obj)
+
+
+def dumps_bytes(obj):
+    """Compact, key-sorted JSON as bytes"""
+    if orjson:
+        try:
+            return orjson.dumps(obj, default=_default, option=_OPTIONS)
+        except (orjson.JSONEncodeError, TypeError):
+            pass  # e.g. integers wider than 64 bits; let the stdlib handle it
+    return json.dumps(obj, default=_default, sort_keys=True,
+                      separators=(',', ':')).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that prefers orjson"""
+
+    # Called with the seconds spent encoding each response body, when set
+    on_encode = None
+
+    def dumps(self, obj, **kwargs):
+        if orjson and not kwargs:
+            return dumps_bytes(obj).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.on_encode is None:
+            return self._app.response_class(dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+        started = time.perf_counter()
+        body = dumps_bytes(obj) + b"\n"
+        self.on_encode(time.perf_counter() - started)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class ProductFragments:
+    """Encoded JSON for each product, kept in sync with a Catalog"""
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+        self._fragments = {pid: dumps_bytes(p) for pid, p in catalog.products.items()}
+        catalog.on_change(self.refresh)
+
+    def refresh(self, product_id):
+        product = self._catalog.get(product_id)
+        if product:
+            self._fragments[product_id] = dumps_bytes(product)
+        else:
+            self._fragments.pop(product_id, None)
+
+    def get(self, product):
+        fragment = self._fragments.get(product['id'])
+        if fragment is None:
+            fragment = dumps_bytes(product)
+        return fragment
+
+    def array(self, products):
+        """Encoded JSON array of the given products"""
+        return b'[' + b','.join(self.get(p) for p in products) + b']'
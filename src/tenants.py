@@ -0,0 +1,259 @@
+"""
+Multi-tenant merchant hosting
+
+One worker pool can serve many small merchants. Each tenant has its own
+catalog (with its indexes, caches and pricing rules), order store, event
+streams, sales figures and discovery document. Tenants are listed in a JSON manifest
+(UCP_TENANTS_PATH):
+
+    {
+        "acme": {
+            "hosts": ["shop.acme.example"],
+            "base_url": "https://shop.acme.example",
+            "merchant": {"name": "Acme Books", "contact": "hello@acme.example"},
+            "catalog": "acme/catalog.json",
+            "pricing_rules": "acme/pricing.json"
+        }
+    }
+
+A request belongs to the tenant whose hosts include its Host header, or
+the tenant named by a path prefix: /t/acme/api/ucp/products is acme's
+/api/ucp/products. Everything else goes to the default merchant set up by
+the rest of config.py. Relative paths in the manifest are relative to it.
+
+A tenant's catalog side is built on its first request, and the least
+recently used tenants are dropped once more than max_loaded of them (or
+max_products products in all) are loaded, so memory follows the busy
+tenants rather than the number of tenants. Order stores, event hubs and
+sales figures hold data that can't be rebuilt from files, so they are kept.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from flask import g, has_app_context
+
+DEFAULT_TENANT = "default"
+TENANT_ID = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+# Tenant for work outside a request (job handlers, ASGI event streams)
+_current = contextvars.ContextVar('ucp_tenant', default=None)
+
+
+class TenantError(ValueError):
+    """Raised when the tenant manifest cannot be read or fails validation"""
+
+    def __init__(self, source, problems):
+        self.source = source
+        self.problems = problems
+        super().__init__(f"{source}: " + "; ".join(problems))
+
+
+def load_manifest(path):
+    """Read and validate a tenant manifest; returns {tenant id: spec}"""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise TenantError(path, [str(e)])
+    if not isinstance(manifest, dict):
+        raise TenantError(path, ["manifest must be a JSON object of tenant id -> settings"])
+
+    base = os.path.dirname(os.path.abspath(path))
+    problems, specs, hosts = [], {}, {}
+    for tenant_id, spec in manifest.items():
+        if not TENANT_ID.match(tenant_id) or tenant_id == DEFAULT_TENANT:
+            problems.append(f"{tenant_id!r}: ids are lowercase letters, digits, '-' and '_' "
+                            f"(and not {DEFAULT_TENANT!r})")
+            continue
+        if not isinstance(spec, dict) or not isinstance(spec.get('catalog'), str):
+            problems.append(f"{tenant_id}: needs a \"catalog\" file")
+            continue
+        tenant_hosts = [h.lower() for h in spec.get('hosts') or []]
+        for host in tenant_hosts:
+            if host in hosts:
+                problems.append(f"{tenant_id}: host {host} already belongs to {hosts[host]}")
+            hosts[host] = tenant_id
+        base_url = spec.get('base_url') or (f"https://{tenant_hosts[0]}" if tenant_hosts else None)
+        if not base_url:
+            problems.append(f"{tenant_id}: needs \"base_url\" or \"hosts\"")
+            continue
+        rules = spec.get('pricing_rules')
+        specs[tenant_id] = {
+            "hosts": tenant_hosts,
+            "base_url": base_url,
+            "merchant": dict(spec.get('merchant') or {"name": tenant_id}),
+            "catalog": os.path.join(base, spec['catalog']),
+            "pricing_rules": os.path.join(base, rules) if rules else None,
+        }
+    if problems:
+        raise TenantError(path, problems)
+    return specs
+
+
+def tenant_file(path, tenant_id):
+    """Per-tenant variant of a data file: orders.db -> orders-acme.db"""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{tenant_id}{ext}"
+
+
+def split_path(path, prefix):
+    """(tenant id, rest of path) for "<prefix>/<id>/...", else (None, path)"""
+    if not prefix or not path.startswith(prefix + '/'):
+        return None, path
+    tenant_id, _, rest = path[len(prefix) + 1:].partition('/')
+    return tenant_id or None, '/' + rest
+
+
+class Tenant:
+    """One merchant: its settings and the state built from them"""
+
+    def __init__(self, tenant_id, merchant, base_url, catalog, inventory, fragments,
+                 fulfillment, pricing, response_cache, orders, events, lifecycle,
+                 sales, catalog_path=None):
+        self.id = tenant_id
+        self.merchant = merchant
+        self.base_url = base_url.rstrip('/')
+        self.root = urlsplit(self.base_url).path   # "" or e.g. "/t/acme"
+        self.catalog = catalog
+        self.inventory = inventory
+        self.fragments = fragments
+        self.fulfillment = fulfillment
+        self.pricing = pricing
+        self.response_cache = response_cache
+        self.orders = orders
+        self.events = events
+        self.lifecycle = lifecycle
+        self.sales = sales
+        self.catalog_path = catalog_path
+
+
+class TenantRegistry:
+    """Tenants by id and host, loaded on demand and evicted least recently used first"""
+
+    def __init__(self, default, specs, loader, max_loaded=64, max_products=0):
+        self.default = default
+        self.specs = specs
+        self._loader = loader       # loader(tenant_id, spec) -> Tenant
+        self._hosts = {host: tenant_id for tenant_id, spec in specs.items() for host in spec['hosts']}
+        self.max_loaded = max_loaded
+        self.max_products = max_products
+        self._loaded = OrderedDict()    # tenant id -> Tenant, least recently used first
+        self._loading = {}              # tenant id -> lock held while it loads
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def for_host(self, host):
+        """Tenant id for a Host header, or None"""
+        if not host or not self._hosts:
+            return None
+        host = host.lower()
+        if ':' in host and not host.endswith(']'):
+            host = host.rsplit(':', 1)[0]     # drop the port
+        return self._hosts.get(host)
+
+    def get(self, tenant_id):
+        """The tenant, loading it if needed; the default for None, None if unknown"""
+        if tenant_id is None or tenant_id == DEFAULT_TENANT:
+            return self.default
+        with self._lock:
+            tenant = self._loaded.get(tenant_id)
+            if tenant is not None:
+                self._loaded.move_to_end(tenant_id)
+                return tenant
+            if tenant_id not in self.specs:
+                return None
+            lock = self._loading.setdefault(tenant_id, threading.Lock())
+
+        # Load outside the registry lock; requests for the same tenant wait here
+        with lock:
+            with self._lock:
+                tenant = self._loaded.get(tenant_id)
+            if tenant is not None:
+                return tenant
+            try:
+                tenant = self._loader(tenant_id, self.specs[tenant_id])
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(tenant_id, None)
+                raise
+            with self._lock:
+                self._loading.pop(tenant_id, None)
+                self._loaded[tenant_id] = tenant
+                self.loads += 1
+                self._evict(tenant_id)
+        return tenant
+
+    def _evict(self, keep):
+        products = sum(len(t.catalog.products) for t in self._loaded.values())
+        while len(self._loaded) > 1:
+            over_count = len(self._loaded) > self.max_loaded
+            over_products = self.max_products and products > self.max_products
+            if not (over_count or over_products):
+                break
+            tenant_id = next(iter(self._loaded))
+            if tenant_id == keep:
+                self._loaded.move_to_end(keep)
+                continue
+            products -= len(self._loaded.pop(tenant_id).catalog.products)
+            self.evictions += 1
+
+    def current(self):
+        """The tenant being served: the request's, else the one in use(), else the default"""
+        if has_app_context():
+            tenant = g.get('tenant')
+            if tenant is not None:
+                return tenant
+        return _current.get() or self.default
+
+    @contextlib.contextmanager
+    def use(self, tenant):
+        """Make `tenant` current outside a request"""
+        token = _current.set(tenant)
+        try:
+            yield tenant
+        finally:
+            _current.reset(token)
+
+    def loaded(self):
+        with self._lock:
+            return [self.default] + list(self._loaded.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "configured": len(self.specs),
+                "loaded": len(self._loaded),
+                "products_loaded": sum(len(t.catalog.products) for t in self._loaded.values()),
+                "max_loaded": self.max_loaded,
+                "max_products": self.max_products,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+class TenantPathMiddleware:
+    """
+    WSGI middleware for path-prefixed tenants: /t/acme/api/ucp/... reaches
+    the app as /api/ucp/... with SCRIPT_NAME /t/acme and the tenant id in
+    environ['ucp.tenant'].
+    """
+
+    def __init__(self, app, prefix='/t'):
+        self.app = app
+        self.prefix = prefix.rstrip('/')
+
+    def __call__(self, environ, start_response):
+        tenant_id, path = split_path(environ.get('PATH_INFO', ''), self.prefix)
+        if tenant_id:
+            environ['PATH_INFO'] = path
+            environ['SCRIPT_NAME'] = f"{environ.get('SCRIPT_NAME', '')}{self.prefix}/{tenant_id}"
+            environ['ucp.tenant'] = tenant_id
+        return self.app(environ, start_response)
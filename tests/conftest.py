@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app runs from src/ with flat imports (python app.py, gunicorn --chdir src)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
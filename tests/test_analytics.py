@@ -0,0 +1,140 @@
+import pytest
+
+from analytics import HyperLogLog, SalesStats, SlidingHyperLogLog, buyer_key
+
+PRODUCTS = {
+    "paperback": {"type": "physical"},
+    "kindle": {"type": "digital"},
+}
+
+
+class Clock:
+    def __init__(self, now=1_000_000 * 60):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def order(lines, total=None, email=None, agent=None):
+    """lines: (product id, quantity, line total)"""
+    return {
+        "line_items": [{"product_id": p, "quantity": q, "total": t} for p, q, t in lines],
+        "totals": {"total": sum(t for _, _, t in lines) if total is None else total, "currency": "USD"},
+        "buyer": {"email": email} if email else {},
+        "agent": agent,
+    }
+
+
+@pytest.mark.parametrize("n", [0, 10, 1000, 50000])
+def test_hyperloglog_error(n):
+    hll = HyperLogLog(11)
+    for i in range(n):
+        hll.add(f"buyer-{i}")
+        hll.add(f"buyer-{i}")   # duplicates don't count
+    assert abs(hll.estimate() - n) <= max(1, 0.05 * n)
+
+
+def test_sliding_hyperloglog_windows():
+    hll = SlidingHyperLogLog(11, horizon=60)
+    for minute in range(60):
+        for i in range(100):
+            hll.add(f"m{minute}-{i}", minute)
+    assert abs(hll.estimate(0) - 6000) <= 300
+    assert abs(hll.estimate(45) - 1500) <= 75
+    assert hll.estimate(60) == 0
+    # Seen again recently: counted in the recent window
+    for i in range(100):
+        hll.add(f"m0-{i}", 59)
+    assert abs(hll.estimate(59) - 200) <= 10
+
+
+def test_buyer_key():
+    assert buyer_key({"buyer": {"email": " Ann@Example.com "}}) == "email:ann@example.com"
+    assert buyer_key({"buyer": {}, "agent": "bot/1"}) == "agent:bot/1"
+    assert buyer_key({"buyer": "odd"}) is None
+
+
+def test_totals_in_minor_units():
+    stats = SalesStats(clock=Clock())
+    for _ in range(3):
+        stats.record(order([("paperback", 1, 18.74), ("kindle", 2, 19.98)], email="a@x"), PRODUCTS)
+    report = stats.report()
+    assert report["orders"] == 3 and report["items"] == 9
+    assert report["revenue"] == 116.16       # 3 x 38.72, no float drift
+    assert report["average_order"] == 38.72
+    assert report["buyers"] == 1
+    assert report["by_type"] == {
+        "physical": {"quantity": 3, "orders": 3, "revenue": 56.22},
+        "digital": {"quantity": 6, "orders": 3, "revenue": 59.94},
+    }
+
+
+def test_order_counted_once_per_product():
+    stats = SalesStats(clock=Clock())
+    stats.record(order([("kindle", 1, 9.99), ("kindle", 1, 9.99)]), PRODUCTS)
+    assert stats.report()["products"] == [
+        {"product_id": "kindle", "quantity": 2, "orders": 1, "revenue": 19.98}]
+
+
+def test_window_drops_old_minutes():
+    clock = Clock()
+    stats = SalesStats(windows=(15, 60), clock=clock)
+    stats.record(order([("paperback", 1, 18.74)], email="old@x"), PRODUCTS)
+    clock.now += 10 * 60
+    stats.record(order([("kindle", 1, 9.99)], email="new@x"), PRODUCTS)
+
+    report = stats.report(15)
+    assert report["orders"] == 2 and report["buyers"] == 2
+
+    clock.now += 6 * 60     # the first order's minute is now 16 minutes old
+    report = stats.report(15)
+    assert report["orders"] == 1 and report["revenue"] == 9.99 and report["buyers"] == 1
+    assert [p["product_id"] for p in report["products"]] == ["kindle"]
+    assert list(report["by_type"]) == ["digital"]
+    assert stats.report(60)["orders"] == 2
+
+    clock.now += 60 * 60
+    for minutes in (15, 60):
+        report = stats.report(minutes)
+        assert report["orders"] == 0 and report["products"] == [] and report["buyers"] == 0
+    assert stats.report()["orders"] == 2   # since start never forgets
+
+
+def test_window_matches_recount():
+    """Running window totals equal a recount of the orders inside the window"""
+    clock = Clock()
+    stats = SalesStats(windows=(15,), clock=clock)
+    history = []
+    for step in range(200):
+        clock.now += 23
+        quantity = 1 + step % 3
+        stats.record(order([("kindle", quantity, 9.99 * quantity)]), PRODUCTS)
+        history.append((int(clock.now // 60), quantity))
+        minute = int(clock.now // 60)
+        inside = [q for m, q in history if m > minute - 15]
+        report = stats.report(15)
+        assert report["orders"] == len(inside)
+        assert report["items"] == sum(inside)
+
+
+def test_per_minute_rows():
+    clock = Clock()
+    stats = SalesStats(windows=(15,), clock=clock)
+    stats.record(order([("kindle", 1, 9.99)]), PRODUCTS)
+    stats.record(order([("kindle", 1, 9.99)]), PRODUCTS)
+    clock.now += 120
+    stats.record(order([("paperback", 1, 18.74)]), PRODUCTS)
+    rows = stats.report(15, per_minute=True)["per_minute"]
+    assert [(r["orders"], r["revenue"]) for r in rows] == [(2, 19.98), (1, 18.74)]
+    assert "per_minute" not in stats.report(per_minute=True)
+
+
+def test_best_sellers_limit_and_order():
+    stats = SalesStats(clock=Clock())
+    for n in range(20):
+        stats.record(order([(f"p{n:02d}", 1 + n % 4, 1.0)]), PRODUCTS)
+    report = stats.report(limit=5)
+    assert report["products_sold"] == 20
+    assert [p["product_id"] for p in report["products"]] == ["p03", "p07", "p11", "p15", "p19"]
+    assert [p["quantity"] for p in stats.report(limit=100)["products"]][:6] == [4, 4, 4, 4, 4, 3]
@@ -0,0 +1,258 @@
+import copy
+import json
+import time
+
+import pytest
+
+import order_records
+import orders
+from orders import LogOrderStore, MemoryOrderStore, SQLiteOrderStore, make_order_store
+
+SAMPLE = {
+    "order_id": "ORD_F39335E6688E",
+    "status": "completed",
+    "sandbox": True,
+    "created_at": "2026-10-18T13:30:00.397097Z",
+    "buyer": {"email": "A@x.com", "name": "A"},
+    "line_items": [
+        {"product_id": "pudding-heroes-paperback", "product_name": "Pudding Heroes (Paperback)",
+         "quantity": 2, "unit_price": 18.74, "total": 37.48},
+        {"product_id": "pudding-theory-pdf", "product_name": "Pudding Theory",
+         "quantity": 1, "unit_price": 0, "total": 0},
+    ],
+    "totals": {"subtotal": 37.48, "discount": 5, "tax": 2.11, "shipping": 6.49,
+               "total": 41.08, "currency": "USD", "promo_code": "BOOKS5"},
+    "payment": {"token": "sandbox_default", "status": "sandbox_success",
+                "note": "No actual charge - sandbox mode"},
+    "fulfillment": [
+        {"product_id": "pudding-heroes-paperback", "type": "shipping", "carrier": "USPS",
+         "tracking_number": "SANDBOX_F43F7373", "status": "sandbox_shipped"},
+        {"product_id": "pudding-theory-pdf", "type": "instant_download",
+         "download_url": "https://puddingheroes.com/downloads/pudding-theory.pdf",
+         "status": "delivered"},
+    ],
+}
+
+
+def make_order(n, status="completed", email=None, created_at=None):
+    order = copy.deepcopy(SAMPLE)
+    order["order_id"] = f"ORD_{n:06d}"
+    order["status"] = status
+    order["created_at"] = created_at or f"2026-10-{1 + n % 28:02d}T12:00:00Z"
+    order["buyer"]["email"] = email or f"buyer{n}@example.com"
+    return order
+
+
+# ============================================================================
+# ORDER RECORDS
+# ============================================================================
+
+def test_pack_round_trip():
+    record = order_records.pack(SAMPLE)
+    assert record.unpack() == SAMPLE
+    assert json.dumps(record.unpack(), sort_keys=True) == json.dumps(SAMPLE, sort_keys=True)
+
+
+def test_pack_shares_product_refs():
+    a = order_records.pack(make_order(1))
+    b = order_records.pack(make_order(2))
+    assert a.line_items[0].product is b.line_items[0].product
+
+
+@pytest.mark.parametrize("order", [
+    {"order_id": "ORD_1"},
+    {"order_id": "ORD_2", "status": "on_hold", "buyer": None, "line_items": "odd",
+     "payment": {"token": "t", "status": "sandbox_success"}},
+    {"order_id": "ORD_3", "buyer": {"email": "x@y.z", "favourite_colour": "teal"},
+     "line_items": [{"product_id": "p", "gift_wrap": True}],
+     "fulfillment": [{"type": "carrier_pigeon", "status": "flying", "bird": "Kevin"}],
+     "totals": {"total": 1}, "unexpected": [1, 2]},
+])
+def test_pack_round_trip_unusual_orders(order):
+    assert order_records.pack(order).unpack() == order
+
+
+# ============================================================================
+# STORES
+# ============================================================================
+
+@pytest.fixture(params=['memory', 'sqlite', 'log'])
+def store(request, tmp_path):
+    path = str(tmp_path / f"orders.{request.param}")
+    store = make_order_store(request.param, path, batch_ms=0)
+    yield store
+    store.close()
+
+
+def test_put_get_round_trip(store):
+    store.put(SAMPLE)
+    assert store.get(SAMPLE["order_id"]) == SAMPLE
+    assert store.get("ORD_MISSING") is None
+    assert store.count() == 1
+
+
+def test_update_keeps_count_and_position(store):
+    store.put_many([make_order(n) for n in range(5)])
+    updated = make_order(2, status="processing")
+    store.put(updated)
+    assert store.count() == 5
+    assert store.get("ORD_000002")["status"] == "processing"
+    page, _, _ = store.page(limit=10)
+    assert [o["order_id"] for o in page] == [f"ORD_{n:06d}" for n in range(5)]
+
+
+def test_page_walks_back_through_every_order(store):
+    store.put_many([make_order(n) for n in range(23)])
+    seen = []
+    page, before, after = store.page(limit=5)
+    newest_after = after
+    while True:
+        ids = [o["order_id"] for o in page]
+        assert ids == sorted(ids)   # oldest first within a page
+        seen = ids + seen
+        if before is None:
+            break
+        page, before, _ = store.page(limit=5, before=before)
+    assert seen == [f"ORD_{n:06d}" for n in range(23)]
+
+    # Polling from the newest page's after cursor only returns new orders
+    page, _, after = store.page(limit=5, after=newest_after)
+    assert page == [] and after == newest_after
+    store.put_many([make_order(n) for n in range(23, 26)])
+    page, _, after = store.page(limit=5, after=newest_after)
+    assert [o["order_id"] for o in page] == ["ORD_000023", "ORD_000024", "ORD_000025"]
+    assert store.page(limit=5, after=after)[0] == []
+
+
+def test_page_filters(store):
+    store.put_many([
+        make_order(1, status="completed", email="Ann@example.com", created_at="2026-01-05T10:00:00Z"),
+        make_order(2, status="processing", email="bob@example.com", created_at="2026-01-06T10:00:00Z"),
+        make_order(3, status="completed", email="ann@example.com", created_at="2026-01-07T10:00:00Z"),
+        make_order(4, status="completed", email="bob@example.com", created_at="2026-01-08T10:00:00Z"),
+    ])
+
+    def ids(**filters):
+        return [o["order_id"][-1] for o in store.page(limit=10, **filters)[0]]
+
+    assert ids(status="completed") == ["1", "3", "4"]
+    assert ids(email="ANN@example.com") == ["1", "3"]
+    assert ids(created_from="2026-01-06", created_to="2026-01-07") == ["2", "3"]
+    assert ids(status="completed", email="bob@example.com") == ["4"]
+
+
+def test_filtered_pages_follow_status_changes(store):
+    store.put_many([make_order(n, status="processing") for n in range(3)])
+    store.put(make_order(1, status="completed"))
+    assert [o["order_id"] for o in store.page(status="processing")[0]] == ["ORD_000000", "ORD_000002"]
+    assert [o["order_id"] for o in store.page(status="completed")[0]] == ["ORD_000001"]
+
+
+@pytest.mark.parametrize("kind", ['sqlite', 'log'])
+def test_persistent_stores_reopen(kind, tmp_path):
+    path = str(tmp_path / "orders")
+    store = make_order_store(kind, path, batch_ms=0)
+    store.put_many([make_order(n) for n in range(4)])
+    _, before, _ = store.page(limit=2)
+    store.close()
+
+    reopened = make_order_store(kind, path, batch_ms=0)
+    assert reopened.count() == 4
+    assert reopened.get("ORD_000003") == make_order(3)
+    # Cursors handed out before the restart still work
+    assert [o["order_id"] for o in reopened.page(limit=2, before=before)[0]] == ["ORD_000000", "ORD_000001"]
+    reopened.close()
+
+
+def test_sqlite_count_survives_upserts_and_deletes(tmp_path):
+    path = str(tmp_path / "orders.db")
+    store = SQLiteOrderStore(path, batch_ms=0)
+    store.put_many([make_order(n) for n in range(10)])
+    store.put_many([make_order(n, status="processing") for n in range(5)])
+    assert store.count() == 10
+    store._reader().execute("DELETE FROM orders WHERE order_id = 'ORD_000000'")
+    assert store.count() == 9
+    assert SQLiteOrderStore(path).count() == 9
+
+
+def test_sqlite_count_migrates_old_databases(tmp_path):
+    path = str(tmp_path / "orders.db")
+    store = SQLiteOrderStore(path, batch_ms=0)
+    store.put_many([make_order(n) for n in range(3)])
+    conn = store._reader()
+    conn.execute("DROP TRIGGER order_count_insert")
+    conn.execute("DROP TRIGGER order_count_delete")
+    conn.execute("DROP TABLE order_count")
+    assert SQLiteOrderStore(path).count() == 3
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryOrderStore(max_entries=3)
+    store.put_many([make_order(n) for n in range(3)])
+    store.get("ORD_000000")     # now the most recently used
+    store.put(make_order(3))
+    assert store.get("ORD_000001") is None
+    assert store.get("ORD_000000") is not None
+    assert store.count() == 3
+    assert store.stats()["evictions"]["capacity"] == 1
+
+
+def test_memory_store_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(orders.time, 'monotonic', lambda: now[0])
+    store = MemoryOrderStore(ttl=60, test_ttl=5)
+    store.put(make_order(1))
+    store.put(dict(make_order(2), order_id="TEST_2"))
+    now[0] += 10
+    assert store.get("TEST_2") is None
+    assert store.get("ORD_000001") is not None
+    now[0] += 60
+    assert store.page()[0] == []
+    assert store.count() == 0
+    assert store.stats()["evictions"]["ttl"] == 2
+
+
+def test_log_store_expires_by_created_at(tmp_path):
+    path = str(tmp_path / "orders.log")
+    now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    store = LogOrderStore(path, ttl=3600)
+    store.put(make_order(1, created_at="2020-01-01T00:00:00Z"))
+    store.put(make_order(2, created_at=now))
+    assert store.get("ORD_000001") is None
+    assert store.get("ORD_000002") is not None
+    assert store.count() == 1
+    # Old lines stay expired when the file is indexed again
+    assert LogOrderStore(path, ttl=3600).count() == 1
+
+
+def test_log_store_compaction_keeps_orders_and_cursors(tmp_path, monkeypatch):
+    monkeypatch.setattr(LogOrderStore, 'COMPACT_MIN_BYTES', 0)
+    path = str(tmp_path / "orders.log")
+    store = LogOrderStore(path, compact_seconds=3600)
+    other = LogOrderStore(path, compact_seconds=3600)   # another worker on the same file
+    store.put_many([make_order(n) for n in range(6)])
+    for _ in range(3):
+        store.put_many([make_order(n, status="processing") for n in range(6)])
+    _, before, after = store.page(limit=3)
+
+    store.compact_seconds = 0
+    store._next_compact = 0
+    store.put(make_order(6))
+    assert store.compactions == 1
+    assert store.stats()["file_bytes"] < 2 * store.stats()["live_bytes"] + 100
+
+    for reader in (store, other, LogOrderStore(path)):
+        assert reader.count() == 7
+        assert reader.get("ORD_000004")["status"] == "processing"
+        assert [o["order_id"] for o in reader.page(limit=3, before=before)[0]] == \
+            ["ORD_000000", "ORD_000001", "ORD_000002"]
+        assert [o["order_id"] for o in reader.page(limit=10, after=after)[0]] == ["ORD_000006"]
+
+    # The worker that didn't compact keeps appending to the new file
+    other.put(make_order(7))
+    assert store.get("ORD_000007") == make_order(7)
+
+
+def test_unknown_store_kind():
+    with pytest.raises(ValueError):
+        make_order_store('redis')
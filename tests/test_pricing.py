@@ -0,0 +1,157 @@
+import pytest
+
+from pricing import PricingEngine, PricingRulesError, compile_rules, from_minor, load_rules, to_minor
+
+RULES = {
+    "currency": "USD",
+    "tax": {"US-CA": 7.25, "US-WA": {"*": 6.5, "subscription": 0}, "US": 5},
+    "shipping": {"physical": {"first": 4.99, "additional": 1.50}},
+    "free_shipping_over": 35,
+    "promos": {
+        "SANDBOX10": {"percent": 10},
+        "BOOKS5": {"amount": 5, "min_subtotal": 20, "types": ["physical"]},
+        "DIGI": {"percent": 50, "types": "digital"},
+        "FREESHIP": {"free_shipping": True},
+    },
+}
+
+PRODUCTS = {
+    "paperback": {"id": "paperback", "name": "Paperback", "price": 18.74, "type": "physical"},
+    "kindle": {"id": "kindle", "name": "Kindle", "price": 9.99, "type": "digital"},
+    "member": {"id": "member", "name": "Membership", "price": 9.99, "type": "subscription"},
+    "yen": {"id": "yen", "name": "Yen", "price": 500, "type": "digital", "currency": "JPY"},
+}
+
+
+class FakeCatalog:
+    def __init__(self, products):
+        self.products = products
+
+    def get(self, product_id):
+        return self.products.get(product_id)
+
+    def on_change(self, callback):
+        self.callback = callback
+
+
+@pytest.fixture
+def engine():
+    return PricingEngine(FakeCatalog(dict(PRODUCTS)), RULES)
+
+
+def quote(engine, items, **kwargs):
+    items = [{"product_id": p, "quantity": q} for p, q in items]
+    return engine.quote(items, engine._catalog.products, **kwargs)
+
+
+@pytest.mark.parametrize("amount, currency, minor", [
+    (18.74, "USD", 1874), ("0.1", "USD", 10), (0.005, "USD", 1), (500, "JPY", 500),
+    (1.2345, "KWD", 1235), (0, "USD", 0),
+])
+def test_minor_units(amount, currency, minor):
+    assert to_minor(amount, currency) == minor
+
+
+def test_from_minor():
+    assert from_minor(5622) == 56.22
+    assert from_minor(500) == 5 and isinstance(from_minor(500), int)
+    assert from_minor(500, "JPY") == 500
+
+
+def test_totals_exact_to_the_cent(engine):
+    result, error = quote(engine, [("paperback", 3)])
+    assert error is None
+    totals = result["totals"]
+    assert totals["subtotal"] == 56.22      # not 56.220000000000006
+    assert totals["shipping"] == 0          # free over 35
+    assert totals["total"] == 56.22
+    assert result["line_items"][0]["total"] == 56.22
+
+
+def test_shipping_first_and_additional(engine):
+    totals = quote(engine, [("paperback", 1)])[0]["totals"]
+    assert totals["shipping"] == 4.99 and totals["total"] == 23.73
+    totals = quote(engine, [("paperback", 1), ("kindle", 1)])[0]["totals"]
+    assert totals["shipping"] == 4.99       # digital items don't ship
+
+
+def test_tax_by_region_and_type(engine):
+    address = {"country": "us", "region": "wa"}
+    totals = quote(engine, [("kindle", 1), ("member", 1)], address=address)[0]["totals"]
+    assert totals["tax"] == 0.65            # 6.5% of 9.99, subscriptions exempt
+    totals = quote(engine, [("kindle", 1)], address={"country": "US", "region": "NY"})[0]["totals"]
+    assert totals["tax"] == 0.5             # falls back to the country rate
+    totals = quote(engine, [("kindle", 1)], address={"country": "FR"})[0]["totals"]
+    assert totals["tax"] == 0
+    assert quote(engine, [("kindle", 1)], address="US")[1]["error"]
+
+
+def test_percent_promo_taxes_discounted_amount(engine):
+    totals = quote(engine, [("kindle", 2)], promo_code="sandbox10",
+                   address={"country": "US", "region": "CA"})[0]["totals"]
+    assert totals["discount"] == 2
+    assert totals["tax"] == 1.3             # 7.25% of 17.98
+    assert totals["total"] == 19.28
+    assert totals["promo_code"] == "SANDBOX10"
+
+
+def test_type_limited_promo_minimum_counts_eligible_items(engine):
+    result, error = quote(engine, [("paperback", 1), ("kindle", 2)], promo_code="BOOKS5")
+    assert result is None and "physical" in error["error"]
+    totals = quote(engine, [("paperback", 2)], promo_code="BOOKS5")[0]["totals"]
+    assert totals["discount"] == 5 and totals["total"] == 38.97
+
+
+def test_promo_types_given_as_a_string(engine):
+    totals = quote(engine, [("kindle", 1), ("member", 1)], promo_code="DIGI")[0]["totals"]
+    assert totals["discount"] == 5          # half of the kindle only, rounded half up
+    assert compile_rules({"promos": {"X": {"types": "digital"}}})[4]["X"][3] == frozenset({"digital"})
+
+
+def test_free_shipping_promo(engine):
+    totals = quote(engine, [("paperback", 1)], promo_code="FREESHIP")[0]["totals"]
+    assert totals["shipping"] == 0 and totals["total"] == 18.74
+
+
+def test_quote_errors(engine):
+    assert "available_promo_codes" in quote(engine, [("kindle", 1)], promo_code="NOPE")[1]
+    assert "available_products" in quote(engine, [("missing", 1)])[1]
+    assert quote(engine, [("kindle", 0)])[1]["error"].startswith("Invalid quantity")
+    assert quote(engine, [("kindle", True)])[1]["error"].startswith("Invalid quantity")
+    assert "priced in JPY" in quote(engine, [("yen", 1)])[1]["error"]
+
+
+def test_catalog_changes_reprice(engine):
+    catalog = engine._catalog
+    catalog.products["kindle"] = dict(PRODUCTS["kindle"], price=4.5)
+    catalog.callback("kindle")
+    assert quote(engine, [("kindle", 1)])[0]["totals"]["total"] == 4.5
+    del catalog.products["kindle"]
+    catalog.callback("kindle")
+    assert "kindle" not in engine._entries
+
+
+@pytest.mark.parametrize("rules, problem", [
+    ({"tax": {"US": 101}}, "tax.US.*"),
+    ({"shipping": {"physical": {"first": -1}}}, "shipping.physical.first"),
+    ({"free_shipping_over": "lots"}, "free_shipping_over"),
+    ({"promos": {"X": 10}}, "promos.X"),
+    ({"promos": {"X": {"percent": True}}}, "promos.X.percent"),
+    ({"promos": {"X": {"types": 5}}}, "promos.X.types"),
+    ({"promos": {"X": {"types": ["physical", 1]}}}, "promos.X.types"),
+])
+def test_invalid_rules(rules, problem):
+    with pytest.raises(PricingRulesError) as e:
+        compile_rules(rules)
+    assert any(p.startswith(problem) for p in e.value.problems)
+
+
+def test_load_rules(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text('{"currency": "EUR"}')
+    assert load_rules(str(path)) == {"currency": "EUR"}
+    path.write_text('[1, 2]')
+    with pytest.raises(PricingRulesError):
+        load_rules(str(path))
+    with pytest.raises(PricingRulesError):
+        load_rules(str(tmp_path / "missing.json"))
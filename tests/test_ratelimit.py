@@ -0,0 +1,137 @@
+import threading
+
+import pytest
+
+import ratelimit
+from ratelimit import ConcurrencyLimit, MemoryBuckets, RateLimiter, SQLiteBuckets, make_buckets
+
+
+class FakeClock:
+    """Stands in for the time module inside ratelimit"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def buckets(request, tmp_path, clock):
+    return make_buckets(request.param, str(tmp_path / "ratelimit.db"))
+
+
+def test_bucket_allows_burst_then_refills(buckets, clock):
+    results = [buckets.take("k", rate=2, burst=3)[0] for _ in range(4)]
+    assert results == [True, True, True, False]
+    allowed, tokens, wait = buckets.take("k", rate=2, burst=3)
+    assert not allowed and wait == pytest.approx(0.5)
+    clock.now += 0.5
+    assert buckets.take("k", rate=2, burst=3)[0]
+    # Refill stops at the burst
+    clock.now += 100
+    assert [buckets.take("k", rate=2, burst=3)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_cost(buckets, clock):
+    assert buckets.take("k", rate=1, burst=5, cost=4)[0]
+    allowed, tokens, wait = buckets.take("k", rate=1, burst=5, cost=4)
+    assert not allowed and tokens == pytest.approx(1) and wait == pytest.approx(3)
+    clock.now += 3
+    assert buckets.take("k", rate=1, burst=5, cost=4)[0]
+
+
+def test_buckets_are_per_key(buckets):
+    assert buckets.take("a", rate=1, burst=1)[0]
+    assert not buckets.take("a", rate=1, burst=1)[0]
+    assert buckets.take("b", rate=1, burst=1)[0]
+    assert len(buckets) == 2
+
+
+def test_sqlite_buckets_shared_between_instances(tmp_path, clock):
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+    assert first.take("k", rate=1, burst=2)[0]
+    assert second.take("k", rate=1, burst=2)[0]
+    assert not first.take("k", rate=1, burst=2)[0]
+
+
+def test_memory_buckets_capped(clock):
+    buckets = MemoryBuckets(stripes=4, max_keys=100)
+    for n in range(10000):
+        buckets.take(f"client{n}", rate=1, burst=1)
+    assert len(buckets) <= 100
+
+
+def test_memory_buckets_evict_least_recently_used(clock):
+    buckets = MemoryBuckets(stripes=1, max_keys=2)
+    buckets.take("a", rate=1, burst=1)
+    buckets.take("b", rate=1, burst=1)
+    buckets.take("a", rate=1, burst=1)     # "a" is empty and now the most recent
+    buckets.take("c", rate=1, burst=1)     # evicts "b"
+    assert not buckets.take("a", rate=0.001, burst=1)[0]
+
+
+def test_memory_buckets_drop_idle(clock):
+    buckets = MemoryBuckets(stripes=1)
+    buckets.take("a", rate=1, burst=1)
+    clock.now += ratelimit.IDLE_SECONDS + 1
+    buckets.take("b", rate=1, burst=1)
+    assert len(buckets) == 1
+
+
+def test_rate_limiter(clock):
+    limiter = RateLimiter({"checkout": (0.5, 2), "catalog": None})
+    assert limiter.check("checkout", "1.2.3.4") is None
+    assert limiter.check("checkout", "1.2.3.4") is None
+    assert limiter.check("checkout", "1.2.3.4") == 2     # whole seconds until the next token
+    assert limiter.check("checkout", "5.6.7.8") is None
+    assert limiter.check("catalog", "1.2.3.4") is None
+    assert limiter.check("unknown", "1.2.3.4") is None
+    stats = limiter.stats()
+    assert stats["allowed"] == {"checkout": 3} and stats["limited"] == {"checkout": 1}
+
+
+def test_rate_limiter_cost_over_burst(clock):
+    limiter = RateLimiter({"checkout": (1, 10)})
+    assert limiter.max_cost("checkout") == 10
+    assert limiter.max_cost("catalog") is None
+    assert limiter.check("checkout", "c", cost=10) is None
+    with pytest.raises(ValueError):
+        limiter.check("checkout", "c", cost=11)
+
+
+def test_concurrency_limit():
+    limit = ConcurrencyLimit(2)
+    assert limit.acquire() and limit.acquire()
+    assert not limit.acquire()
+    limit.release()
+    assert limit.acquire()
+    assert limit.stats() == {"limit": 2, "in_flight": 2, "rejected": 1}
+    assert all(ConcurrencyLimit(0).acquire() for _ in range(100))
+
+
+def test_memory_buckets_threads(clock):
+    buckets = MemoryBuckets()
+    allowed = []
+
+    def worker():
+        for _ in range(100):
+            allowed.append(buckets.take("shared", rate=1, burst=50)[0])
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert allowed.count(True) == 50